@@ -1,8 +1,12 @@
+from typing import List
 from unittest import TestCase
 
+import numpy as np
+
 from test.utils import demo_picture_parameters
-from text_depixelizer.HMM.clusterer import KmeansClusterer
+from text_depixelizer.HMM.clusterer import KmeansClusterer, BisectingClusterer
 from text_depixelizer.training_pipeline.training_pipeline import create_training_data
+from text_depixelizer.training_pipeline.windows import Window
 
 
 class TestKmeansClusterer(TestCase):
@@ -16,3 +20,39 @@ class TestKmeansClusterer(TestCase):
 
         # Assert
         self.assertEqual(kmeans_clusterer.kmeans.n_clusters, 5)
+
+
+class TestBisectingClusterer(TestCase):
+
+    windows: List[Window] = [window for image_windows in create_training_data(n_img=3, picture_parameters=demo_picture_parameters)[3]
+                             for window in image_windows]
+
+    def test_fit(self):
+        # Act
+        clusterer: BisectingClusterer = BisectingClusterer(self.windows, k=8, random_state=0)
+        k_values: np.ndarray = clusterer.map_values_to_cluster([window.values for window in self.windows])
+
+        # Assert: Every cluster is used
+        self.assertEqual(clusterer.k, 8)
+        self.assertEqual(clusterer.centroids.shape, (8, len(self.windows[0].values)))
+        self.assertCountEqual(set(k_values), range(8))
+
+    def test_cut(self):
+        # Arrange
+        clusterer: BisectingClusterer = BisectingClusterer(self.windows, k=8, random_state=0)
+        values: List[np.ndarray] = [window.values for window in self.windows]
+
+        # Act
+        cut: BisectingClusterer = clusterer.cut(4)
+
+        # Assert: Same clusters as fitting 4 clusters, the tree itself isn't changed
+        np.testing.assert_array_equal(cut.map_values_to_cluster(values),
+                                      BisectingClusterer(self.windows, k=4, random_state=0).map_values_to_cluster(values))
+        self.assertEqual(clusterer.k, 8)
+        with self.assertRaises(ValueError):
+            clusterer.cut(9)
+
+    def test_too_few_windows(self):
+        # Act & Assert
+        with self.assertRaises(ValueError):
+            BisectingClusterer(self.windows[:3], k=4)
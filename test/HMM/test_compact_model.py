@@ -0,0 +1,123 @@
+import dataclasses
+import tempfile
+import unittest
+from pathlib import Path
+from typing import List
+
+import numpy as np
+from PIL import Image, ImageFont
+
+from resources.fonts import DemoFontPaths
+from test.utils import demo_training_parameters
+from text_depixelizer.HMM.compact_model import CompactModel
+from text_depixelizer.HMM.depix_hmm import DepixHMM
+from text_depixelizer.HMM.factorized_hmm import FactorizedDepixHMM
+from text_depixelizer.benchmark import crop_pixelized_area
+from text_depixelizer.parameters import PictureParameters, TrainingParameters
+from text_depixelizer.training_pipeline.training_pipeline import create_training_data
+
+
+class TestCompactModel(unittest.TestCase):
+
+    demo_picture_parameters: PictureParameters = PictureParameters(
+        block_size=6,
+        pattern=r'\d{8,12}',
+        font=ImageFont.truetype(str(DemoFontPaths.arial), 50)
+    )
+
+    demo_training_parameters: TrainingParameters = dataclasses.replace(
+        demo_training_parameters, n_img_train=20, n_clusters=10, seed=42, smoothing=0.01
+    )
+
+    def get_images(self, n_img: int) -> List[Image.Image]:
+        _, _, pixelized_images, _ = create_training_data(n_img, self.demo_picture_parameters)
+        return [crop_pixelized_area(pixelized_image) for pixelized_image in pixelized_images]
+
+    def assert_same_results(self, depix_hmm: DepixHMM):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Arrange
+            path: Path = Path(tmp_dir) / 'model.npz'
+            imgs: List[Image.Image] = self.get_images(5)
+
+            # Act
+            depix_hmm.to_compact_model().save(path)
+            compact_model: CompactModel = CompactModel.load(path)
+
+            # Assert
+            self.assertEqual(compact_model.states, depix_hmm.states)
+            self.assertEqual(compact_model.ink_percentile, depix_hmm.ink_percentile)
+            texts, scores = compact_model.score_images(imgs)
+            expected_texts, expected_scores = depix_hmm.score_images(imgs)
+            self.assertEqual(texts, expected_texts)
+            np.testing.assert_allclose(scores, expected_scores)
+
+    def test_clusters(self):
+        # Arrange
+        depix_hmm: DepixHMM = DepixHMM(self.demo_picture_parameters, self.demo_training_parameters)
+        depix_hmm.train()
+
+        # Act & Assert
+        self.assert_same_results(depix_hmm)
+
+    def test_sparse_transitions(self):
+        # Arrange: Without smoothing, most transitions are impossible
+        depix_hmm: DepixHMM = DepixHMM(self.demo_picture_parameters,
+                                       dataclasses.replace(self.demo_training_parameters, smoothing=0.0))
+        depix_hmm.train()
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path: Path = Path(tmp_dir) / 'model.npz'
+
+            # Act
+            depix_hmm.to_compact_model().save(path)
+            compact_model: CompactModel = CompactModel.load(path)
+            with np.load(path) as data:
+                names: List[str] = list(data.keys())
+
+        # Assert: Only the predecessors of every state are stored, and the sparse viterbi decodes them
+        self.assertNotIn('log_transition_probabilities', names)
+        self.assertIsNone(compact_model.log_transition_probabilities)
+        np.testing.assert_array_equal(compact_model.sparse_log_transitions.predecessors,
+                                      depix_hmm.sparse_log_transitions.predecessors)
+        self.assert_same_results(depix_hmm)
+
+    def test_coverage_features(self):
+        # Arrange
+        depix_hmm: DepixHMM = DepixHMM(dataclasses.replace(self.demo_picture_parameters, features='coverage'),
+                                       self.demo_training_parameters)
+        depix_hmm.train()
+
+        # Act & Assert
+        self.assert_same_results(depix_hmm)
+
+    def test_float32_gaussian_emissions(self):
+        # Arrange
+        training_parameters: TrainingParameters = dataclasses.replace(self.demo_training_parameters,
+                                                                      emission_model='gaussian', precision='float32')
+        depix_hmm: DepixHMM = DepixHMM(self.demo_picture_parameters, training_parameters)
+        depix_hmm.train()
+
+        # Act & Assert
+        self.assert_same_results(depix_hmm)
+
+    def test_assign_clusters(self):
+        # Arrange
+        depix_hmm: DepixHMM = DepixHMM(self.demo_picture_parameters, self.demo_training_parameters)
+        depix_hmm.train()
+        values: np.ndarray = np.concatenate([depix_hmm.get_window_values(img) for img in self.get_images(3)])
+
+        # Act
+        k_values: np.ndarray = depix_hmm.to_compact_model().assign_clusters(values)
+
+        # Assert
+        np.testing.assert_array_equal(k_values, depix_hmm.clusterer.map_values_to_cluster(values))
+
+    def test_factorized_model(self):
+        # Arrange
+        depix_hmm: FactorizedDepixHMM = FactorizedDepixHMM(
+            self.demo_picture_parameters, dataclasses.replace(self.demo_training_parameters, state_model='factorized')
+        )
+
+        # Act & Assert
+        with self.assertRaises(ValueError):
+            depix_hmm.to_compact_model()
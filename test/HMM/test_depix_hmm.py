@@ -1,14 +1,20 @@
+import dataclasses
 import unittest
 from pathlib import Path
-from typing import List
+from typing import List, Tuple
 
 import numpy as np
 from PIL import Image, ImageFont
 
 from resources.fonts import DemoFontPaths
 from test.utils import demo_training_parameters, demo_picture_parameters
+from text_depixelizer.HMM.clusterer import BisectingClusterer
+from text_depixelizer.benchmark import crop_pixelized_area
 from text_depixelizer.HMM.depix_hmm import DepixHMM
+from text_depixelizer.HMM.evaluation import SequentialEvaluation
 from text_depixelizer.parameters import PictureParameters, TrainingParameters
+from text_depixelizer.training_pipeline.training_pipeline import create_training_data, TrainingData, \
+    create_seeded_training_data
 from text_depixelizer.training_pipeline.windows import Window
 
 
@@ -33,6 +39,21 @@ class TestDepixHmm(unittest.TestCase):
         self.assertTrue(len(depix_hmm.states) > 5)
         self.assertEqual(depix_hmm.emission_probabilities.shape, depix_hmm.log_emission_probabilities.shape)
 
+    def test_train_with_seed(self):
+        # Arrange
+        training_parameters: TrainingParameters = dataclasses.replace(demo_training_parameters, seed=42)
+        depix_hmms: List[DepixHMM] = [DepixHMM(self.demo_picture_parameters, training_parameters) for _ in range(2)]
+
+        # Act
+        for depix_hmm in depix_hmms:
+            depix_hmm.train()
+
+        # Assert
+        self.assertEqual(depix_hmms[0].states, depix_hmms[1].states)
+        np.testing.assert_array_equal(depix_hmms[0].transition_probabilities, depix_hmms[1].transition_probabilities)
+        np.testing.assert_array_equal(depix_hmms[0].emission_probabilities, depix_hmms[1].emission_probabilities)
+        self.assertEqual(depix_hmms[0].evaluate(), depix_hmms[1].evaluate())
+
     def test_evaluate(self):
         # Arrange
         depix_hmm: DepixHMM = DepixHMM(self.demo_picture_parameters, demo_training_parameters)
@@ -47,6 +68,178 @@ class TestDepixHmm(unittest.TestCase):
         self.assertIsInstance(accuracy, float)
         self.assertIsInstance(average_distance, float)
 
+    def test_evaluate_in_chunks(self):
+        # Arrange
+        training_parameters: TrainingParameters = dataclasses.replace(demo_training_parameters, seed=42, n_img_test=7,
+                                                                      evaluation_chunk_size=3)
+        depix_hmm: DepixHMM = DepixHMM(self.demo_picture_parameters, training_parameters)
+        depix_hmm.train()
+
+        # Act: A tolerance that is never reached
+        expected: Tuple[float, float] = depix_hmm.evaluate()
+        depix_hmm.training_parameters = dataclasses.replace(training_parameters, evaluation_tolerance=1e-9)
+        evaluation: SequentialEvaluation = depix_hmm.evaluate_sequentially()
+
+        # Assert: The chunks are the same test images
+        self.assertEqual((evaluation.accuracy, evaluation.average_similarity), expected)
+        self.assertEqual(evaluation.n_evaluated, 7)
+        self.assertEqual(evaluation.stop_reason, 'complete')
+
+    def test_gaussian_emissions(self):
+        # Arrange
+        training_parameters: TrainingParameters = dataclasses.replace(demo_training_parameters,
+                                                                      emission_model='gaussian')
+        depix_hmm: DepixHMM = DepixHMM(self.demo_picture_parameters, training_parameters)
+
+        # Act
+        depix_hmm.train()
+        accuracy, average_distance = depix_hmm.evaluate()
+
+        # Assert
+        self.assertEqual(depix_hmm.gaussian_emissions.means.shape[0], len(depix_hmm.states))
+        self.assertEqual(depix_hmm.gaussian_emissions.variances.shape, depix_hmm.gaussian_emissions.means.shape)
+        self.assertGreaterEqual(accuracy, 0)
+        self.assertIsInstance(average_distance, float)
+
+    def test_bisecting_clustering(self):
+        # Arrange
+        training_parameters: TrainingParameters = dataclasses.replace(demo_training_parameters, seed=42,
+                                                                      clustering='bisecting')
+        depix_hmm: DepixHMM = DepixHMM(self.demo_picture_parameters, training_parameters)
+
+        # Act
+        depix_hmm.train()
+        accuracy, _ = depix_hmm.evaluate()
+
+        # Assert: Decoding works, but the clusters can't be exported as nearest centroids
+        self.assertIsInstance(depix_hmm.clusterer, BisectingClusterer)
+        self.assertEqual(depix_hmm.emission_probabilities.shape[1], training_parameters.n_clusters)
+        self.assertGreaterEqual(accuracy, 0)
+        with self.assertRaises(ValueError):
+            depix_hmm.to_compact_model()
+
+    def test_train_with_clusterer(self):
+        # Arrange
+        training_parameters: TrainingParameters = dataclasses.replace(demo_training_parameters, seed=42,
+                                                                      clustering='bisecting')
+        depix_hmm: DepixHMM = DepixHMM(self.demo_picture_parameters, training_parameters)
+        expected: DepixHMM = DepixHMM(self.demo_picture_parameters, training_parameters)
+        training_data: TrainingData = depix_hmm.generate_training_data()
+        cluster_tree: BisectingClusterer = depix_hmm.create_clusterer(
+            [window for windows in training_data[3] for window in windows], k=10
+        )
+
+        # Act
+        depix_hmm.train(training_data, cluster_tree.cut(training_parameters.n_clusters))
+        expected.train()
+
+        # Assert: Cutting a larger tree gives the model of fitting the clusters
+        np.testing.assert_array_equal(depix_hmm.emission_probabilities, expected.emission_probabilities)
+
+    def test_coverage_features(self):
+        # Arrange: Train on black text on white, decode white text on dark blue
+        picture_parameters: PictureParameters = dataclasses.replace(demo_picture_parameters, features='coverage')
+        depix_hmm: DepixHMM = DepixHMM(picture_parameters, dataclasses.replace(demo_training_parameters, seed=42))
+        _, _, pixelized_images, _ = create_seeded_training_data(1, picture_parameters, seed=1)
+        _, _, pixelized_images_dark, _ = create_seeded_training_data(
+            1, dataclasses.replace(picture_parameters, font_color=(255, 255, 255), background_color=(39, 48, 70)), seed=1
+        )
+        gray: Tuple[Tuple[int, int, int], Tuple[int, int, int]] = ((51, 51, 51), (255, 255, 255))
+        _, _, pixelized_images_gray, _ = create_seeded_training_data(
+            1, dataclasses.replace(picture_parameters, font_color=gray[0], background_color=gray[1]), seed=1
+        )
+
+        # Act
+        depix_hmm.train()
+        reconstructed_string: str = depix_hmm.test_image(crop_pixelized_area(pixelized_images[0]))
+        reconstructed_string_dark: str = depix_hmm.test_image(crop_pixelized_area(pixelized_images_dark[0]))
+        gray_img: Image.Image = crop_pixelized_area(pixelized_images_gray[0])
+        detected_values: np.ndarray = depix_hmm.get_window_values(gray_img)
+        given_values: np.ndarray = depix_hmm.get_window_values(gray_img, gray)
+
+        # Assert: One feature per block instead of three colors, and the same result for both color schemes
+        self.assertEqual(depix_hmm.clusterer.centroids.shape[1], picture_parameters.window_size
+                         * pixelized_images[0].n_tiles[1])
+        self.assertEqual(reconstructed_string_dark, reconstructed_string)
+
+        # Assert: The colors detected with the ink coverage of the training images are those of a gray font
+        self.assertLess(depix_hmm.ink_percentile, 1)
+        np.testing.assert_allclose(detected_values.astype(int), given_values.astype(int), atol=2)
+        self.assertEqual(depix_hmm.score_images([gray_img], gray)[0], [reconstructed_string])
+
+    def test_precision(self):
+        # Arrange
+        training_parameters: TrainingParameters = dataclasses.replace(demo_training_parameters, seed=42)
+        depix_hmm_64: DepixHMM = DepixHMM(self.demo_picture_parameters, training_parameters)
+        depix_hmm_32: DepixHMM = DepixHMM(self.demo_picture_parameters,
+                                          dataclasses.replace(training_parameters, precision='float32'))
+
+        # Act
+        depix_hmm_64.train()
+        depix_hmm_32.train()
+        _, _, pixelized_images, windows = create_training_data(n_img=3, picture_parameters=self.demo_picture_parameters)
+        _, scores = depix_hmm_32.score_window_values(depix_hmm_32.get_test_window_values(pixelized_images, windows))
+
+        # Assert: Same model in half the memory
+        self.assertEqual(depix_hmm_32.states, depix_hmm_64.states)
+        self.assertEqual(depix_hmm_32.clusterer.kmeans.cluster_centers_.dtype, np.float32)
+        for name in ('log_starting_probabilities', 'log_transition_probabilities', 'log_emission_probabilities'):
+            self.assertEqual(getattr(depix_hmm_32, name).dtype, np.float32)
+            self.assertEqual(getattr(depix_hmm_64, name).dtype, np.float64)
+        self.assertEqual(len(scores), len(windows))
+        self.assertEqual(depix_hmm_32.transition_probabilities.nbytes * 2, depix_hmm_64.transition_probabilities.nbytes)
+
+    def test_unknown_precision(self):
+        # Arrange
+        depix_hmm: DepixHMM = DepixHMM(self.demo_picture_parameters,
+                                       dataclasses.replace(demo_training_parameters, precision='float16'))
+
+        # Act & Assert
+        with self.assertRaises(ValueError):
+            depix_hmm.train()
+
+    def test_saturated_training_data(self):
+        # Arrange
+        training_parameters: TrainingParameters = dataclasses.replace(demo_training_parameters, seed=42,
+                                                                      n_img_train=400, saturation_threshold=0.05,
+                                                                      saturation_increment=20)
+        depix_hmm: DepixHMM = DepixHMM(self.demo_picture_parameters, training_parameters)
+
+        # Act
+        texts, _, _, windows = depix_hmm.generate_training_data()
+        expected_texts, _, _, _ = DepixHMM(
+            self.demo_picture_parameters,
+            dataclasses.replace(training_parameters, n_img_train=len(texts), saturation_threshold=0.0)
+        ).generate_training_data()
+
+        # Assert: Stopped before the maximum, with the images that a fixed size would generate
+        self.assertLess(len(texts), 400)
+        self.assertEqual(len(windows), len(texts))
+        self.assertEqual(texts, expected_texts)
+        self.assertEqual(depix_hmm.saturation.n_img, len(texts))
+        self.assertLess(depix_hmm.saturation.discovery_rate, 0.05)
+        self.assertEqual([point.n_img for point in depix_hmm.saturation.curve], list(range(20, len(texts) + 1, 20)))
+
+    def test_saturated_training_data_coverage_texts(self):
+        # Arrange
+        picture_parameters: PictureParameters = dataclasses.replace(self.demo_picture_parameters, pattern=r'\d{4}')
+        training_parameters: TrainingParameters = dataclasses.replace(
+            demo_training_parameters, seed=3, n_img_train=30, saturation_threshold=0.001, saturation_increment=10,
+            text_generation='coverage'
+        )
+
+        # Act
+        texts, _, _, _ = DepixHMM(picture_parameters, training_parameters).generate_training_data()
+        expected_texts, _, _, _ = DepixHMM(
+            picture_parameters, dataclasses.replace(training_parameters, saturation_threshold=0.0)
+        ).generate_training_data()
+
+        # Assert: The increments continue the coverage texts
+        self.assertEqual(texts, expected_texts[:len(texts)])
+        with self.assertRaises(ValueError):
+            DepixHMM(picture_parameters, dataclasses.replace(training_parameters, state_model='factorized')) \
+                .generate_saturated_training_data()
+
     def test_get_starting_probabilities(self):
         # Arrange
         windows: List[Window] = [
@@ -83,6 +276,71 @@ class TestDepixHmm(unittest.TestCase):
         for s in depix_hmm.emission_probabilities.sum(axis=1):
             self.assertAlmostEqual(s, 1.0, places=3)
 
+    def test_smoothing_and_pruning(self):
+        # Arrange
+        windows: List[Window] = [
+            Window(characters=('a',), values=np.ndarray([1]), window_index=0, k=0),
+            Window(characters=('a', 'b'), values=np.ndarray([1]), window_index=1, k=1),
+            Window(characters=('b',), values=np.ndarray([1]), window_index=2, k=1),
+            Window(characters=('c',), values=np.ndarray([1]), window_index=0, k=2),
+            Window(characters=('c', 'b'), values=np.ndarray([1]), window_index=1, k=1),
+            Window(characters=('b',), values=np.ndarray([1]), window_index=2, k=1)
+        ]
+        states: List[tuple] = sorted({window.characters for window in windows})
+        a, ab, b, c, cb = [states.index(state) for state in [('a',), ('a', 'b'), ('b',), ('c',), ('c', 'b')]]
+
+        # Act
+        emissions: np.ndarray = DepixHMM.get_emission_probabilities(windows, states, [0, 1, 2, 3], smoothing=0.5)
+        transitions: np.ndarray = DepixHMM.get_transition_probabilities(windows, states, smoothing=0.5)
+        backoff_transitions: np.ndarray = DepixHMM.get_transition_probabilities(
+            windows, states, smoothing=0.5, backoff=True
+        )
+        pruned_transitions: np.ndarray = DepixHMM.get_transition_probabilities(
+            windows, states, smoothing=0.5, pruning_threshold=0.2
+        )
+
+        # Assert: Nothing is impossible with add-k smoothing, also not for the unused observation 3
+        self.assertTrue(np.all(emissions > 0))
+        self.assertAlmostEqual(emissions[a, 0], 1.5 / 3)
+        self.assertTrue(np.all(transitions > 0))
+        np.testing.assert_allclose(transitions.sum(axis=1), 1)
+
+        # Assert: With backoff, ('a', 'b') may continue like ('c', 'b'), which also ends with 'b', but not to ('c',)
+        self.assertGreater(backoff_transitions[ab, b], backoff_transitions[ab, c])
+        self.assertEqual(backoff_transitions[ab, c], 0)
+        self.assertGreater(backoff_transitions[a, ab], 0)
+
+        # Assert: Pruning removes the unlikely smoothed transitions again
+        self.assertEqual(pruned_transitions[a, c], 0)
+        self.assertGreater(pruned_transitions[a, ab], 0.5)
+        np.testing.assert_allclose(pruned_transitions.sum(axis=1), 1)
+
+    def test_sparse_transitions(self):
+        # Arrange
+        training_parameters: TrainingParameters = dataclasses.replace(demo_training_parameters, seed=42)
+        depix_hmm: DepixHMM = DepixHMM(self.demo_picture_parameters, training_parameters)
+        _, _, _, windows = depix_hmm.generate_training_data()
+        windows_flattened: List[Window] = [window for image_windows in windows for window in image_windows]
+        states: List[tuple] = sorted({window.characters for window in windows_flattened})
+        sources, targets, counts = DepixHMM.count_transition_pairs(windows_flattened, states)
+
+        # Act
+        depix_hmm.train()
+        sparse_transitions: List[np.ndarray] = [
+            np.exp(DepixHMM.estimate_sparse_transitions(len(states), sources, targets, counts, threshold).to_dense_log())
+            for threshold in (0.0, 0.4)
+        ]
+
+        # Assert: Same as the dense estimate, which the model doesn't store
+        for threshold, transitions in zip((0.0, 0.4), sparse_transitions):
+            np.testing.assert_allclose(transitions, DepixHMM.get_transition_probabilities(
+                windows_flattened, states, pruning_threshold=threshold
+            ))
+        self.assertIsNotNone(depix_hmm.sparse_transitions)
+        self.assertIsNone(depix_hmm._transition_probabilities)
+        np.testing.assert_allclose(depix_hmm.transition_probabilities,
+                                   DepixHMM.get_transition_probabilities(windows_flattened, states))
+
     def test_test_image(self):
         # Arrange
         img_path: Path = Path(__file__).parent.parent.parent / 'examples' / 'arial_50_blocksize-8' / 'pixelized_cropped.png'
@@ -108,3 +366,21 @@ class TestDepixHmm(unittest.TestCase):
 
         # Assert
         self.assertIsInstance(reconstructed_string, str)
+
+    def test_test_images(self):
+        # Arrange
+        depix_hmm: DepixHMM = DepixHMM(self.demo_picture_parameters, demo_training_parameters)
+        depix_hmm.train()
+        _, _, pixelized_images, _ = create_training_data(n_img=3, picture_parameters=self.demo_picture_parameters)
+        imgs: List[Image.Image] = [
+            p.image.crop((p.origin[0], p.origin[1], p.origin[0] + p.n_tiles[0]*p.block_size, p.origin[1] + p.n_tiles[1]*p.block_size))
+            for p in pixelized_images
+        ]
+
+        # Act
+        reconstructed_strings, scores = depix_hmm.score_images(imgs)
+
+        # Assert: Same results as decoding the images one by one
+        self.assertListEqual(reconstructed_strings, [depix_hmm.test_image(img) for img in imgs])
+        self.assertEqual(len(scores), len(imgs))
+
@@ -0,0 +1,41 @@
+import unittest
+
+import numpy as np
+
+from text_depixelizer.HMM.emission_model import GaussianEmissions
+
+
+class TestGaussianEmissions(unittest.TestCase):
+
+    def test_fit(self):
+        # Arrange
+        values: np.ndarray = np.array([[0, 10], [2, 10], [100, 50], [104, 50]], dtype=np.uint8)
+        state_indices: np.ndarray = np.array([0, 0, 1, 1])
+
+        # Act
+        gaussian_emissions: GaussianEmissions = GaussianEmissions.fit(values, state_indices, n_states=3,
+                                                                      variance_prior=0.0)
+
+        # Assert: The last state has no windows and gets the distribution of all windows
+        np.testing.assert_allclose(gaussian_emissions.means, [[1, 10], [102, 50], [51.5, 30]])
+        np.testing.assert_allclose(gaussian_emissions.variances[:2], [[1, 0], [4, 0]])
+        np.testing.assert_allclose(gaussian_emissions.variances[2], values.astype(float).var(axis=0))
+
+    def test_log_likelihood(self):
+        # Arrange
+        rng: np.random.Generator = np.random.default_rng(0)
+        gaussian_emissions: GaussianEmissions = GaussianEmissions(
+            means=rng.random((4, 6)) * 255, variances=rng.random((4, 6)) * 100 + 1
+        )
+        values: np.ndarray = rng.integers(0, 256, (5, 6)).astype(np.uint8)
+
+        # Act
+        log_likelihood: np.ndarray = gaussian_emissions.log_likelihood(values)
+
+        # Assert
+        expected: np.ndarray = -0.5 * np.sum(
+            (values[:, np.newaxis, :] - gaussian_emissions.means[np.newaxis])**2 / gaussian_emissions.variances
+            + np.log(2 * np.pi * gaussian_emissions.variances),
+            axis=2
+        )
+        np.testing.assert_allclose(log_likelihood, expected)
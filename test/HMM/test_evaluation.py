@@ -0,0 +1,73 @@
+import unittest
+from typing import List, Tuple
+
+from text_depixelizer.HMM.evaluation import SequentialEvaluation, evaluate_sequentially
+
+
+class TestEvaluation(unittest.TestCase):
+
+    def test_chunks(self):
+        # Act
+        chunks: List[Tuple[int, int]] = SequentialEvaluation(n_img=250, tolerance=0.05).chunks(100)
+        single_chunk: List[Tuple[int, int]] = SequentialEvaluation(n_img=250).chunks(100)
+
+        # Assert: Without a criterion to stop early, all images are decoded at once
+        self.assertEqual(chunks, [(0, 100), (100, 100), (200, 50)])
+        self.assertEqual(single_chunk, [(0, 250)])
+
+    def test_accuracy_interval(self):
+        # Arrange
+        evaluation: SequentialEvaluation = SequentialEvaluation(n_img=1000)
+
+        # Act
+        evaluation.add(['123'] * 100, ['124'] * 100)
+        lower, upper = evaluation.accuracy_interval
+
+        # Assert: Even without a single correct text, the accuracy isn't certainly 0
+        self.assertEqual(evaluation.accuracy, 0.0)
+        self.assertEqual(lower, 0.0)
+        self.assertGreater(upper, 0.0)
+        self.assertLess(upper, 0.05)
+
+    def test_stop_at_best_to_beat(self):
+        # Arrange
+        evaluation: SequentialEvaluation = SequentialEvaluation(n_img=1000, best_to_beat=0.5)
+
+        # Act
+        evaluation.add(['123'] * 100, ['123'] * 10 + ['124'] * 90)
+
+        # Assert
+        self.assertTrue(evaluation.is_done())
+        self.assertEqual(evaluation.stop_reason, 'best_to_beat')
+
+    def test_stop_at_tolerance(self):
+        # Arrange
+        evaluation: SequentialEvaluation = SequentialEvaluation(n_img=1000, tolerance=0.05)
+
+        # Act
+        evaluation.add(['123'] * 50, ['123'] * 25 + ['124'] * 25)
+        is_done_after_50: bool = evaluation.is_done()
+        evaluation.add(['123'] * 350, ['123'] * 350)
+        is_done_after_400: bool = evaluation.is_done()
+
+        # Assert: 50% accuracy is too uncertain after 50 images, 94% after 400 images is certain enough
+        self.assertFalse(is_done_after_50)
+        self.assertTrue(is_done_after_400)
+        self.assertEqual(evaluation.stop_reason, 'tolerance')
+
+    def test_evaluate_sequentially(self):
+        # Arrange
+        decoded_chunks: List[Tuple[int, int]] = []
+
+        def decode_test_images(first_image: int, n_img: int) -> Tuple[List[str], List[str]]:
+            decoded_chunks.append((first_image, n_img))
+            return ['123'] * n_img, ['123'] * n_img
+
+        # Act
+        evaluation: SequentialEvaluation = evaluate_sequentially(decode_test_images, n_img=1000, chunk_size=100,
+                                                                 tolerance=0.05)
+
+        # Assert: A perfect model is certain after the first chunk
+        self.assertEqual(decoded_chunks, [(0, 100)])
+        self.assertEqual(evaluation.accuracy, 1.0)
+        self.assertEqual(evaluation.average_similarity, 1.0)
@@ -0,0 +1,122 @@
+import dataclasses
+import unittest
+from typing import List
+
+import numpy as np
+from PIL import ImageFont
+
+from resources.fonts import DemoFontPaths
+from test.utils import demo_training_parameters
+from text_depixelizer.HMM.factorized_hmm import FactorizedDepixHMM, BEGIN, END
+from text_depixelizer.HMM.hmm import HMM
+from text_depixelizer.parameters import PictureParameters, TrainingParameters
+
+
+class TestFactorizedDepixHmm(unittest.TestCase):
+
+    demo_picture_parameters: PictureParameters = PictureParameters(
+        block_size=6,
+        pattern=r'\d{8,12}',
+        font=ImageFont.truetype(str(DemoFontPaths.arial), 50),
+        randomize_pixelization_origin_x=True
+    )
+
+    demo_training_parameters: TrainingParameters = dataclasses.replace(
+        demo_training_parameters, n_img_train=20, n_clusters=10, seed=42, smoothing=0.01, state_model='factorized'
+    )
+
+    def test_train(self):
+        # Arrange
+        hmm: FactorizedDepixHMM = FactorizedDepixHMM(self.demo_picture_parameters, self.demo_training_parameters)
+
+        # Act
+        hmm.train()
+
+        # Assert: One state per pixel column of every character
+        digit_width: int = round(self.demo_picture_parameters.font.getlength('0'))
+        self.assertEqual(hmm.symbols, [BEGIN] + list('0123456789') + [END])
+        self.assertEqual(len(hmm.states), 10*digit_width + 5*6 + 6)
+        np.testing.assert_allclose(hmm.starting_probabilities.sum(), 1.0)
+        np.testing.assert_allclose(hmm.transition_probabilities.sum(axis=1), 1.0)
+        np.testing.assert_allclose(hmm.emission_probabilities.sum(axis=1), 1.0)
+
+        # Assert: Only the possible transitions are stored, at most one per symbol that a state can wrap into
+        self.assertNotIn('_transition_probabilities', vars(hmm))
+        self.assertLessEqual(hmm.sparse_transitions.n_predecessors, len(hmm.symbols))
+
+    def test_viterbi_step(self):
+        # Arrange
+        hmm: FactorizedDepixHMM = FactorizedDepixHMM(self.demo_picture_parameters, self.demo_training_parameters)
+        hmm.train()
+        v: np.ndarray = np.log(np.random.default_rng(0).random((3, len(hmm.states))))
+
+        # Act
+        best, pointers = hmm.viterbi_step(v)
+        expected_best, _ = HMM.viterbi_step(hmm, v)
+
+        # Assert: Same scores as the generic step on the dense transition matrix
+        np.testing.assert_allclose(best, expected_best)
+        np.testing.assert_allclose(
+            np.take_along_axis(v, pointers, axis=1) + hmm.log_transition_probabilities[pointers, np.arange(len(hmm.states))],
+            best
+        )
+
+    def test_evaluate(self):
+        # Arrange
+        hmm: FactorizedDepixHMM = FactorizedDepixHMM(self.demo_picture_parameters, self.demo_training_parameters)
+        hmm.train()
+
+        # Act
+        accuracy, average_similarity = hmm.evaluate()
+
+        # Assert
+        self.assertGreaterEqual(accuracy, 0)
+        self.assertLessEqual(accuracy, 1)
+        self.assertGreater(average_similarity, 0)
+
+    def test_gaussian_emissions(self):
+        # Arrange
+        training_parameters: TrainingParameters = dataclasses.replace(self.demo_training_parameters,
+                                                                      emission_model='gaussian')
+        hmm: FactorizedDepixHMM = FactorizedDepixHMM(self.demo_picture_parameters, training_parameters)
+
+        # Act
+        hmm.train()
+        accuracy, average_similarity = hmm.evaluate()
+
+        # Assert: No clustering is needed
+        self.assertFalse(hasattr(hmm, 'clusterer'))
+        self.assertEqual(hmm.gaussian_emissions.means.shape[0], len(hmm.states))
+        self.assertGreater(average_similarity, 0)
+
+    def test_reconstruct_string(self):
+        # Arrange
+        states: List[tuple] = [(BEGIN, 28), ('1', 2), ('1', 8), ('1', 14), ('1', 20), ('1', 0), ('1', 6), ('2', 1),
+                               (END, 0), (END, 0)]
+
+        # Act
+        reconstructed_string: str = FactorizedDepixHMM.reconstruct_string(states)
+
+        # Assert
+        self.assertEqual(reconstructed_string, '112')
+
+    def test_narrow_characters(self):
+        # Arrange
+        picture_parameters: PictureParameters = dataclasses.replace(self.demo_picture_parameters, block_size=12)
+        hmm: FactorizedDepixHMM = FactorizedDepixHMM(picture_parameters, self.demo_training_parameters)
+
+        # Act & Assert
+        with self.assertRaises(ValueError):
+            hmm.calculate_symbols(['1il1'])
+
+    def test_get_bigram_probabilities(self):
+        # Act
+        probabilities: np.ndarray = FactorizedDepixHMM.get_bigram_probabilities(['ab', 'aa'], [BEGIN, 'a', 'b', END])
+
+        # Assert
+        np.testing.assert_allclose(probabilities, [
+            [0.5, 0.5, 0.0, 0.0],
+            [0.0, 1/3, 1/3, 1/3],
+            [0.0, 0.0, 0.0, 1.0],
+            [0.0, 0.0, 0.0, 1.0]
+        ])
@@ -1,9 +1,9 @@
 from typing import List
-from unittest import TestCase
+from unittest import TestCase, mock
 
 import numpy as np
 
-from text_depixelizer.HMM.hmm import HMM
+from text_depixelizer.HMM.hmm import HMM, get_checkpoint_interval, get_pointer_dtype
 
 
 class TestHmm(TestCase):
@@ -106,3 +106,98 @@ class TestHmm(TestCase):
 
             # Assert
             self.assertListEqual(result_viterbi, result_log_viterbi)
+
+    def test_log_viterbi_batch(self):
+        """
+        The batched log-viterbi should return the same state sequences as the regular log-viterbi
+        """
+        np.random.seed(0)
+
+        # Arrange
+        possible_observations: List[int] = list(range(20))
+        possible_states: List[int] = list(range(300))
+        sequences: List[List[int]] = [
+            list(np.random.choice(possible_observations, size=length)) for length in [1, 17, 5, 30]
+        ]
+        hmm: HMM = self.create_random_hmm(sequences[0], possible_states, possible_observations)
+
+        # Act
+        results, scores = hmm.log_viterbi_batch(sequences + [[]])
+
+        # Assert
+        for sequence, result in zip(sequences, results):
+            self.assertListEqual(result, hmm.log_viterbi(sequence))
+        self.assertListEqual(results[-1], [])
+        self.assertEqual(len(scores), len(sequences) + 1)
+        self.assertTrue(all(scores[:-1] < 0))
+
+
+    def test_log_viterbi_batch_sparse_transitions(self):
+        """
+        With mostly impossible transitions, the batched log-viterbi uses the sparse transitions and should still
+        return the same state sequences as the regular log-viterbi
+        """
+        np.random.seed(1)
+
+        # Arrange: Every state can only be left to itself and the next 3 states
+        n_states: int = 50
+        possible_observations: List[int] = list(range(10))
+        hmm: HMM = self.create_random_hmm([], list(range(n_states)), possible_observations)
+        allowed: np.ndarray = np.zeros((n_states, n_states), dtype=bool)
+        for offset in range(4):
+            allowed[np.arange(n_states), (np.arange(n_states) + offset) % n_states] = True
+        transitions: np.ndarray = np.where(allowed, hmm.transition_probabilities, 0.0)
+        hmm.transition_probabilities = transitions / transitions.sum(axis=1)[:, np.newaxis]
+        sequences: List[List[int]] = [list(np.random.choice(possible_observations, size=length)) for length in [3, 25]]
+
+        # Act
+        results, scores = hmm.log_viterbi_batch(sequences)
+
+        # Assert
+        self.assertEqual(hmm.sparse_log_transitions.n_predecessors, 4)
+        for sequence, result in zip(sequences, results):
+            self.assertListEqual(result, hmm.log_viterbi(sequence))
+        self.assertTrue(np.all(np.isfinite(scores)))
+
+    def test_log_viterbi_checkpointed(self):
+        np.random.seed(2)
+
+        # Arrange
+        possible_observations: List[int] = list(range(10))
+        hmm: HMM = self.create_random_hmm([], list(range(20)), possible_observations)
+        sequence: List[int] = list(np.random.choice(possible_observations, size=50))
+        log_emissions: np.ndarray = hmm.log_emission_probabilities[:, sequence].T
+
+        # Act
+        (expected_indices,), expected_scores = hmm.log_viterbi_from_log_emissions([log_emissions])
+        results = [hmm.log_viterbi_checkpointed(log_emissions, interval) for interval in [None, 1, 7, 50, 100]]
+
+        # Assert: The same path and score for any interval between the checkpoints
+        self.assertEqual(get_checkpoint_interval(50), 8)
+        for state_indices, score in results:
+            np.testing.assert_array_equal(state_indices, expected_indices)
+            self.assertEqual(score, expected_scores[0])
+
+    def test_log_viterbi_batch_long_sequences(self):
+        """
+        Sequences with more backpointers than MAX_POINTER_ELEMENTS are decoded with checkpoints, and chunks of shorter
+        sequences are made smaller
+        """
+        np.random.seed(3)
+
+        # Arrange
+        possible_observations: List[int] = list(range(10))
+        hmm: HMM = self.create_random_hmm([], list(range(20)), possible_observations)
+        sequences: List[List[int]] = [list(np.random.choice(possible_observations, size=length))
+                                      for length in [3, 40, 5, 200, 6]]
+        expected_results, expected_scores = hmm.log_viterbi_batch(sequences)
+
+        # Act
+        with mock.patch('text_depixelizer.HMM.hmm.MAX_POINTER_ELEMENTS', 20 * 50):
+            results, scores = hmm.log_viterbi_batch(sequences)
+
+        # Assert
+        self.assertEqual(get_pointer_dtype(len(hmm.states)), np.uint8)
+        self.assertEqual(get_pointer_dtype(300), np.uint16)
+        self.assertEqual(results, expected_results)
+        np.testing.assert_array_equal(scores, expected_scores)
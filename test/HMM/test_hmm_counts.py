@@ -0,0 +1,52 @@
+import tempfile
+import unittest
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from text_depixelizer.HMM.depix_hmm import DepixHMM
+from text_depixelizer.HMM.hmm_counts import HMMCounts
+from text_depixelizer.training_pipeline.windows import Window
+
+
+def create_windows(characters: List[tuple], k_values: List[int]) -> List[Window]:
+    return [Window(characters=c, values=np.zeros(1), window_index=i, k=k)
+            for i, (c, k) in enumerate(zip(characters, k_values))]
+
+
+class TestHMMCounts(unittest.TestCase):
+
+    def test_merge(self):
+        # Arrange
+        windows_a: List[Window] = create_windows([('a',), ('a', 'b'), ('b',)], [0, 1, 0])
+        windows_b: List[Window] = create_windows([('c',), ('a',), ('a', 'b')], [2, 0, 1])
+
+        # Act
+        merged: HMMCounts = HMMCounts.merge([DepixHMM.count_windows(windows_a, 3),
+                                             DepixHMM.count_windows(windows_b, 3)])
+        expected: HMMCounts = DepixHMM.count_windows(windows_a + windows_b, 3)
+
+        # Assert: Both shards are images of their own, so there is no transition inbetween
+        self.assertEqual(merged.states, expected.states)
+        np.testing.assert_array_equal(merged.starting_counts, expected.starting_counts)
+        np.testing.assert_array_equal(merged.emission_counts, expected.emission_counts)
+        np.testing.assert_array_equal(merged.transition_sources, expected.transition_sources)
+        np.testing.assert_array_equal(merged.transition_targets, expected.transition_targets)
+        np.testing.assert_array_equal(merged.transition_counts, expected.transition_counts)
+
+    def test_save_load(self):
+        # Arrange
+        counts: HMMCounts = DepixHMM.count_windows(create_windows([('a',), ('a', 'b'), ('b',)], [0, 1, 0]), 2)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Act
+            counts.save(Path(tmp_dir) / 'counts.npz')
+            loaded: HMMCounts = HMMCounts.load(Path(tmp_dir) / 'counts.npz')
+
+        # Assert
+        self.assertEqual(loaded.states, counts.states)
+        np.testing.assert_array_equal(loaded.transition_sources, counts.transition_sources)
+        np.testing.assert_array_equal(loaded.transition_targets, counts.transition_targets)
+        np.testing.assert_array_equal(loaded.transition_counts, counts.transition_counts)
+        np.testing.assert_array_equal(loaded.emission_counts, counts.emission_counts)
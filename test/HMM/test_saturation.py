@@ -0,0 +1,39 @@
+import unittest
+from typing import List
+
+import numpy as np
+
+from text_depixelizer.HMM.saturation import CoverageSaturation, SaturationPoint
+from text_depixelizer.training_pipeline.windows import Window
+
+
+def create_windows(characters: List[tuple]) -> List[Window]:
+    return [Window(characters=c, values=np.zeros(1), window_index=i) for i, c in enumerate(characters)]
+
+
+class TestCoverageSaturation(unittest.TestCase):
+
+    def test_add(self):
+        # Arrange
+        saturation: CoverageSaturation = CoverageSaturation(threshold=0.1)
+
+        # Act
+        saturation.add([create_windows([('a',), ('a', 'b'), ('b',)]), create_windows([('a',), ('b',)])],
+                       [[0, 1, 2], [0, 3]])
+        saturation.add([create_windows([('a',), ('a', 'b'), ('b',)])], [[0, 1, 2]])
+
+        # Assert: Transitions only within an image, nothing new in the second increment
+        self.assertEqual(saturation.curve, [SaturationPoint(2, 3, 3, 4), SaturationPoint(3, 3, 3, 4)])
+        self.assertEqual(saturation.discovery_rate, 0.0)
+        self.assertTrue(saturation.is_saturated())
+
+    def test_is_saturated(self):
+        # Arrange
+        saturation: CoverageSaturation = CoverageSaturation(threshold=0.1)
+
+        # Act & Assert: Not after the first increment, and not while an increment adds a new state
+        saturation.add([create_windows([('a',), ('b',)])], [[0, 1]])
+        self.assertFalse(saturation.is_saturated())
+        saturation.add([create_windows([('a',), ('c',)])], [[0, 1]])
+        self.assertAlmostEqual(saturation.discovery_rate, 1.0)
+        self.assertFalse(saturation.is_saturated())
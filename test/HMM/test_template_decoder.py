@@ -0,0 +1,79 @@
+import unittest
+from typing import List
+
+from PIL import ImageFont, Image
+
+from resources.fonts import DemoFontPaths
+from text_depixelizer.HMM.template_decoder import TemplateDecoder
+from text_depixelizer.benchmark import crop_pixelized_area
+from text_depixelizer.parameters import PictureParameters, TrainingParameters
+from text_depixelizer.seeding import get_seed_sequence
+from text_depixelizer.training_pipeline.training_pipeline import create_training_data
+
+
+class TestTemplateDecoder(unittest.TestCase):
+
+    picture_parameters: PictureParameters = PictureParameters(
+        block_size=8,
+        pattern=r'\d{6,8}',
+        font=ImageFont.truetype(str(DemoFontPaths.micr), 50),
+        randomize_pixelization_origin_x=True
+    )
+
+    training_parameters: TrainingParameters = TrainingParameters(
+        n_img_train=0,
+        n_img_test=10,
+        n_clusters=0,
+        seed=42,
+        state_model='templates'
+    )
+
+    def test_train(self):
+        # Arrange
+        decoder: TemplateDecoder = TemplateDecoder(self.picture_parameters, self.training_parameters)
+
+        # Act
+        decoder.train()
+
+        # Assert
+        self.assertEqual(decoder.states, list('0123456789'))
+        self.assertEqual(decoder.text_lengths, [6, 7, 8])
+        self.assertEqual(decoder.templates.shape[:3], (10, 8, decoder.n_rows))
+        self.assertTrue(((decoder.templates >= 0) & (decoder.templates <= 1)).all())
+
+    def test_test_images(self):
+        # Arrange
+        decoder: TemplateDecoder = TemplateDecoder(self.picture_parameters, self.training_parameters)
+        decoder.train()
+        texts, _, pixelized_images, _ = create_training_data(5, self.picture_parameters, get_seed_sequence(1, 0))
+        imgs: List[Image.Image] = [crop_pixelized_area(pixelized_image) for pixelized_image in pixelized_images]
+
+        # Act
+        reconstructed_texts, scores = decoder.score_images(imgs)
+
+        # Assert
+        self.assertEqual(reconstructed_texts, texts)
+        self.assertEqual(scores.shape, (5,))
+
+    def test_evaluate(self):
+        # Arrange
+        decoder: TemplateDecoder = TemplateDecoder(self.picture_parameters, self.training_parameters)
+        decoder.train()
+
+        # Act
+        accuracy, average_similarity = decoder.evaluate()
+
+        # Assert
+        self.assertEqual(accuracy, 1.0)
+        self.assertEqual(average_similarity, 1.0)
+
+    def test_proportional_font(self):
+        # Arrange
+        picture_parameters: PictureParameters = PictureParameters(
+            block_size=6, pattern=r'[a-z]{5}', font=ImageFont.truetype(str(DemoFontPaths.arial), 50)
+        )
+        decoder: TemplateDecoder = TemplateDecoder(picture_parameters, self.training_parameters)
+
+        # Act & Assert
+        with self.assertRaises(ValueError):
+            decoder.train()
@@ -0,0 +1,72 @@
+from typing import Tuple
+from unittest import TestCase
+
+from PIL import Image
+
+from test import utils
+from text_depixelizer.inference_pipeline.block_grid_detection import BlockGrid, detect_block_grid, align_to_block_grid
+from text_depixelizer.training_pipeline.pixelized_image import PixelizationOptions, PixelizedImage, pixelize_image
+
+
+class TestBlockGridDetection(TestCase):
+
+    def test_detect_block_grid_mosaic(self):
+        for block_size in [2, 6, 8, 16]:
+            for offset in [(0, 0), (1, 0), (3, 5)]:
+                # Arrange
+                img: Image = utils.create_random_mosaic((200, 120), block_size).crop((offset[0], offset[1], 200, 120))
+
+                # Act
+                block_grid: BlockGrid = detect_block_grid(img)
+
+                # Assert
+                self.assertEqual(block_grid.block_size, block_size)
+                self.assertEqual(block_grid.origin, ((-offset[0]) % block_size, (-offset[1]) % block_size))
+                self.assertAlmostEqual(block_grid.confidence, 1.0)
+
+    def test_detect_block_grid_pixelized_text(self):
+        # Arrange
+        block_size: int = 10
+        pixelized_image: PixelizedImage = pixelize_image(
+            utils.create_image(text='123456789'), PixelizationOptions(block_size=block_size, offset=(0, 3))
+        )
+
+        # Act
+        block_grid: BlockGrid = detect_block_grid(pixelized_image.image)
+
+        # Assert
+        self.assertEqual(block_grid.block_size, block_size)
+        self.assertEqual(block_grid.origin, (pixelized_image.origin[0] % block_size, pixelized_image.origin[1] % block_size))
+        self.assertGreater(block_grid.confidence, 0.5)
+
+    def test_detect_block_grid_given_block_size(self):
+        # Arrange
+        img: Image = utils.create_random_mosaic((120, 120), 12).crop((5, 0, 120, 120))
+
+        # Act
+        block_grid: BlockGrid = detect_block_grid(img, block_sizes=[12])
+
+        # Assert
+        self.assertEqual(block_grid.origin, (7, 0))
+
+    def test_detect_block_grid_single_color(self):
+        # Arrange
+        img: Image = Image.new('RGB', (50, 50), (255, 255, 255))
+
+        # Act
+        block_grid: BlockGrid = detect_block_grid(img)
+
+        # Assert
+        self.assertIsNone(block_grid)
+
+    def test_align_to_block_grid(self):
+        # Arrange
+        offset: Tuple[int, int] = (3, 5)
+        img: Image = utils.create_random_mosaic((120, 120), 8).crop((offset[0], offset[1], 120, 120))
+
+        # Act
+        aligned_img: Image = align_to_block_grid(img, detect_block_grid(img))
+
+        # Assert
+        self.assertEqual(detect_block_grid(aligned_img).origin, (0, 0))
+        self.assertEqual(aligned_img.getpixel((0, 0)), aligned_img.getpixel((7, 7)))
@@ -0,0 +1,57 @@
+from typing import List, Tuple
+from unittest import TestCase
+
+from PIL import Image, ImageFont
+
+from resources.fonts import DemoFontPaths
+from test.utils import create_screenshot
+from text_depixelizer.HMM.depix_hmm import DepixHMM
+from text_depixelizer.inference_pipeline.inference_pipeline import DecodedLine, decode_screenshots, get_rows_per_line
+from text_depixelizer.parameters import PictureParameters, TrainingParameters
+from text_depixelizer.training_pipeline.training_pipeline import create_training_data
+
+
+class TestInferencePipeline(TestCase):
+
+    picture_parameters: PictureParameters = PictureParameters(
+        pattern=r'\d{9}',
+        font=ImageFont.truetype(str(DemoFontPaths.arial), 50),
+        block_size=8,
+        window_size=4
+    )
+
+    def test_get_rows_per_line(self):
+        # Arrange
+        _, _, pixelized_images, _ = create_training_data(n_img=1, picture_parameters=self.picture_parameters)
+
+        # Act
+        rows_per_line: int = get_rows_per_line(self.picture_parameters)
+
+        # Assert
+        self.assertEqual(rows_per_line, pixelized_images[0].n_tiles[1])
+
+    def test_decode_screenshots(self):
+        # Arrange
+        depix_hmm: DepixHMM = DepixHMM(self.picture_parameters, TrainingParameters(n_img_train=50, n_img_test=1, n_clusters=50))
+        depix_hmm.train()
+
+        positions: List[Tuple[int, int]] = [(13, 20), (300, 150)]
+        _, _, pixelized_images, _ = create_training_data(n_img=2, picture_parameters=self.picture_parameters)
+        screenshots: List[Image.Image] = [
+            create_screenshot(pixelized_images, positions),
+            create_screenshot(pixelized_images[:1], positions[1:])
+        ]
+
+        # Act
+        decoded_lines: List[List[DecodedLine]] = decode_screenshots(depix_hmm, screenshots)
+
+        # Assert
+        self.assertListEqual([len(lines) for lines in decoded_lines], [2, 1])
+        for lines in decoded_lines:
+            for line in lines:
+                self.assertIsInstance(line.text, str)
+                self.assertEqual(line.region.n_tiles[1], get_rows_per_line(self.picture_parameters))
+
+        # Assert: The decoded crop covers the pasted pixelized image
+        top: int = decoded_lines[0][0].region.origin[1]
+        self.assertEqual((top - positions[0][1]) % self.picture_parameters.block_size, 0)
@@ -0,0 +1,65 @@
+from typing import List, Tuple
+from unittest import TestCase
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from test.utils import demo_picture_parameters, create_screenshot
+from text_depixelizer.inference_pipeline.region_detection import PixelizedRegion, detect_pixelized_regions, \
+    split_into_lines
+from text_depixelizer.training_pipeline.training_pipeline import create_training_data
+
+
+class TestRegionDetection(TestCase):
+
+    def test_detect_pixelized_regions(self):
+        # Arrange
+        block_size: int = demo_picture_parameters.block_size
+        positions: List[Tuple[int, int]] = [(13, 20), (301, 150), (40, 272)]
+        _, _, pixelized_images, _ = create_training_data(n_img=3, picture_parameters=demo_picture_parameters)
+        screenshot: Image = create_screenshot(pixelized_images, positions)
+
+        # Some sharp text, which must not be detected
+        ImageDraw.Draw(screenshot).text((500, 20), 'Not pixelized', font=demo_picture_parameters.font, fill=(0, 0, 0))
+
+        # Act
+        regions: List[PixelizedRegion] = detect_pixelized_regions(screenshot, block_size)
+
+        # Assert
+        self.assertEqual(len(regions), len(positions))
+        for region, position, pixelized_image in zip(regions, positions, pixelized_images):
+            self.assertEqual((region.origin[0] - position[0]) % block_size, 0)
+            self.assertEqual((region.origin[1] - position[1]) % block_size, 0)
+            self.assertGreaterEqual(region.origin[0], position[0])
+            self.assertGreaterEqual(region.origin[1], position[1])
+            self.assertLessEqual(region.box[2], position[0] + pixelized_image.n_tiles[0]*block_size)
+            self.assertLessEqual(region.box[3], position[1] + pixelized_image.n_tiles[1]*block_size)
+
+    def test_detect_pixelized_regions_empty_image(self):
+        # Arrange
+        img: Image = Image.new('RGB', (200, 100), (39, 48, 70))
+
+        # Act
+        regions: List[PixelizedRegion] = detect_pixelized_regions(img, block_size=6)
+
+        # Assert
+        self.assertListEqual(regions, [])
+
+    def test_split_into_lines(self):
+        # Arrange: Two lines of 3 rows each, separated by an empty row, and a band of 6 rows
+        block_mask: np.ndarray = np.zeros((14, 10), dtype=bool)
+        block_mask[0:3, 2:8] = True
+        block_mask[4:7, 0:5] = True
+        block_mask[8:14, 1:10] = True
+        region: PixelizedRegion = PixelizedRegion(n_tiles=(10, 14), block_size=6, origin=(100, 50), block_mask=block_mask)
+
+        # Act
+        lines: List[PixelizedRegion] = split_into_lines(region, rows_per_line=3)
+
+        # Assert
+        self.assertEqual(len(lines), 4)
+        self.assertEqual(lines[0].origin, (112, 50))
+        self.assertEqual(lines[0].n_tiles, (6, 3))
+        self.assertEqual(lines[1].origin, (100, 74))
+        self.assertEqual(lines[3].origin, (106, 116))
+        self.assertEqual(lines[3].n_tiles, (9, 3))
@@ -0,0 +1,61 @@
+import copy
+import tempfile
+from pathlib import Path
+from typing import List
+from unittest import TestCase
+
+from test.utils import demo_picture_parameters, demo_training_parameters
+from text_depixelizer.HMM.depix_hmm import DepixHMM
+from text_depixelizer.benchmark import run_benchmark_suite, compare_benchmarks, BenchmarkScale, measure_decode_worker
+
+
+class TestBenchmark(TestCase):
+    scales: List[BenchmarkScale] = [BenchmarkScale(name='tiny', n_img_train=5, n_img_test=2, n_clusters=3)]
+
+    def test_run_benchmark_suite(self):
+        # Act
+        report: dict = run_benchmark_suite(demo_picture_parameters, self.scales, repeats=2, seed=1)
+
+        # Assert
+        stages: List[str] = [result['stage'] for result in report['results']]
+        self.assertEqual(stages, ['text_generation', 'rendering', 'pixelization', 'windows', 'clustering_fit',
+                                  'clustering_assign', 'hmm_estimation', 'viterbi', 'reconstruction', 'decode',
+                                  'evaluate'])
+        for result in report['results']:
+            self.assertEqual(result['scale'], 'tiny')
+            self.assertEqual(result['repeats'], 2)
+            self.assertLessEqual(result['min_seconds'], result['median_seconds'])
+        self.assertEqual(report['parameters']['seed'], 1)
+
+    def test_compare_benchmarks(self):
+        # Arrange
+        baseline: dict = {'results': [
+            {'scale': 'tiny', 'stage': 'viterbi', 'min_seconds': 1.0},
+            {'scale': 'tiny', 'stage': 'rendering', 'min_seconds': 1.0}
+        ]}
+        current: dict = copy.deepcopy(baseline)
+        current['results'][0]['min_seconds'] = 1.5
+        current['results'][1]['min_seconds'] = 1.1
+
+        # Act
+        regressions: List[str] = compare_benchmarks(baseline, current, tolerance=0.2)
+
+        # Assert
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith('tiny/viterbi'))
+
+    def test_measure_decode_worker(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Arrange
+            path: Path = Path(tmp_dir) / 'model.npz'
+            depix_hmm: DepixHMM = DepixHMM(demo_picture_parameters, demo_training_parameters)
+            depix_hmm.train()
+            depix_hmm.to_compact_model().save(path)
+
+            # Act
+            measurements: dict = measure_decode_worker(path)
+
+            # Assert
+            self.assertFalse(measurements['sklearn_imported'])
+            self.assertGreater(measurements['max_rss_mb'], 0)
+            self.assertGreater(measurements['import_seconds'], 0)
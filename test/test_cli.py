@@ -0,0 +1,121 @@
+import io
+import json
+import tempfile
+from contextlib import redirect_stdout, redirect_stderr
+from pathlib import Path
+from typing import List
+from unittest import TestCase
+
+from test.utils import demo_picture_parameters
+from text_depixelizer.benchmark import crop_pixelized_area
+from text_depixelizer.cli import main
+from text_depixelizer.training_pipeline.training_pipeline import create_training_data
+
+
+def run_cli(argv: List[str]) -> str:
+    stdout: io.StringIO = io.StringIO()
+    with redirect_stdout(stdout):
+        main(argv)
+    return stdout.getvalue()
+
+
+class TestCli(TestCase):
+    model_arguments: List[str] = ['--pattern', '123456789', '--font', 'arial', '--font-size', '50', '--block-size', '6',
+                                  '--n-img-train', '7', '--n-img-test', '3', '--n-clusters', '3', '--seed', '0']
+
+    def test_train_evaluate_decode(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Arrange
+            model_path: Path = Path(tmp_dir) / 'model.pickle'
+            compact_path: Path = Path(tmp_dir) / 'model.npz'
+            image_dir: Path = Path(tmp_dir) / 'images'
+            image_dir.mkdir()
+            _, _, pixelized_images, _ = create_training_data(4, demo_picture_parameters)
+            for i, pixelized_image in enumerate(pixelized_images):
+                crop_pixelized_area(pixelized_image).save(image_dir / f'{i}.png')
+
+            # Act
+            trained: dict = json.loads(run_cli(['train', *self.model_arguments, '--output', str(model_path)]))
+            evaluated: dict = json.loads(run_cli(['evaluate', '--model', str(model_path)]))
+            decoded: List[str] = run_cli(['decode', '--model', str(model_path), '--workers', '2', str(image_dir)]) \
+                .splitlines()
+            decoded_ensemble: List[str] = run_cli(
+                ['decode', '--model', str(model_path), str(model_path), '--fuse', str(image_dir)]
+            ).splitlines()
+            exported: dict = json.loads(run_cli(['export', '--model', str(model_path), '--output', str(compact_path)]))
+            decoded_compact: List[str] = run_cli(['decode', str(image_dir), '--model', str(compact_path)]).splitlines()
+
+            # Assert
+            self.assertTrue(model_path.exists())
+            self.assertGreater(trained['n_states'], 0)
+            self.assertTrue(0 <= evaluated['accuracy'] <= 1)
+            self.assertEqual(len(decoded), 4)
+            self.assertTrue(all(line.split('\t')[0].endswith('.png') for line in decoded))
+            self.assertEqual(decoded_ensemble, decoded)
+            self.assertEqual(exported['n_states'], trained['n_states'])
+            self.assertEqual(decoded_compact, decoded)
+
+    def test_train_with_cache_dir(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Act
+            first: dict = json.loads(run_cli(['train', *self.model_arguments, '--cache-dir', tmp_dir]))
+            second: dict = json.loads(run_cli(['train', *self.model_arguments, '--cache-dir', tmp_dir]))
+
+            # Assert
+            self.assertEqual(first['model'], second['model'])
+            self.assertTrue(Path(first['model']).exists())
+
+    def test_train_with_saturation_threshold(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Act: The pattern is a single text, so the second increment adds nothing new
+            trained: dict = json.loads(run_cli(['train', *self.model_arguments, '--n-img-train', '20',
+                                                '--saturation-threshold', '0.01', '--saturation-increment', '5',
+                                                '--output', str(Path(tmp_dir) / 'model.pickle')]))
+
+            # Assert
+            self.assertEqual(trained['n_img_train'], 10)
+            self.assertEqual([point['n_img'] for point in trained['saturation_curve']], [5, 10])
+
+    def test_train_sharded(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Act
+            trained: dict = json.loads(run_cli(['train', *self.model_arguments, '--shards', '2', '--workers', '2',
+                                                '--shard-dir', str(Path(tmp_dir) / 'shards'),
+                                                '--output', str(Path(tmp_dir) / 'model.pickle')]))
+
+            # Assert
+            self.assertGreater(trained['n_states'], 0)
+            self.assertTrue((Path(tmp_dir) / 'shards' / 'counts-1.npz').exists())
+
+    def test_train_sharded_cache_dir(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Act
+            trained: dict = json.loads(run_cli(['train', *self.model_arguments, '--shards', '2',
+                                                '--cache-dir', tmp_dir]))
+
+            # Assert: The sharded model is cached like any other
+            self.assertEqual(Path(trained['model']).parent, Path(tmp_dir))
+            self.assertTrue(Path(trained['model']).exists())
+
+    def test_bench(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Arrange
+            output_path: Path = Path(tmp_dir) / 'timings.json'
+
+            # Act
+            run_cli(['bench', *self.model_arguments, '--n-img-decode', '5', '--output', str(output_path)])
+
+            # Assert
+            timings: dict = json.loads(output_path.read_text())
+            for key in ('train', 'evaluate', 'decode', 'accuracy'):
+                self.assertIn(key, timings)
+
+    def test_bench_unknown_scales(self):
+        # Act & Assert
+        with redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+            run_cli(['bench', *self.model_arguments, '--suite', '--scales', 'small,huge'])
+
+    def test_evaluate_has_no_workers(self):
+        # Act & Assert: Only sharded training and decoding run several processes
+        with redirect_stderr(io.StringIO()), self.assertRaises(SystemExit):
+            run_cli(['evaluate', '--model', 'model.pickle', '--workers', '2'])
@@ -1,12 +1,17 @@
 import logging
-from unittest import TestCase
+import tempfile
+from pathlib import Path
+from unittest import TestCase, mock
 
-from PIL import ImageFont
+from PIL import ImageFont, Image
 from PIL.ImageFont import FreeTypeFont
 
 from resources.fonts import DemoFontPaths
-from text_depixelizer.depix_hmm import depix_hmm_grid_search
-from text_depixelizer.parameters import PictureParametersGridSearch, TrainingParametersGridSearch, LoggingParameters
+from test.utils import create_random_mosaic
+from text_depixelizer import depix_hmm
+from text_depixelizer.depix_hmm import depix_hmm_grid_search, align_image, depix_hmm_successive_halving, load_image
+from text_depixelizer.parameters import PictureParametersGridSearch, TrainingParametersGridSearch, LoggingParameters, \
+    PictureParameters
 
 
 class TestDepixHmm(TestCase):
@@ -36,3 +41,123 @@ class TestDepixHmm(TestCase):
 
         # Assert
         pass
+
+    def test_depix_hmm_grid_search_bisecting(self):
+        # Arrange: One cluster tree per window size, cut for every n_clusters
+        picture_parameters: PictureParametersGridSearch = PictureParametersGridSearch(
+            pattern=r'\d{8,12}',
+            font=ImageFont.truetype(str(DemoFontPaths.arial), 50),
+            block_size=6,
+            window_size=[4, 5]
+        )
+
+        training_parameters: TrainingParametersGridSearch = TrainingParametersGridSearch(
+            n_img_test=50,
+            n_clusters=[20, 50],
+            n_img_train=[60],
+            clustering='bisecting',
+            seed=0
+        )
+
+        # Act
+        reconstructed_string = depix_hmm_grid_search(picture_parameters, training_parameters)
+
+        # Assert
+        self.assertIsNone(reconstructed_string)
+
+    def test_depix_hmm_grid_search_coverage(self):
+        # Arrange: Every cell keeps the features and colors of the search
+        picture_parameters: PictureParametersGridSearch = PictureParametersGridSearch(
+            pattern=r'\d{8,12}',
+            font=ImageFont.truetype(str(DemoFontPaths.arial), 50),
+            font_color=(0, 0, 128),
+            background_color=(240, 240, 240),
+            block_size=6,
+            randomize_pixelization_origin_x=True,
+            window_size=[4, 5],
+            features='coverage'
+        )
+
+        training_parameters: TrainingParametersGridSearch = TrainingParametersGridSearch(
+            n_img_test=50,
+            n_clusters=[50],
+            n_img_train=[100],
+            seed=0
+        )
+
+        # Act
+        with mock.patch.object(depix_hmm, 'create_model', wraps=depix_hmm.create_model) as create_model:
+            depix_hmm_grid_search(picture_parameters, training_parameters)
+
+        # Assert
+        self.assertEqual(create_model.call_count, 2)
+        for (cell_picture_parameters, cell_training_parameters), _ in create_model.call_args_list:
+            self.assertEqual(cell_picture_parameters.features, 'coverage')
+            self.assertEqual(cell_picture_parameters.font_color, (0, 0, 128))
+            self.assertEqual(cell_picture_parameters.background_color, (240, 240, 240))
+            self.assertTrue(cell_picture_parameters.randomize_pixelization_origin_x)
+            self.assertEqual(cell_training_parameters.seed, 0)
+
+    def test_depix_hmm_successive_halving(self):
+        # Arrange
+        picture_parameters: PictureParametersGridSearch = PictureParametersGridSearch(
+            pattern=r'\d{8,12}',
+            font=ImageFont.truetype(str(DemoFontPaths.arial), 50),
+            block_size=6,
+            window_size=[4, 5]
+        )
+
+        training_parameters: TrainingParametersGridSearch = TrainingParametersGridSearch(
+            n_img_test=50,
+            n_clusters=[20, 50],
+            n_img_train=[60, 120],
+            seed=0
+        )
+
+        # Act
+        reconstructed_string = depix_hmm_successive_halving(picture_parameters, training_parameters)
+
+        # Assert
+        self.assertIsNone(reconstructed_string)
+
+    def test_align_image_infers_block_size(self):
+        # Arrange
+        picture_parameters: PictureParameters = PictureParameters(
+            pattern=r'\d{8,12}',
+            font=ImageFont.truetype(str(DemoFontPaths.arial), 50)
+        )
+        img: Image = create_random_mosaic((240, 60), 6).crop((2, 1, 240, 60))
+
+        # Act
+        aligned_img, aligned_picture_parameters = align_image(img, picture_parameters)
+
+        # Assert
+        self.assertEqual(aligned_picture_parameters.block_size, 6)
+        self.assertIsNone(picture_parameters.block_size)
+        self.assertEqual(aligned_img.size, (240 - 2 - 4, 60 - 1 - 5))
+
+
+    def test_load_image_aligns_only_without_block_size(self):
+        # Arrange
+        picture_parameters: PictureParameters = PictureParameters(
+            pattern=r'\d{8,12}',
+            font=ImageFont.truetype(str(DemoFontPaths.arial), 50),
+            block_size=6
+        )
+        img: Image = create_random_mosaic((240, 60), 6).crop((2, 1, 240, 60))
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            img_path: Path = Path(tmp_dir) / 'mosaic.png'
+            img.save(img_path)
+            single_color_path: Path = Path(tmp_dir) / 'single_color.png'
+            Image.new('RGB', (60, 12), (255, 255, 255)).save(single_color_path)
+
+            # Act
+            loaded_img, _ = load_image(img_path, picture_parameters)
+            aligned_img, _ = load_image(img_path, picture_parameters, align=True)
+            single_color_img, _ = load_image(single_color_path, picture_parameters, align=True)
+
+        # Assert
+        self.assertEqual(loaded_img.size, img.size)
+        self.assertEqual(aligned_img.size, (240 - 2 - 4, 60 - 1 - 5))
+        self.assertEqual(single_color_img.size, (60, 12))
@@ -0,0 +1,70 @@
+import dataclasses
+from typing import List, Tuple
+from unittest import TestCase
+
+import numpy as np
+from PIL import Image
+
+from test.utils import demo_picture_parameters, demo_training_parameters
+from text_depixelizer.benchmark import crop_pixelized_area
+from text_depixelizer.ensemble import EnsembleDecoder, EnsembleResult
+from text_depixelizer.parameters import TrainingParameters
+from text_depixelizer.seeding import get_seed_sequence
+from text_depixelizer.training_pipeline.training_pipeline import create_training_data
+
+
+class IncompatibleModel:
+    """
+    Fails like a model that expects images of a different size
+    """
+    def score_images(self, imgs: List[Image.Image]) -> Tuple[List[str], np.ndarray]:
+        raise ValueError('X has 30 features, but KMeans is expecting 45 features as input')
+
+
+class TestEnsembleDecoder(TestCase):
+
+    training_parameters: TrainingParameters = dataclasses.replace(demo_training_parameters, seed=42, smoothing=0.01,
+                                                                  n_clusters=30)
+
+    def test_decode_images(self):
+        # Arrange
+        ensemble: EnsembleDecoder = EnsembleDecoder.from_offsets(
+            demo_picture_parameters, self.training_parameters, offsets_y=[0, 3]
+        )
+        ensemble.models.append(IncompatibleModel())
+        texts, _, pixelized_images, _ = create_training_data(
+            3, dataclasses.replace(demo_picture_parameters, offset_y=3), get_seed_sequence(1, 0)
+        )
+
+        # Act
+        results: List[EnsembleResult] = ensemble.decode_images(
+            [crop_pixelized_area(pixelized_image) for pixelized_image in pixelized_images]
+        )
+        ensemble.close()
+
+        # Assert
+        self.assertEqual(len(results), 3)
+        for text, result in zip(texts, results):
+            # The model of the images' offset wins
+            self.assertEqual(result.model_index, 1)
+            self.assertEqual(result.text, text)
+            self.assertEqual(len(result.candidates), 3)
+            self.assertEqual(result.candidates[2], ('', -np.inf))
+            self.assertEqual(result.log_likelihood, max(score for _, score in result.candidates))
+            self.assertEqual(result.text, result.candidates[result.model_index][0])
+
+    def test_combine(self):
+        # Arrange
+        texts: List[str] = ['123', '128', '128', '']
+        scores: np.ndarray = np.array([-10.0, -10.5, -10.5, -np.inf])
+
+        # Act
+        best: EnsembleResult = EnsembleDecoder([], fuse=False).combine(texts, scores)
+        fused: EnsembleResult = EnsembleDecoder([], fuse=True).combine(texts, scores)
+        nothing: EnsembleResult = EnsembleDecoder([]).combine(['', ''], np.array([-np.inf, -np.inf]))
+
+        # Assert
+        self.assertEqual((best.text, best.model_index), ('123', 0))
+        self.assertEqual((fused.text, fused.model_index), ('128', 1))
+        self.assertAlmostEqual(fused.log_likelihood, -10.5 + np.log(2))
+        self.assertEqual(nothing.model_index, -1)
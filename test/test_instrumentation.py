@@ -0,0 +1,78 @@
+import time
+from typing import List
+from unittest import TestCase
+
+import numpy as np
+
+from text_depixelizer.instrumentation import span, record_run, NullSpan, Recorder, StageSummary, instrumented
+
+
+@instrumented('decorated')
+def decorated_function() -> int:
+    with span('inner', n_items=2):
+        return 1
+
+
+class TestInstrumentation(TestCase):
+
+    def test_span_without_recording(self):
+        # Act
+        with span('stage') as s:
+            s.add_items(3)
+
+        # Assert
+        self.assertIsInstance(s, NullSpan)
+
+    def test_nested_spans(self):
+        # Act
+        with record_run() as recorder:
+            with span('train'):
+                for _ in range(2):
+                    with span('render', n_items=5) as s:
+                        s.add_items(1)
+                with span('kmeans.fit'):
+                    time.sleep(0.01)
+            decorated_function()
+
+        # Assert
+        summaries: List[StageSummary] = recorder.summarize()
+        self.assertEqual([s.path for s in summaries], [
+            ('train',), ('train', 'render'), ('train', 'kmeans.fit'), ('decorated',), ('decorated', 'inner')
+        ])
+        render: StageSummary = summaries[1]
+        self.assertEqual(render.calls, 2)
+        self.assertEqual(render.n_items, 12)
+        self.assertGreaterEqual(summaries[0].wall_time, summaries[2].wall_time)
+        self.assertGreaterEqual(summaries[2].wall_time, 0.01)
+        self.assertGreater(summaries[0].peak_rss, 0)
+
+    def test_trace_memory(self):
+        # Act
+        with record_run(trace_memory=True) as recorder:
+            with span('outer'):
+                with span('allocate'):
+                    array: np.ndarray = np.ones(2**20)
+                    del array
+
+        # Assert
+        outer, allocate = recorder.summarize()
+        self.assertGreaterEqual(allocate.peak_traced_memory, 8 * 2**20)
+        self.assertGreaterEqual(outer.peak_traced_memory, allocate.peak_traced_memory)
+
+    def test_reports(self):
+        # Arrange
+        recorder: Recorder
+        with record_run() as recorder:
+            with span('train'):
+                with span('render', n_items=1):
+                    pass
+
+        # Act
+        collapsed_stacks: List[str] = recorder.collapsed_stacks().splitlines()
+        summary: str = recorder.format_summary()
+        report: dict = recorder.to_dict()
+
+        # Assert
+        self.assertEqual([line.split(' ')[0] for line in collapsed_stacks], ['train', 'train;render'])
+        self.assertIn('  render', summary)
+        self.assertEqual([stage['path'] for stage in report['stages']], ['train', 'train/render'])
@@ -0,0 +1,110 @@
+import dataclasses
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import List
+from unittest import TestCase
+
+from test.utils import demo_picture_parameters, demo_training_parameters
+from text_depixelizer.HMM.depix_hmm import DepixHMM
+from text_depixelizer.model_registry import ModelRegistry, get_model_key, train_model, estimate_model_size
+from text_depixelizer.parameters import PictureParameters, TrainingParameters
+
+
+class CountingBuilder:
+    """
+    Trains the demo model and counts how often it was called
+    """
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.calls: List[str] = []
+        self._lock = threading.Lock()
+
+    def __call__(self, picture_parameters: PictureParameters, training_parameters: TrainingParameters) -> DepixHMM:
+        with self._lock:
+            self.calls.append(get_model_key(picture_parameters, training_parameters))
+        time.sleep(self.delay)
+        return train_model(picture_parameters, training_parameters)
+
+
+class TestModelRegistry(TestCase):
+
+    def test_get_model_key(self):
+        # Arrange
+        other_block_size: PictureParameters = dataclasses.replace(demo_picture_parameters, block_size=8)
+        copied: PictureParameters = dataclasses.replace(demo_picture_parameters)
+
+        # Act
+        key: str = get_model_key(demo_picture_parameters, demo_training_parameters)
+
+        # Assert
+        self.assertEqual(key, get_model_key(copied, demo_training_parameters))
+        self.assertNotEqual(key, get_model_key(other_block_size, demo_training_parameters))
+
+    def test_get_caches_model(self):
+        # Arrange
+        builder: CountingBuilder = CountingBuilder()
+        registry: ModelRegistry = ModelRegistry(build_model=builder)
+
+        # Act
+        first: DepixHMM = registry.get(demo_picture_parameters, demo_training_parameters)
+        second: DepixHMM = registry.get(demo_picture_parameters, demo_training_parameters)
+
+        # Assert
+        self.assertIs(first, second)
+        self.assertEqual(len(builder.calls), 1)
+        self.assertGreater(estimate_model_size(first), 0)
+
+    def test_concurrent_requests_build_once(self):
+        # Arrange
+        builder: CountingBuilder = CountingBuilder(delay=0.2)
+        registry: ModelRegistry = ModelRegistry(build_model=builder)
+        models: List[DepixHMM] = []
+
+        def request():
+            models.append(registry.get(demo_picture_parameters, demo_training_parameters))
+
+        # Act
+        threads: List[threading.Thread] = [threading.Thread(target=request) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        # Assert
+        self.assertEqual(len(builder.calls), 1)
+        self.assertEqual(len(models), 8)
+        self.assertTrue(all(model is models[0] for model in models))
+
+    def test_lru_eviction(self):
+        # Arrange
+        builder: CountingBuilder = CountingBuilder()
+        registry: ModelRegistry = ModelRegistry(memory_budget=1, build_model=builder)
+        picture_parameters: List[PictureParameters] = [
+            dataclasses.replace(demo_picture_parameters, window_size=window_size) for window_size in [3, 4]
+        ]
+
+        # Act
+        for p in picture_parameters + picture_parameters[:1]:
+            registry.get(p, demo_training_parameters)
+
+        # Assert: Only the most recently used model stays resident and evicted models are built again
+        self.assertEqual(len(builder.calls), 3)
+        self.assertIn(get_model_key(picture_parameters[0], demo_training_parameters), registry)
+        self.assertNotIn(get_model_key(picture_parameters[1], demo_training_parameters), registry)
+
+    def test_cache_dir(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            # Arrange
+            builder: CountingBuilder = CountingBuilder()
+            ModelRegistry(cache_dir=Path(cache_dir), build_model=builder).get(demo_picture_parameters, demo_training_parameters)
+
+            # Act
+            model: DepixHMM = ModelRegistry(cache_dir=Path(cache_dir), build_model=builder)\
+                .get(demo_picture_parameters, demo_training_parameters)
+
+            # Assert
+            self.assertEqual(len(builder.calls), 1)
+            self.assertGreater(len(model.states), 0)
+            self.assertEqual(model.picture_parameters.font.size, demo_picture_parameters.font.size)
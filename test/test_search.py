@@ -0,0 +1,48 @@
+import dataclasses
+from typing import List, Tuple
+from unittest import TestCase
+
+from test.utils import demo_picture_parameters, demo_training_parameters
+from text_depixelizer.parameters import PictureParameters, TrainingParameters
+from text_depixelizer.search import get_rungs, successive_halving, SearchResult
+
+
+class TestSearch(TestCase):
+
+    def test_get_rungs(self):
+        # Act & Assert
+        self.assertEqual(get_rungs([100, 30, 100], n_candidates=20), [30, 100])
+        self.assertEqual(get_rungs([900], n_candidates=20), [100, 300, 900])
+        self.assertEqual(get_rungs([900], n_candidates=1), [900])
+
+    def test_successive_halving(self):
+        # Arrange
+        candidates: List[Tuple[PictureParameters, TrainingParameters]] = [
+            (dataclasses.replace(demo_picture_parameters, window_size=window_size),
+             dataclasses.replace(demo_training_parameters, n_clusters=n_clusters, seed=1, smoothing=0.01))
+            for window_size in (3, 4) for n_clusters in (3, 5)
+        ]
+
+        # Act
+        best_hmm, results = successive_halving(candidates, rungs=[4, 8], eta=2)
+
+        # Assert: All candidates on the first rung, the better half on the second
+        self.assertEqual([result.rung for result in results], [0, 0, 0, 0, 1, 1])
+        self.assertEqual([result.training_parameters.n_img_train for result in results], [4, 4, 4, 4, 8, 8])
+        best: SearchResult = max(results[4:], key=lambda result: (result.accuracy, result.average_similarity))
+        self.assertEqual(best_hmm.picture_parameters, best.picture_parameters)
+        self.assertEqual(best_hmm.training_parameters, best.training_parameters)
+
+    def test_successive_halving_skips_failing_candidates(self):
+        # Arrange: More clusters than windows
+        candidates: List[Tuple[PictureParameters, TrainingParameters]] = [
+            (demo_picture_parameters, dataclasses.replace(demo_training_parameters, n_clusters=n_clusters, seed=1))
+            for n_clusters in (3, 10000)
+        ]
+
+        # Act
+        best_hmm, results = successive_halving(candidates, rungs=[4])
+
+        # Assert
+        self.assertIsNotNone(results[1].error)
+        self.assertEqual(best_hmm.training_parameters.n_clusters, 3)
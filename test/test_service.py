@@ -0,0 +1,145 @@
+import asyncio
+import io
+import json
+from typing import List, Tuple
+from unittest import IsolatedAsyncioTestCase
+
+import numpy as np
+from PIL import Image
+
+from test.utils import demo_picture_parameters, demo_training_parameters
+from text_depixelizer.model_registry import ModelRegistry
+from text_depixelizer.service import DecodeService, DecodeResult
+from text_depixelizer.training_pipeline.training_pipeline import create_training_data
+
+
+async def http_request(port: int, method: str, path: str, body: bytes = b'') -> Tuple[int, dict]:
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f'{method} {path} HTTP/1.1\r\nHost: localhost\r\nContent-Length: {len(body)}\r\n\r\n'.encode() + body)
+    await writer.drain()
+    response: bytes = await reader.read()
+    writer.close()
+
+    head, _, payload = response.partition(b'\r\n\r\n')
+    status: int = int(head.split(b' ')[1])
+    return status, json.loads(payload)
+
+
+class FailingModel:
+    """
+    Decodes every image as 'ok', but fails on batches with an image that is narrower than a block, or of
+    different heights like DepixHMM.score_images
+    """
+    def score_images(self, imgs: List[Image.Image]) -> Tuple[List[str], np.ndarray]:
+        if any(img.size[0] < demo_picture_parameters.block_size for img in imgs):
+            raise ValueError('The image is narrower than a block')
+        if len({img.size[1] // demo_picture_parameters.block_size for img in imgs}) > 1:
+            raise ValueError('All images of a batch must have the same height in blocks')
+        return ['ok'] * len(imgs), np.zeros(len(imgs))
+
+
+class TestDecodeService(IsolatedAsyncioTestCase):
+
+    def setUp(self):
+        self.service: DecodeService = DecodeService(
+            model_registry=ModelRegistry(),
+            models={'demo': (demo_picture_parameters, demo_training_parameters)},
+            batch_window=0.2
+        )
+        _, _, pixelized_images, _ = create_training_data(n_img=4, picture_parameters=demo_picture_parameters)
+        self.imgs: List[Image.Image] = [
+            p.image.crop((p.origin[0], p.origin[1], p.origin[0] + p.n_tiles[0]*p.block_size, p.origin[1] + p.n_tiles[1]*p.block_size))
+            for p in pixelized_images
+        ]
+
+    def tearDown(self):
+        self.service.close()
+
+    async def test_decode_batches_concurrent_requests(self):
+        # Act
+        results: List[DecodeResult] = await asyncio.gather(*[self.service.decode('demo', img) for img in self.imgs])
+
+        # Assert
+        self.assertTrue(all(result.batch_size == len(self.imgs) for result in results))
+        hmm = self.service.model_registry.get(demo_picture_parameters, demo_training_parameters)
+        self.assertListEqual([result.text for result in results], hmm.test_images(self.imgs))
+        self.assertTrue(all(result.timings['total'] >= result.timings['decode'] for result in results))
+
+    async def test_decode_full_batches(self):
+        # Arrange
+        self.service.max_batch_size = 2
+
+        # Act
+        results: List[DecodeResult] = await asyncio.gather(*[self.service.decode('demo', img) for img in self.imgs])
+
+        # Assert: Full batches are decoded right away and cancel their timer
+        self.assertTrue(all(result.batch_size == 2 for result in results))
+        self.assertTrue(all(result.timings['queue'] < self.service.batch_window for result in results))
+        self.assertDictEqual(self.service._timers, {})
+        self.assertSetEqual(self.service._tasks, set())
+
+    async def test_decode_mixed_heights(self):
+        # Arrange: One image is a block row higher than the others
+        service: DecodeService = DecodeService(
+            model_registry=ModelRegistry(build_model=lambda picture_parameters, training_parameters: FailingModel()),
+            models={'demo': (demo_picture_parameters, demo_training_parameters)},
+            batch_window=0.2
+        )
+        tall_img: Image.Image = self.imgs[1].crop((0, 0, self.imgs[1].size[0], self.imgs[1].size[1] + 6))
+
+        # Act
+        results: List[DecodeResult] = await asyncio.gather(
+            *[service.decode('demo', img) for img in [self.imgs[0], tall_img, self.imgs[2]]]
+        )
+        service.close()
+
+        # Assert: The images of every height are decoded in a batch of their own
+        self.assertListEqual([result.text for result in results], ['ok'] * 3)
+        self.assertListEqual([result.batch_size for result in results], [2, 1, 2])
+
+    async def test_decode_failing_image(self):
+        # Arrange: The image that is narrower than a block fails, and with it its batch
+        service: DecodeService = DecodeService(
+            model_registry=ModelRegistry(build_model=lambda picture_parameters, training_parameters: FailingModel()),
+            models={'demo': (demo_picture_parameters, demo_training_parameters)},
+            batch_window=0.2
+        )
+        narrow_img: Image.Image = self.imgs[0].crop((0, 0, 3, self.imgs[0].size[1]))
+
+        # Act
+        results: List = await asyncio.gather(service.decode('demo', self.imgs[0]), service.decode('demo', narrow_img),
+                                             return_exceptions=True)
+        service.close()
+
+        # Assert: Only the request of the failing image gets the error
+        self.assertEqual(results[0].text, 'ok')
+        self.assertIsInstance(results[1], ValueError)
+
+    async def test_http(self):
+        # Arrange
+        server: asyncio.AbstractServer = await self.service.start(port=0)
+        port: int = server.sockets[0].getsockname()[1]
+        bodies: List[bytes] = []
+        for img in self.imgs[:2]:
+            buffer: io.BytesIO = io.BytesIO()
+            img.save(buffer, format='PNG')
+            bodies.append(buffer.getvalue())
+
+        # Act
+        models_response = await http_request(port, 'GET', '/models')
+        decode_responses = await asyncio.gather(*[http_request(port, 'POST', '/decode/demo', body) for body in bodies])
+        unknown_model_response = await http_request(port, 'POST', '/decode/unknown', bodies[0])
+        invalid_image_response = await http_request(port, 'POST', '/decode/demo', b'no image')
+
+        server.close()
+        await server.wait_closed()
+
+        # Assert
+        self.assertEqual(models_response, (200, {'models': ['demo']}))
+        for status, response in decode_responses:
+            self.assertEqual(status, 200)
+            self.assertIsInstance(response['text'], str)
+            self.assertEqual(response['batch_size'], 2)
+            self.assertIn('decode', response['timings'])
+        self.assertEqual(unknown_model_response[0], 404)
+        self.assertEqual(invalid_image_response[0], 400)
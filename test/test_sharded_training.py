@@ -0,0 +1,112 @@
+import dataclasses
+import tempfile
+import unittest
+from pathlib import Path
+from typing import List
+
+import numpy as np
+
+from test.utils import demo_training_parameters, demo_picture_parameters
+from text_depixelizer.HMM.clusterer import CentroidClusterer
+from text_depixelizer.HMM.depix_hmm import DepixHMM
+from text_depixelizer.parameters import TrainingParameters, PictureParameters
+from text_depixelizer.sharded_training import train_sharded, get_shard_range, generate_shard, get_partial_sums, \
+    reduce_partial_sums, load_shard
+from text_depixelizer.training_pipeline.training_pipeline import create_seeded_training_data
+
+
+class TestShardedTraining(unittest.TestCase):
+
+    def test_get_shard_range(self):
+        # Act
+        ranges: List[tuple] = [get_shard_range(10, 3, shard) for shard in range(3)]
+
+        # Assert
+        self.assertEqual(ranges, [(0, 3), (3, 6), (6, 10)])
+
+    def test_train_sharded(self):
+        # Arrange
+        training_parameters: TrainingParameters = dataclasses.replace(demo_training_parameters, seed=42)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Act
+            hmm: DepixHMM = train_sharded(demo_picture_parameters, training_parameters, n_shards=3,
+                                          shard_dir=Path(tmp_dir), n_workers=2)
+            expected: DepixHMM = DepixHMM(demo_picture_parameters, training_parameters)
+            expected.train(clusterer=CentroidClusterer(hmm.clusterer.centroids))
+
+        # Assert: The merged counts give the model of training on all images in one process
+        self.assertEqual(hmm.states, expected.states)
+        np.testing.assert_array_equal(hmm.starting_probabilities, expected.starting_probabilities)
+        np.testing.assert_array_equal(hmm.transition_probabilities, expected.transition_probabilities)
+        np.testing.assert_array_equal(hmm.emission_probabilities, expected.emission_probabilities)
+        self.assertTrue(0 <= hmm.evaluate()[0] <= 1)
+
+    def test_partial_sums(self):
+        # Arrange
+        training_parameters: TrainingParameters = dataclasses.replace(demo_training_parameters, seed=42)
+        _, _, _, windows = create_seeded_training_data(training_parameters.n_img_train, demo_picture_parameters, seed=42)
+        values: np.ndarray = np.array([window.values for image_windows in windows for window in image_windows],
+                                      dtype=float)
+        centroids: np.ndarray = values[:3]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            shard_dir: Path = Path(tmp_dir)
+            np.save(shard_dir / 'centroids-0.npy', centroids)
+
+            # Act
+            for shard in range(3):
+                generate_shard(demo_picture_parameters, training_parameters, 3, shard, shard_dir)
+            new_centroids, inertia = reduce_partial_sums(
+                [get_partial_sums(shard_dir, shard, 0) for shard in range(3)], centroids
+            )
+
+        # Assert: One step of Lloyd's algorithm on all windows
+        distances: np.ndarray = ((values[:, np.newaxis] - centroids[np.newaxis]) ** 2).sum(axis=2)
+        k_values: np.ndarray = distances.argmin(axis=1)
+        np.testing.assert_allclose(new_centroids, [values[k_values == k].mean(axis=0) for k in range(3)])
+        self.assertAlmostEqual(inertia, distances.min(axis=1).sum(), delta=1e-6 * inertia)
+
+    def test_generate_shard_coverage_texts(self):
+        # Arrange
+        training_parameters: TrainingParameters = dataclasses.replace(demo_training_parameters, seed=42,
+                                                                      text_generation='coverage')
+        _, _, _, windows = create_seeded_training_data(training_parameters.n_img_train, demo_picture_parameters,
+                                                       seed=42, text_generation='coverage')
+        expected: List[tuple] = [window.characters for image_windows in windows for window in image_windows]
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Act
+            characters: List[tuple] = []
+            for shard in range(3):
+                generate_shard(demo_picture_parameters, training_parameters, 3, shard, Path(tmp_dir))
+                characters += [window.characters for window in load_shard(Path(tmp_dir), shard)]
+
+        # Assert: The shards continue the coverage texts of a single process
+        self.assertEqual(characters, expected)
+
+    def test_train_sharded_too_many_shards(self):
+        # Arrange
+        training_parameters: TrainingParameters = dataclasses.replace(demo_training_parameters, seed=42)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Act & Assert
+            with self.assertRaises(ValueError):
+                train_sharded(demo_picture_parameters, training_parameters,
+                              n_shards=training_parameters.n_img_train + 1, shard_dir=Path(tmp_dir))
+
+    def test_train_sharded_coverage_features(self):
+        # Arrange
+        picture_parameters: PictureParameters = dataclasses.replace(demo_picture_parameters, features='coverage')
+        training_parameters: TrainingParameters = dataclasses.replace(demo_training_parameters, seed=42)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            # Act
+            hmm: DepixHMM = train_sharded(picture_parameters, training_parameters, n_shards=2,
+                                          shard_dir=Path(tmp_dir), n_workers=1)
+            expected: DepixHMM = DepixHMM(picture_parameters, training_parameters)
+            expected.train(clusterer=CentroidClusterer(hmm.clusterer.centroids))
+
+        # Assert: The colors of the images to decode are detected with the ink coverage of all shards
+        self.assertLess(hmm.ink_percentile, 1)
+        self.assertEqual(hmm.ink_percentile, expected.ink_percentile)
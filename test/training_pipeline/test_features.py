@@ -0,0 +1,81 @@
+import dataclasses
+from typing import List, Tuple
+from unittest import TestCase
+
+import numpy as np
+
+from test.utils import demo_picture_parameters
+from text_depixelizer.parameters import PictureParameters
+from text_depixelizer.training_pipeline.features import get_ink_coverage, detect_colors, get_features, \
+    get_ink_percentile
+from text_depixelizer.training_pipeline.pixelized_image import PixelizedImage
+from text_depixelizer.training_pipeline.training_pipeline import create_seeded_training_data
+from text_depixelizer.training_pipeline.windows import get_block_values
+
+
+def create_block_values(picture_parameters: PictureParameters, seed: int = 0) -> np.ndarray:
+    _, _, pixelized_images, _ = create_seeded_training_data(1, picture_parameters, seed=seed)
+    pixelized_image: PixelizedImage = pixelized_images[0]
+    return get_block_values(np.asarray(pixelized_image.image), pixelized_image.origin, pixelized_image.n_tiles,
+                            pixelized_image.block_size)
+
+
+class TestFeatures(TestCase):
+    color_schemes: List[Tuple[Tuple[int, int, int], Tuple[int, int, int]]] = [
+        ((0, 0, 0), (255, 255, 255)),
+        ((255, 255, 255), (39, 48, 70)),
+        ((0, 0, 255), (255, 255, 255))
+    ]
+
+    def test_get_ink_coverage(self):
+        # Act
+        coverages: List[np.ndarray] = [
+            get_ink_coverage(
+                create_block_values(dataclasses.replace(demo_picture_parameters, font_color=font_color,
+                                                        background_color=background_color)),
+                font_color,
+                background_color
+            )
+            for font_color, background_color in self.color_schemes
+        ]
+
+        # Assert: The same up to rounding, for every color scheme
+        self.assertEqual(coverages[0].shape[2], 1)
+        self.assertEqual(coverages[0].min(), 0)
+        self.assertGreater(coverages[0].max(), 128)
+        for coverage in coverages[1:]:
+            self.assertLessEqual(np.abs(coverage.astype(int) - coverages[0]).max(), 2)
+
+    def test_detect_colors(self):
+        # Arrange: The ink coverage of another image of the same font, like that of the training images of a model
+        coverage: np.ndarray = get_ink_coverage(create_block_values(demo_picture_parameters, seed=1), (0, 0, 0),
+                                                (255, 255, 255))
+        ink_percentile: float = get_ink_percentile(np.bincount(coverage.ravel(), minlength=256))
+        color_schemes: List[Tuple[Tuple[int, int, int], Tuple[int, int, int]]] = self.color_schemes + [
+            ((51, 51, 51), (255, 255, 255)),
+            ((200, 30, 30), (255, 255, 255))
+        ]
+
+        # Act
+        detected: List[tuple] = [
+            detect_colors(create_block_values(dataclasses.replace(demo_picture_parameters, font_color=font_color,
+                                                                  background_color=background_color)), ink_percentile)
+            for font_color, background_color in color_schemes
+        ]
+
+        # Assert: Up to rounding of the block colors, also for colors that aren't at the edge of the RGB cube
+        self.assertLess(ink_percentile, 1)
+        for (font_color, background_color), (detected_font, detected_background) in zip(color_schemes, detected):
+            self.assertEqual(detected_background, background_color)
+            np.testing.assert_allclose(detected_font, font_color, atol=2)
+
+    def test_get_features(self):
+        # Arrange
+        block_values: np.ndarray = np.array([[[255, 255, 255], [0, 0, 0], [128, 128, 128], [255, 255, 255]]],
+                                            dtype=np.uint8)
+
+        # Act & Assert
+        np.testing.assert_array_equal(get_features(block_values, 'rgb'), block_values)
+        np.testing.assert_array_equal(get_features(block_values, 'coverage'), [[[0], [255], [127], [0]]])
+        with self.assertRaises(ValueError):
+            get_features(block_values, 'grayscale')
@@ -1,7 +1,10 @@
-from typing import List
+import random
+import re
+from typing import List, Set
 from unittest import TestCase
 
-from text_depixelizer.training_pipeline.text_generator import RegexTextGenerator, NumberTextGenerator
+from text_depixelizer.training_pipeline.text_generator import RegexTextGenerator, NumberTextGenerator, \
+    CoverageTextGenerator, PatternElement, parse_pattern
 
 
 class TestRegexTextGenerator(TestCase):
@@ -17,6 +20,29 @@ class TestRegexTextGenerator(TestCase):
         for random_text in random_texts:
             self.assertRegex(random_text, pattern)
 
+    def test_regex_text_generator_batch(self):
+        for pattern in (r'[A-Z]{2}\d{2} ?\d{1,4}x', r'(ab|cd)\d'):
+            with self.subTest(pattern=pattern):
+                # Arrange
+                text_generator: RegexTextGenerator = RegexTextGenerator(pattern, random_generator=random.Random(0))
+
+                # Act
+                random_texts: List[str] = text_generator.generate_batch(500)
+
+                # Assert
+                self.assertEqual(len(random_texts), 500)
+                for random_text in random_texts:
+                    self.assertRegex(random_text, f'^{pattern}$')
+                self.assertEqual({len(text) for text in random_texts}, {6, 7, 8, 9, 10} if 'x' in pattern else {3})
+
+    def test_regex_text_generator_batch_seeded(self):
+        # Act
+        first: List[str] = RegexTextGenerator(r'\d{3,5}', random.Random(1)).generate_batch(20)
+        second: List[str] = RegexTextGenerator(r'\d{3,5}', random.Random(1)).generate_batch(20)
+
+        # Assert
+        self.assertEqual(first, second)
+
 
 class TestNumberTextGenerator(TestCase):
     def test_number_text_generator(self):
@@ -29,3 +55,62 @@ class TestNumberTextGenerator(TestCase):
 
         # Assert
         self.assertEqual(len(random_text), text_length)
+
+    def test_number_text_generator_batch(self):
+        # Act
+        random_texts: List[str] = NumberTextGenerator(text_length=5).generate_batch(100)
+
+        # Assert
+        self.assertEqual(len(random_texts), 100)
+        for random_text in random_texts:
+            self.assertRegex(random_text, r'^\d{5}$')
+
+
+class TestParsePattern(TestCase):
+    def test_parse_pattern(self):
+        # Act
+        elements: List[PatternElement] = parse_pattern(r'^[A-C]{2}-\d{3,4}(x|y)$')
+
+        # Assert
+        self.assertEqual(elements, [
+            PatternElement('ABC', 2, 2),
+            PatternElement('-'),
+            PatternElement('0123456789', 3, 4),
+            PatternElement('xy')
+        ])
+
+    def test_parse_pattern_unsupported(self):
+        for pattern in (r'\d+', r'(ab|cd)', r'(ab){1,2}'):
+            with self.subTest(pattern=pattern):
+                with self.assertRaises(ValueError):
+                    parse_pattern(pattern)
+
+
+class TestCoverageTextGenerator(TestCase):
+    def test_coverage_text_generator(self):
+        # Arrange
+        pattern: str = r'[abc]{3,4}'
+        text_generator: CoverageTextGenerator = CoverageTextGenerator(pattern, n=2, random_generator=random.Random(0))
+
+        # Act
+        texts: List[str] = [text_generator.generate_text() for _ in range(12)]
+
+        # Assert: All 9 inner bigrams, 3 at the start and 3 at the end are covered by 15 bigrams of the first 4 texts
+        for text in texts:
+            self.assertRegex(text, f'^{pattern}$')
+        bigrams: Set[str] = {
+            padded[i:i+2] for padded in ('^' + text + '$' for text in texts[:4]) for i in range(len(padded) - 1)
+        }
+        self.assertEqual(len(bigrams), 15)
+
+    def test_coverage_text_generator_repeats_coverage(self):
+        # Arrange
+        text_generator: CoverageTextGenerator = CoverageTextGenerator(r'\d{2}', n=2, random_generator=random.Random(1))
+
+        # Act
+        texts: List[str] = [text_generator.generate_text() for _ in range(300)]
+
+        # Assert: Every text of the language is generated, and none much more often than the others
+        counts: List[int] = [texts.count(f'{i:02d}') for i in range(100)]
+        self.assertGreater(min(counts), 0)
+        self.assertLessEqual(max(counts), 3*min(counts) + 1)
@@ -0,0 +1,78 @@
+import dataclasses
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from test.utils import demo_picture_parameters
+from text_depixelizer.parameters import PictureParameters
+from text_depixelizer.training_pipeline import training_pipeline
+from text_depixelizer.training_pipeline.training_data_cache import TrainingDataCache
+from text_depixelizer.training_pipeline.training_pipeline import create_seeded_training_data, TrainingData
+
+
+class TestTrainingDataCache(unittest.TestCase):
+
+    picture_parameters: PictureParameters = dataclasses.replace(demo_picture_parameters, pattern=r'\d{5,10}',
+                                                                randomize_pixelization_origin_x=True, window_size=4)
+
+    def test_get_extends_images(self):
+        # Arrange
+        cache: TrainingDataCache = TrainingDataCache(seed=3)
+
+        # Act
+        first: TrainingData = cache.get(self.picture_parameters, 3)
+        second: TrainingData = cache.get(self.picture_parameters, 5)
+        expected: TrainingData = create_seeded_training_data(5, self.picture_parameters, seed=3)
+
+        # Assert: The first images are reused, and all images are the ones a model would generate itself
+        self.assertEqual(second[0], expected[0])
+        self.assertTrue(all(a is b for a, b in zip(first[2], second[2])))
+        self.assertEqual([p.origin for p in second[2]], [p.origin for p in expected[2]])
+        for windows, expected_windows in zip(second[3], expected[3]):
+            self.assertEqual([w.characters for w in windows], [w.characters for w in expected_windows])
+
+    def test_get_extends_coverage_texts(self):
+        # Arrange
+        cache: TrainingDataCache = TrainingDataCache(seed=3, text_generation='coverage')
+
+        # Act
+        cache.get(self.picture_parameters, 3)
+        texts: list = cache.get(self.picture_parameters, 7)[0]
+        expected: TrainingData = create_seeded_training_data(7, self.picture_parameters, seed=3,
+                                                             text_generation='coverage')
+        last_texts: list = create_seeded_training_data(4, self.picture_parameters, seed=3, text_generation='coverage',
+                                                       first_image=3)[0]
+
+        # Assert: Coverage texts continue the series, with or without the generator of the first images
+        self.assertEqual(texts, expected[0])
+        self.assertEqual(last_texts, expected[0][3:])
+
+    def test_get_other_window_size(self):
+        # Arrange
+        cache: TrainingDataCache = TrainingDataCache(seed=3)
+        picture_parameters: PictureParameters = dataclasses.replace(self.picture_parameters, window_size=2)
+
+        # Act
+        data: TrainingData = cache.get(self.picture_parameters, 4)
+        data_other_window_size: TrainingData = cache.get(picture_parameters, 4)
+        expected: TrainingData = create_seeded_training_data(4, picture_parameters, seed=3)
+
+        # Assert: Same images, windows of the other size
+        self.assertTrue(all(a is b for a, b in zip(data[2], data_other_window_size[2])))
+        for windows, expected_windows in zip(data_other_window_size[3], expected[3]):
+            self.assertEqual(len(windows), len(expected_windows))
+            np.testing.assert_array_equal(windows[0].values, expected_windows[0].values)
+
+    def test_get_samples_blocks_once(self):
+        # Arrange
+        cache: TrainingDataCache = TrainingDataCache(seed=3)
+
+        # Act
+        with mock.patch.object(training_pipeline, 'create_block_columns',
+                               wraps=training_pipeline.create_block_columns) as create_block_columns:
+            cache.get(self.picture_parameters, 3)
+            cache.get(self.picture_parameters, 5)
+
+        # Assert: The blocks of every image are sampled only once
+        self.assertEqual(create_block_columns.call_count, 5)
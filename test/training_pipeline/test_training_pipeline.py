@@ -1,9 +1,12 @@
 from unittest import TestCase
 
+import numpy as np
 
 from test.utils import demo_picture_parameters
 from text_depixelizer.parameters import PictureParameters
-from text_depixelizer.training_pipeline.training_pipeline import create_training_data
+from text_depixelizer.seeding import get_seed_sequence, TRAINING_DATA, TEST_DATA
+from text_depixelizer.training_pipeline.text_generator import CoverageTextGenerator
+from text_depixelizer.training_pipeline.training_pipeline import create_training_data, create_text_generator
 
 
 class TestTrainingPipeline(TestCase):
@@ -45,3 +48,43 @@ class TestTrainingPipeline(TestCase):
 
         # Assert
         self.assertGreater(len(set([p.origin for p in pixelized_images])), 1)
+
+    def test_create_training_data_seeded(self):
+        # Arrange
+        picture_parameters: PictureParameters = PictureParameters(
+            block_size=6,
+            pattern=r'\d{5,10}',
+            font=demo_picture_parameters.font,
+            randomize_pixelization_origin_x=True
+        )
+        seed_sequence: np.random.SeedSequence = get_seed_sequence(7, TRAINING_DATA)
+
+        # Act
+        texts, _, pixelized_images, _ = create_training_data(6, picture_parameters, seed_sequence)
+        texts_again, _, _, _ = create_training_data(6, picture_parameters, get_seed_sequence(7, TRAINING_DATA))
+        texts_first_shard, _, pixelized_images_first_shard, _ = \
+            create_training_data(2, picture_parameters, seed_sequence, first_image=0)
+        texts_second_shard, _, pixelized_images_second_shard, _ = \
+            create_training_data(4, picture_parameters, seed_sequence, first_image=2)
+        texts_test, _, _, _ = create_training_data(6, picture_parameters, get_seed_sequence(7, TEST_DATA))
+
+        # Assert
+        self.assertEqual(texts, texts_again)
+        self.assertEqual(texts, texts_first_shard + texts_second_shard)
+        self.assertEqual(
+            [p.origin for p in pixelized_images],
+            [p.origin for p in pixelized_images_first_shard + pixelized_images_second_shard]
+        )
+        self.assertNotEqual(texts, texts_test)
+
+    def test_create_text_generator(self):
+        # Act
+        random_text_generator = create_text_generator(demo_picture_parameters, 'random')
+        coverage_text_generator = create_text_generator(demo_picture_parameters, 'coverage')
+
+        # Assert: Two consecutive windows of 6 blocks of 6 pixels overlap at most 3 digits of arial 50
+        self.assertIsNone(random_text_generator)
+        self.assertIsInstance(coverage_text_generator, CoverageTextGenerator)
+        self.assertEqual(coverage_text_generator.n, 3)
+        with self.assertRaises(ValueError):
+            create_text_generator(demo_picture_parameters, 'exhaustive')
@@ -1,10 +1,13 @@
 from typing import List, Tuple
 from unittest import TestCase
 
+import numpy as np
+
 from test import utils
 from text_depixelizer.training_pipeline.original_image import OriginalImage
 from text_depixelizer.training_pipeline.pixelized_image import PixelizationOptions, PixelizedImage, pixelize_image
-from text_depixelizer.training_pipeline.windows import create_windows_from_image, Window, interval_overlap, WindowOptions
+from text_depixelizer.training_pipeline.windows import create_windows_from_image, Window, interval_overlap, WindowOptions, \
+    get_block_values, get_window_values, BlockColumns, create_block_columns
 
 
 class TestWindows(TestCase):
@@ -54,3 +57,45 @@ class TestWindows(TestCase):
 
         # Assert: The number of windows is correct
         self.assertEqual(len(windows), pixelized_image.n_tiles[0] - window_options.window_size + 1)
+
+    def test_get_window_values(self):
+        # Arrange
+        block_size: int = 8
+        window_size: int = 3
+        original_image: OriginalImage = utils.create_image(text='Asdfjklö')
+        pixelized_image: PixelizedImage = pixelize_image(original_image, PixelizationOptions(block_size, (3, 2)))
+        windows: List[Window] = create_windows_from_image(original_image, pixelized_image, WindowOptions(window_size))
+
+        # Act
+        block_values: np.ndarray = get_block_values(
+            np.asarray(pixelized_image.image), pixelized_image.origin, pixelized_image.n_tiles, block_size
+        )
+        window_values: np.ndarray = get_window_values(block_values, window_size)
+
+        # Assert: Same values as the windows from the training pipeline
+        self.assertEqual(window_values.shape[0], len(windows))
+        for window, values in zip(windows, window_values):
+            np.testing.assert_array_equal(window.values, values)
+
+
+    def test_block_columns(self):
+        # Arrange: Every offset of the pixelization grid within a block
+        block_size: int = 7
+        original_image: OriginalImage = utils.create_image(text='Asdf jklö.iI')
+
+        for offset_x in range(block_size):
+            pixelized_image: PixelizedImage = pixelize_image(original_image,
+                                                             PixelizationOptions(block_size, (offset_x, 2)))
+
+            # Act
+            block_columns: BlockColumns = create_block_columns(original_image, pixelized_image)
+
+            # Assert: Same windows as the ones cut from the image, for every window size
+            for window_size in range(1, 8):
+                expected: List[Window] = create_windows_from_image(original_image, pixelized_image,
+                                                                   WindowOptions(window_size))
+                windows: List[Window] = block_columns.get_windows(window_size)
+                self.assertEqual([w.characters for w in windows], [w.characters for w in expected])
+                self.assertEqual([w.window_index for w in windows], [w.window_index for w in expected])
+                for window, expected_window in zip(windows, expected):
+                    np.testing.assert_array_equal(window.values, expected_window.values)
@@ -1,11 +1,12 @@
 import random
-from typing import Tuple
+from typing import Tuple, List
 
 from PIL import Image, ImageDraw, ImageFont
 
 from resources.fonts import DemoFontPaths
 from text_depixelizer.parameters import PictureParameters, TrainingParameters
 from text_depixelizer.training_pipeline.original_image import ImageCreationOptions, OriginalImage, generate_image_from_text
+from text_depixelizer.training_pipeline.pixelized_image import PixelizedImage
 
 
 def create_random_mosaic(img_size: Tuple[int, int], block_size: int):
@@ -33,6 +34,20 @@ def create_random_mosaic(img_size: Tuple[int, int], block_size: int):
     return img
 
 
+def create_screenshot(pixelized_images: List[PixelizedImage], positions: List[Tuple[int, int]],
+                      img_size: Tuple[int, int] = (900, 400)) -> Image:
+    """
+    Paste the pixelized areas of the given images onto a white canvas, the pixelization origins end up at positions
+    """
+    screenshot: Image = Image.new('RGB', img_size, (255, 255, 255))
+    for pixelized_image, position in zip(pixelized_images, positions):
+        left, top = pixelized_image.origin
+        right: int = left + pixelized_image.n_tiles[0] * pixelized_image.block_size
+        bottom: int = top + pixelized_image.n_tiles[1] * pixelized_image.block_size
+        screenshot.paste(pixelized_image.image.crop((left, top, right, bottom)), position)
+    return screenshot
+
+
 def create_image(text: str, padding: Tuple[int, int] = (30, 30), font_size: int = 50) -> OriginalImage:
     default_font: ImageFont = ImageFont.truetype(str(DemoFontPaths.arial), font_size)
     options: ImageCreationOptions = ImageCreationOptions(padding, default_font)
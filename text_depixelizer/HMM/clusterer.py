@@ -1,11 +1,17 @@
+import copy
+import heapq
 from abc import ABC, abstractmethod
-from typing import List
+from typing import List, Optional, Tuple, TYPE_CHECKING
 
 import numpy as np
-from sklearn.cluster import KMeans
 
+from text_depixelizer.HMM.hmm import MAX_BATCH_ELEMENTS
+from text_depixelizer.instrumentation import span
 from text_depixelizer.training_pipeline.windows import Window
 
+if TYPE_CHECKING:
+    from sklearn.cluster import KMeans
+
 
 class Clusterer(ABC):
     centroids: List[np.ndarray]
@@ -18,15 +24,42 @@ class Clusterer(ABC):
     def map_values_to_cluster(self, values: List[np.array]) -> List[int]:
         pass
 
+
+def get_nearest_centroids(values: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """
+    Index of the nearest centroid of every row of values, like KMeans.predict. The squared distances are computed as
+    |c|^2 - 2xc (|x|^2 doesn't change the nearest centroid), in chunks of at most MAX_BATCH_ELEMENTS distances
+    """
+    squared_norms: np.ndarray = np.einsum('ij,ij->i', centroids, centroids)
+    chunk_size: int = max(1, MAX_BATCH_ELEMENTS // len(centroids))
+    k_values: np.ndarray = np.empty(len(values), dtype=int)
+    for start in range(0, len(values), chunk_size):
+        chunk: np.ndarray = values[start:start + chunk_size].astype(centroids.dtype)
+        k_values[start:start + chunk_size] = np.argmin(squared_norms - 2 * chunk @ centroids.T, axis=1)
+    return k_values
+
+
 class KmeansClusterer(Clusterer):
-    kmeans: KMeans
+    kmeans: 'KMeans'
+    dtype: np.dtype = np.dtype(np.float64)  # Type of the centroids and of the values when they are assigned
+
+    def __init__(self, windows: List[Window], k: int, random_state: Optional[int] = None,
+                 dtype: np.dtype = np.float64):
+        # Imported here, so decoding with a saved model doesn't need to import scikit-learn
+        from sklearn.cluster import KMeans
 
-    def __init__(self, windows: List[Window], k: int):
-        X = np.array([window.values for window in windows])
-        kmeans = KMeans(n_clusters=k)
-        kmeans.fit(X)
+        # The window values are uint8 until here, KMeans keeps float32 data in float32
+        self.dtype = np.dtype(dtype)
+        X = np.array([window.values for window in windows], dtype=self.dtype)
+        kmeans = KMeans(n_clusters=k, random_state=random_state)
+        with span('kmeans.fit', n_items=len(X)):
+            kmeans.fit(X)
         self.kmeans = kmeans
 
+    @property
+    def centroids(self) -> np.ndarray:
+        return self.kmeans.cluster_centers_
+
     def map_windows_to_cluster(self, windows: List[Window]) -> List[Window]:
         k_values: List[int] = self.map_values_to_cluster([window.values for window in windows])
         for window, k_value in zip(windows, k_values):
@@ -34,5 +67,171 @@ class KmeansClusterer(Clusterer):
         return windows
 
     def map_values_to_cluster(self, values: List[np.array]) -> List[int]:
-        k_values: List[int] = self.kmeans.predict(np.array(values))
+        with span('kmeans.predict', n_items=len(values)):
+            k_values: List[int] = self.kmeans.predict(np.asarray(values, dtype=self.dtype))
         return k_values
+
+
+class CentroidClusterer(Clusterer):
+    """
+    Assigns values to the nearest of centroids that were fitted elsewhere, e.g. by the distributed k-means of sharded
+    training
+    """
+    def __init__(self, centroids: np.ndarray, dtype: np.dtype = np.float64):
+        self.centroids = np.asarray(centroids, dtype=dtype)
+
+    def map_windows_to_cluster(self, windows: List[Window]) -> List[Window]:
+        k_values: np.ndarray = self.map_values_to_cluster([window.values for window in windows])
+        for window, k_value in zip(windows, k_values):
+            window.k = int(k_value)
+        return windows
+
+    def map_values_to_cluster(self, values: List[np.array]) -> np.ndarray:
+        with span('kmeans.predict', n_items=len(values)):
+            return get_nearest_centroids(np.asarray(values), self.centroids)
+
+
+class BisectingClusterer(Clusterer):
+    """
+    Tree of 2-means splits: starting with all windows in one cluster, the cluster with the largest sum of squared
+    distances to its centroid is split next. The first k - 1 splits give k clusters, so a tree that is fitted once
+    for the largest k of a grid search can be cut at every smaller k, see cut.
+    Values are assigned by descending the tree, which only compares them to the two children of a node per level
+    """
+    dtype: np.dtype = np.dtype(np.float64)
+    node_centroids: np.ndarray  # Centroid of every node, split s creates the nodes 2s + 1 and 2s + 2
+    split_nodes: np.ndarray  # Node that is split by every split
+    k: int  # Number of clusters, the leaves after the first k - 1 splits
+
+    def __init__(self, windows: List[Window], k: int, random_state: Optional[int] = None,
+                 dtype: np.dtype = np.float64, max_iter: int = 50):
+        values: np.ndarray = np.array([window.values for window in windows], dtype=np.float64)
+        if len(values) < k:
+            raise ValueError(f'n_samples={len(values)} should be >= n_clusters={k}.')
+
+        self.dtype = np.dtype(dtype)
+        rng: np.random.Generator = np.random.default_rng(random_state)
+        node_centroids: List[np.ndarray] = [values.mean(axis=0)]
+        split_nodes: List[int] = []
+
+        # Leaves that can still be split, the one with the largest sum of squared distances first
+        members: dict = {0: np.arange(len(values))}
+        leaves: List[Tuple[float, int]] = [(-self.get_inertia(values, node_centroids[0]), 0)]
+        with span('bisecting.fit', n_items=len(values)):
+            while len(split_nodes) < k - 1 and leaves:
+                _, node = heapq.heappop(leaves)
+                node_members: np.ndarray = members.pop(node)
+                bisection: Optional[Tuple[np.ndarray, np.ndarray]] = self.bisect(values[node_members], rng, max_iter)
+                if bisection is None:
+                    continue
+
+                centroids, is_right = bisection
+                split_nodes.append(node)
+                children: Tuple[int, int] = (2*len(split_nodes) - 1, 2*len(split_nodes))
+                for child, centroid, child_members in zip(children, centroids,
+                                                          (node_members[~is_right], node_members[is_right])):
+                    node_centroids.append(centroid)
+                    members[child] = child_members
+                    inertia: float = self.get_inertia(values[child_members], centroid)
+                    if inertia > 0:
+                        heapq.heappush(leaves, (-inertia, child))
+
+        self.node_centroids = np.array(node_centroids, dtype=self.dtype)
+        self.split_nodes = np.array(split_nodes, dtype=int)
+        self.k = len(split_nodes) + 1
+
+    @staticmethod
+    def get_inertia(values: np.ndarray, centroid: np.ndarray) -> float:
+        return float(((values - centroid)**2).sum())
+
+    @staticmethod
+    def bisect(values: np.ndarray, rng: np.random.Generator, max_iter: int) \
+            -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """
+        2-means of the values, initialized like k-means++. Returns the two centroids and whether every value belongs
+        to the second one, or None if all values are equal
+        """
+        first: np.ndarray = values[rng.integers(len(values))]
+        squared_distances: np.ndarray = ((values - first)**2).sum(axis=1)
+        if squared_distances.sum() == 0:
+            return None
+        second: np.ndarray = values[rng.choice(len(values), p=squared_distances / squared_distances.sum())]
+        centroids: np.ndarray = np.array([first, second])
+
+        is_right: np.ndarray = np.zeros(len(values), dtype=bool)
+        for _ in range(max_iter):
+            is_right = BisectingClusterer.is_closer_to_second(values, centroids[0], centroids[1])
+            if is_right.all() or not is_right.any():
+                return None
+            new_centroids: np.ndarray = np.array([values[~is_right].mean(axis=0), values[is_right].mean(axis=0)])
+            if np.array_equal(new_centroids, centroids):
+                break
+            centroids = new_centroids
+
+        # The members of the children are the values that descending the tree assigns to them
+        is_right = BisectingClusterer.is_closer_to_second(values, centroids[0], centroids[1])
+        if is_right.all() or not is_right.any():
+            return None
+        return centroids, is_right
+
+    @staticmethod
+    def is_closer_to_second(values: np.ndarray, first: np.ndarray, second: np.ndarray) -> np.ndarray:
+        """
+        |x - second|^2 < |x - first|^2, which is x (second - first) > (|second|^2 - |first|^2) / 2
+        """
+        return values @ (second - first) > (second @ second - first @ first) / 2
+
+    def cut(self, k: int) -> 'BisectingClusterer':
+        """
+        The clusters after the first k - 1 splits, without fitting again. The tree is shared with this clusterer
+        """
+        if k > len(self.split_nodes) + 1:
+            raise ValueError(f'The tree has {len(self.split_nodes) + 1} clusters, it can\'t be cut into {k}')
+        clusterer: BisectingClusterer = copy.copy(self)
+        clusterer.k = k
+        return clusterer
+
+    @property
+    def centroids(self) -> np.ndarray:
+        """
+        Centroids of the clusters, in the order of their indices
+        """
+        return self.node_centroids[self.get_leaf_nodes()]
+
+    def get_leaf_nodes(self) -> np.ndarray:
+        n_splits: int = self.k - 1
+        return np.setdiff1d(np.arange(2*n_splits + 1), self.split_nodes[:n_splits])
+
+    def map_windows_to_cluster(self, windows: List[Window]) -> List[Window]:
+        k_values: np.ndarray = self.map_values_to_cluster([window.values for window in windows])
+        for window, k_value in zip(windows, k_values):
+            window.k = int(k_value)
+        return windows
+
+    def map_values_to_cluster(self, values: List[np.array]) -> np.ndarray:
+        """
+        Descend from the root until a leaf is reached, all values one level at a time
+        """
+        with span('bisecting.predict', n_items=len(values)):
+            values: np.ndarray = np.asarray(values, dtype=self.dtype)
+            n_splits: int = self.k - 1
+            node_split: np.ndarray = np.full(2*n_splits + 1, -1)
+            node_split[self.split_nodes[:n_splits]] = np.arange(n_splits)
+
+            # Every split is a hyperplane between the centroids of its children, see is_closer_to_second
+            first: np.ndarray = self.node_centroids[1:2*n_splits + 1:2]
+            second: np.ndarray = self.node_centroids[2:2*n_splits + 2:2]
+            normals: np.ndarray = second - first
+            thresholds: np.ndarray = (np.einsum('ij,ij->i', second, second) - np.einsum('ij,ij->i', first, first)) / 2
+
+            nodes: np.ndarray = np.zeros(len(values), dtype=int)
+            active: np.ndarray = np.flatnonzero(node_split[nodes] >= 0)
+            while len(active) > 0:
+                splits: np.ndarray = node_split[nodes[active]]
+                is_right: np.ndarray = np.einsum('ij,ij->i', values[active], normals[splits]) > thresholds[splits]
+                nodes[active] = 2*splits + 1 + is_right
+                active = active[node_split[nodes[active]] >= 0]
+
+            leaf_index: np.ndarray = np.full(2*n_splits + 1, -1)
+            leaf_index[self.get_leaf_nodes()] = np.arange(self.k)
+            return leaf_index[nodes]
@@ -0,0 +1,195 @@
+import json
+from functools import cached_property
+from pathlib import Path
+from typing import List, Tuple, Dict, Optional, Any
+
+import numpy as np
+from PIL import Image
+
+from text_depixelizer.HMM.clusterer import get_nearest_centroids
+from text_depixelizer.HMM.emission_model import GaussianEmissions
+from text_depixelizer.HMM.hmm import HMM, SparseTransitions
+from text_depixelizer.HMM.hmm_result_reconstructor import reconstruct_string_from_character_widths
+from text_depixelizer.instrumentation import span, instrumented
+from text_depixelizer.parameters import PictureParameters
+from text_depixelizer.training_pipeline.features import get_features, Color
+from text_depixelizer.training_pipeline.windows import get_block_values, get_window_values
+
+FORMAT_VERSION: int = 2  # 2 stores sparse transitions as their predecessors, 1 only the dense matrix
+
+
+class CompactModel(HMM):
+    """
+    Decode-only form of a trained DepixHMM: the centroids of the clusters (or the gaussian emissions), the
+    log-probability tables, the states and the advance width of every character.
+    Loading and decoding only needs numpy and Pillow, so a decode worker neither imports scikit-learn nor the
+    generation of training data. The models are saved as .npz files, without pickle.
+    Sparse transitions are kept as the predecessors of every state, see SparseTransitions, and never made dense
+    """
+    observations: List[int]
+    states: List[Tuple[str, ...]]
+
+    picture_parameters: PictureParameters  # Without the font, its characters are described by character_widths
+    character_widths: Dict[str, int]
+    centroids: Optional[np.ndarray]
+    gaussian_emissions: Optional[GaussianEmissions]
+    ink_percentile: float  # See DepixHMM.set_ink_percentile
+    sparse_transitions: Optional[SparseTransitions]  # Instead of log_transition_probabilities
+
+    def __init__(self, picture_parameters: PictureParameters, states: List[Tuple[str, ...]],
+                 character_widths: Dict[str, int], log_starting_probabilities: np.ndarray,
+                 log_transition_probabilities: Optional[np.ndarray], log_emission_probabilities: np.ndarray,
+                 centroids: Optional[np.ndarray] = None, gaussian_emissions: Optional[GaussianEmissions] = None,
+                 ink_percentile: float = 1.0, sparse_transitions: Optional[SparseTransitions] = None):
+        if (centroids is None) == (gaussian_emissions is None):
+            raise ValueError('A compact model needs either the centroids of the clusters or gaussian emissions')
+        if (log_transition_probabilities is None) == (sparse_transitions is None):
+            raise ValueError('A compact model needs either dense or sparse log transition probabilities')
+
+        self.picture_parameters = picture_parameters
+        self.states = states
+        self.observations = list(range(log_emission_probabilities.shape[1]))
+        self.character_widths = character_widths
+        self.centroids = centroids
+        self.gaussian_emissions = gaussian_emissions
+        self.ink_percentile = ink_percentile
+        self.sparse_transitions = sparse_transitions
+
+        # Only the log-probabilities are kept, they take the place of the cached properties of the HMM
+        self.log_starting_probabilities = log_starting_probabilities
+        self.log_transition_probabilities = log_transition_probabilities
+        self.log_emission_probabilities = log_emission_probabilities
+
+    @property
+    def dtype(self) -> np.dtype:
+        return self.log_starting_probabilities.dtype
+
+    @cached_property
+    def sparse_log_transitions(self) -> Optional[SparseTransitions]:
+        if self.sparse_transitions is not None:
+            return self.sparse_transitions
+        sparse_transitions: SparseTransitions = SparseTransitions.from_dense_log(self.log_transition_probabilities)
+        if not sparse_transitions.is_sparse:
+            return None
+        return sparse_transitions
+
+    def test_image(self, img: Image) -> str:
+        return self.test_images([img])[0]
+
+    def test_images(self, imgs: List[Image]) -> List[str]:
+        reconstructed_strings, _ = self.score_images(imgs)
+        return reconstructed_strings
+
+    @instrumented('decode')
+    def score_images(self, imgs: List[Image],
+                     colors: Optional[Tuple[Color, Color]] = None) -> Tuple[List[str], np.ndarray]:
+        """
+        Same results as DepixHMM.score_images of the model this one was exported from
+        """
+        window_values: List[np.ndarray] = [self.get_window_values(img, colors) for img in imgs]
+        if len({values.shape[1] for values in window_values}) > 1:
+            raise ValueError('All images of a batch must have the same height in blocks')
+
+        lengths: List[int] = [len(values) for values in window_values]
+        log_emissions: np.ndarray = np.empty((0, len(self.states)), dtype=self.dtype)
+        if sum(lengths) > 0:
+            values: np.ndarray = np.concatenate(window_values)
+            if self.gaussian_emissions is None:
+                log_emissions = self.log_emission_probabilities[:, self.assign_clusters(values)].T
+            else:
+                log_emissions = self.gaussian_emissions.log_likelihood(values)
+
+        state_indices, scores = self.log_viterbi_from_log_emissions(np.split(log_emissions, np.cumsum(lengths)[:-1]))
+        with span('reconstruct', n_items=len(state_indices)):
+            reconstructed_strings: List[str] = [
+                reconstruct_string_from_character_widths([self.states[i] for i in indices],
+                                                         self.picture_parameters.block_size, self.character_widths)
+                for indices in state_indices
+            ]
+        return reconstructed_strings, scores
+
+    def get_window_values(self, img: Image, colors: Optional[Tuple[Color, Color]] = None) -> np.ndarray:
+        block_size: int = self.picture_parameters.block_size
+        n_tiles: Tuple[int, int] = (img.size[0] // block_size, img.size[1] // block_size)
+        block_values: np.ndarray = get_block_values(np.asarray(img.convert('RGB')), (0, 0), n_tiles, block_size)
+        return get_window_values(get_features(block_values, self.picture_parameters.features, colors,
+                                              self.ink_percentile),
+                                 self.picture_parameters.window_size)
+
+    def assign_clusters(self, values: np.ndarray) -> np.ndarray:
+        """
+        Index of the nearest centroid of every row of values, like KMeans.predict, see get_nearest_centroids
+        """
+        with span('kmeans.predict', n_items=len(values)):
+            return get_nearest_centroids(values, self.centroids)
+
+    def save(self, path: Path) -> None:
+        pp: PictureParameters = self.picture_parameters
+        metadata: Dict[str, Any] = {
+            'format_version': FORMAT_VERSION,
+            'picture_parameters': {
+                'pattern': pp.pattern,
+                'font_color': pp.font_color,
+                'background_color': pp.background_color,
+                'block_size': pp.block_size,
+                'window_size': pp.window_size,
+                'offset_y': pp.offset_y,
+                'features': pp.features
+            },
+            'states': self.states,
+            'character_widths': self.character_widths,
+            'ink_percentile': self.ink_percentile
+        }
+        arrays: Dict[str, np.ndarray] = {
+            'log_starting_probabilities': self.log_starting_probabilities,
+            'log_emission_probabilities': self.log_emission_probabilities
+        }
+        if self.sparse_transitions is None:
+            arrays['log_transition_probabilities'] = self.log_transition_probabilities
+        else:
+            arrays['transition_predecessors'] = self.sparse_transitions.predecessors
+            arrays['transition_log_probabilities'] = self.sparse_transitions.log_probabilities
+        if self.centroids is not None:
+            arrays['centroids'] = self.centroids
+        if self.gaussian_emissions is not None:
+            arrays['gaussian_means'] = self.gaussian_emissions.means
+            arrays['gaussian_variances'] = self.gaussian_emissions.variances
+
+        with open(path, 'wb') as f:
+            np.savez(f, metadata=np.array(json.dumps(metadata)), **arrays)
+
+    @staticmethod
+    def load(path: Path) -> 'CompactModel':
+        with np.load(path, allow_pickle=False) as data:
+            metadata: Dict[str, Any] = json.loads(str(data['metadata']))
+            if metadata['format_version'] > FORMAT_VERSION:
+                raise ValueError(f'Unsupported model format {metadata["format_version"]}, expected at most '
+                                 f'{FORMAT_VERSION}')
+
+            parameters: Dict[str, Any] = metadata['picture_parameters']
+            return CompactModel(
+                picture_parameters=PictureParameters(
+                    pattern=parameters['pattern'],
+                    font=None,
+                    font_color=tuple(parameters['font_color']),
+                    background_color=tuple(parameters['background_color']),
+                    block_size=parameters['block_size'],
+                    window_size=parameters['window_size'],
+                    offset_y=parameters['offset_y'],
+                    features=parameters.get('features', 'rgb')
+                ),
+                states=[tuple(state) for state in metadata['states']],
+                character_widths=metadata['character_widths'],
+                log_starting_probabilities=data['log_starting_probabilities'],
+                log_transition_probabilities=data['log_transition_probabilities']
+                if 'log_transition_probabilities' in data else None,
+                log_emission_probabilities=data['log_emission_probabilities'],
+                centroids=data['centroids'] if 'centroids' in data else None,
+                gaussian_emissions=GaussianEmissions(means=data['gaussian_means'],
+                                                     variances=data['gaussian_variances'])
+                if 'gaussian_means' in data else None,
+                ink_percentile=metadata.get('ink_percentile', 1.0),
+                sparse_transitions=SparseTransitions(predecessors=data['transition_predecessors'],
+                                                     log_probabilities=data['transition_log_probabilities'])
+                if 'transition_predecessors' in data else None
+            )
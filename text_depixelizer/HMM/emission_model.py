@@ -0,0 +1,69 @@
+from dataclasses import dataclass
+from functools import cached_property
+
+import numpy as np
+
+from text_depixelizer.instrumentation import span
+
+
+@dataclass
+class GaussianEmissions:
+    """
+    Emission model that scores the pixel values of a window directly, instead of the cluster the window is assigned to.
+    Every state has a normal distribution with a diagonal covariance over the values of its windows
+    """
+    means: np.ndarray  # (n_states, n_values)
+    variances: np.ndarray  # (n_states, n_values)
+
+    @staticmethod
+    def fit(values: np.ndarray, state_indices: np.ndarray, n_states: int,
+            variance_prior: float = 1.0) -> 'GaussianEmissions':
+        """
+        Estimate mean and variance of the windows of every state from the sums of their values and squared values.
+        The variances are pulled towards the variance of all windows by variance_prior pseudo observations, so states
+        with few windows or constant pixels don't get a variance of zero. States without windows get the overall
+        distribution
+        """
+        values = values.astype(float)
+        counts: np.ndarray = np.bincount(state_indices, minlength=n_states).astype(float)[:, np.newaxis]
+        sums: np.ndarray = np.zeros((n_states, values.shape[1]))
+        squared_sums: np.ndarray = np.zeros((n_states, values.shape[1]))
+        np.add.at(sums, state_indices, values)
+        np.add.at(squared_sums, state_indices, values**2)
+
+        global_mean: np.ndarray = values.mean(axis=0)
+        global_variance: np.ndarray = np.maximum(values.var(axis=0), 1.0)
+
+        means: np.ndarray = np.divide(sums, counts, out=np.tile(global_mean, (n_states, 1)), where=counts > 0)
+        squared_deviations: np.ndarray = np.maximum(squared_sums - counts * means**2, 0.0)
+        variances: np.ndarray = np.divide(
+            squared_deviations + variance_prior * global_variance,
+            counts + variance_prior,
+            out=np.tile(global_variance, (n_states, 1)),
+            where=counts > 0
+        )
+        return GaussianEmissions(means=means, variances=variances)
+
+    def astype(self, dtype: np.dtype) -> 'GaussianEmissions':
+        return GaussianEmissions(means=self.means.astype(dtype), variances=self.variances.astype(dtype))
+
+    @cached_property
+    def _weights(self) -> np.ndarray:
+        # log N(x | m, s) = -1/2 * sum((x^2 - 2xm + m^2) / s + log(2*pi*s)), the terms with x are one matrix product.
+        # The terms nearly cancel, so the product is always computed in float64, whatever the type of the parameters
+        precisions: np.ndarray = 1.0 / self.variances.astype(float)
+        return -0.5 * np.concatenate([precisions, -2.0 * self.means * precisions], axis=1).T
+
+    @cached_property
+    def _constants(self) -> np.ndarray:
+        variances: np.ndarray = self.variances.astype(float)
+        return -0.5 * np.sum(self.means**2 / variances + np.log(2 * np.pi * variances), axis=1)
+
+    def log_likelihood(self, values: np.ndarray) -> np.ndarray:
+        """
+        Log-likelihood of every window under every state, of shape (n_windows, n_states), in the type of the parameters
+        """
+        with span('gaussian.log_likelihood', n_items=len(values)):
+            values = values.astype(float)
+            log_likelihoods: np.ndarray = np.concatenate([values**2, values], axis=1) @ self._weights + self._constants
+            return log_likelihoods.astype(self.means.dtype, copy=False)
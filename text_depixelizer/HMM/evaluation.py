@@ -0,0 +1,105 @@
+import logging
+import math
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple, Callable
+
+from text_depixelizer.HMM.hmm_result_reconstructor import string_similarity
+
+# Quantile of the normal distribution for 95% confidence intervals
+Z_95: float = 1.96
+
+
+@dataclass
+class SequentialEvaluation:
+    """
+    Accuracy and average similarity of a model on test images that are decoded chunk by chunk.
+    The evaluation stops before all n_img images are decoded, once
+    - the 95% confidence intervals of both values are within +- tolerance of the estimate, or
+    - the upper end of the confidence interval of the accuracy isn't above best_to_beat, e.g. the best accuracy of a
+      grid search so far, so the model can't be the best one anymore
+    """
+    n_img: int
+    tolerance: float = 0.0
+    best_to_beat: Optional[float] = None
+    similarities: List[float] = field(default_factory=list)
+    stop_reason: Optional[str] = None  # 'complete', 'tolerance' or 'best_to_beat' once stopped
+
+    @property
+    def n_evaluated(self) -> int:
+        return len(self.similarities)
+
+    @property
+    def accuracy(self) -> float:
+        return self.similarities.count(1.0) / self.n_evaluated
+
+    @property
+    def average_similarity(self) -> float:
+        return sum(self.similarities) / self.n_evaluated
+
+    @property
+    def accuracy_interval(self) -> Tuple[float, float]:
+        """
+        Wilson score interval, which is neither empty nor outside of [0, 1] for accuracies of 0 or 1
+        """
+        n: int = self.n_evaluated
+        p: float = self.accuracy
+        denominator: float = 1 + Z_95**2 / n
+        center: float = (p + Z_95**2 / (2*n)) / denominator
+        half_width: float = Z_95 * math.sqrt(p*(1 - p)/n + Z_95**2 / (4*n**2)) / denominator
+        return max(0.0, center - half_width), min(1.0, center + half_width)
+
+    @property
+    def similarity_interval(self) -> Tuple[float, float]:
+        n: int = self.n_evaluated
+        mean: float = self.average_similarity
+        if n < 2:
+            return -math.inf, math.inf
+        variance: float = sum((s - mean)**2 for s in self.similarities) / (n - 1)
+        half_width: float = Z_95 * math.sqrt(variance / n)
+        return mean - half_width, mean + half_width
+
+    def chunks(self, chunk_size: int) -> List[Tuple[int, int]]:
+        """
+        First image and number of images of every chunk. Without a criterion to stop early, all images are one chunk
+        """
+        if self.tolerance <= 0 and self.best_to_beat is None:
+            chunk_size = self.n_img
+        chunk_size = max(1, chunk_size)
+        return [(first_image, min(chunk_size, self.n_img - first_image))
+                for first_image in range(0, self.n_img, chunk_size)]
+
+    def add(self, texts: List[str], reconstructed_texts: List[str]) -> None:
+        for text, reconstructed_text in zip(texts, reconstructed_texts):
+            similarity: float = string_similarity(text, reconstructed_text)
+            self.similarities.append(similarity)
+            logging.debug(f'Expected: {text}, Actual: {reconstructed_text}, Similarity: {similarity}')
+
+    def is_done(self) -> bool:
+        if self.n_evaluated >= self.n_img:
+            self.stop_reason = 'complete'
+        elif self.best_to_beat is not None and self.accuracy_interval[1] <= self.best_to_beat:
+            self.stop_reason = 'best_to_beat'
+        elif self.tolerance > 0 and max(self.accuracy - self.accuracy_interval[0],
+                                        self.accuracy_interval[1] - self.accuracy,
+                                        self.average_similarity - self.similarity_interval[0]) <= self.tolerance:
+            self.stop_reason = 'tolerance'
+        return self.stop_reason is not None
+
+
+def evaluate_sequentially(decode_test_images: Callable[[int, int], Tuple[List[str], List[str]]], n_img: int,
+                          chunk_size: int, tolerance: float = 0.0,
+                          best_to_beat: Optional[float] = None) -> SequentialEvaluation:
+    """
+    Decode the test images in chunks until the evaluation can stop. decode_test_images(first_image, n_img) generates
+    and decodes the given images of the test series and returns their texts and the reconstructed texts
+    """
+    evaluation: SequentialEvaluation = SequentialEvaluation(n_img=n_img, tolerance=tolerance, best_to_beat=best_to_beat)
+    for first_image, n_img_chunk in evaluation.chunks(chunk_size):
+        evaluation.add(*decode_test_images(first_image, n_img_chunk))
+        if evaluation.is_done():
+            break
+
+    logging.info(f'Evaluated {evaluation.n_evaluated} of {n_img} test images ({evaluation.stop_reason}): '
+                 f'accuracy {evaluation.accuracy:.3f} in [{evaluation.accuracy_interval[0]:.3f}, '
+                 f'{evaluation.accuracy_interval[1]:.3f}], average similarity {evaluation.average_similarity:.3f}')
+    return evaluation
@@ -0,0 +1,293 @@
+import logging
+import time
+from typing import List, Tuple, Dict, Optional
+
+import numpy as np
+from PIL import Image
+
+from text_depixelizer.HMM.depix_hmm import DepixHMM
+from text_depixelizer.HMM.hmm import SparseTransitions
+from text_depixelizer.instrumentation import span, instrumented
+from text_depixelizer.parameters import PictureParameters
+from text_depixelizer.training_pipeline.original_image import OriginalImage
+from text_depixelizer.training_pipeline.pixelized_image import PixelizedImage
+from text_depixelizer.training_pipeline.training_pipeline import TrainingData
+from text_depixelizer.training_pipeline.features import get_features, get_background_features, Color
+from text_depixelizer.training_pipeline.windows import Window, get_block_values, get_window_values
+
+# Pseudo characters for the background before and after the text
+BEGIN: str = '<begin>'
+END: str = '<end>'
+
+
+class FactorizedDepixHMM(DepixHMM):
+    """
+    HMM whose hidden state is the character at the left edge of a window and the horizontal position of that edge
+    within the character, in pixels. Instead of one state per tuple of characters in a window, there is one state per
+    pixel column of every glyph, so the number of states grows linearly with the alphabet and doesn't depend on the
+    window size.
+
+    A window moves by one block per step: within a character the offset grows by block_size, once it passes the
+    advance width of the character the window wraps into the next character, with the character bigram probabilities
+    of the training texts. The background before the text is a pseudo character as wide as a window, that can repeat
+    itself, and the background after the text a pseudo character as wide as a block.
+    The image is extended by window_size - 1 columns of background on the right, so that every character of the text
+    is at the left edge of some window.
+
+    Approximations: characters are assumed to be placed at their advance width (kerning is only used to assign the
+    training windows to states), and the emission of a state is averaged over all characters that can follow it.
+    """
+    observations: List[int]
+    states: List[Tuple[str, int]]
+
+    symbols: List[str]
+    symbol_widths: np.ndarray
+    symbol_starts: np.ndarray
+    log_bigram_probabilities: np.ndarray
+
+    @instrumented('train')
+    def train(self, training_data: Optional[TrainingData] = None):
+        texts_train, original_images_train, pixelized_images_train, _ = training_data or self.generate_training_data()
+        self.calculate_symbols(texts_train)
+
+        windows_train: List[Window] = []
+        state_indices: List[np.ndarray] = []
+        for original_image, pixelized_image in zip(original_images_train, pixelized_images_train):
+            values: np.ndarray = self.get_padded_window_values(self.get_block_values(pixelized_image))
+            windows_train.extend(Window(characters=(), values=row, window_index=i) for i, row in enumerate(values))
+            state_indices.append(self.get_window_state_indices(original_image, pixelized_image, len(values)))
+
+        self.set_ink_percentile(windows_train)
+        if self.training_parameters.emission_model == 'clusters':
+            windows_train = self.fit_clusterer(windows_train)
+        self.calculate_factorized_hmm_properties(
+            texts_train,
+            windows_train,
+            np.concatenate(state_indices),
+            np.array([window.window_index == 0 for window in windows_train])
+        )
+
+    def calculate_symbols(self, texts: List[str]) -> None:
+        """
+        Determine the characters of the training texts, their widths and the states of the model
+        """
+        block_size: int = self.picture_parameters.block_size
+        alphabet: List[str] = sorted(set(''.join(texts)))
+
+        self.symbols = [BEGIN] + alphabet + [END]
+        self.symbol_widths = np.array(
+            [self.picture_parameters.window_size * block_size]
+            + [round(self.picture_parameters.font.getlength(c)) for c in alphabet]
+            + [block_size],
+            dtype=int
+        )
+        if self.symbol_widths.min() < block_size:
+            narrow: List[str] = [s for s, w in zip(self.symbols, self.symbol_widths) if w < block_size]
+            raise ValueError(f'The characters {narrow} are narrower than a block of {block_size} pixels, a window '
+                             f'could skip them')
+        self.symbol_starts = np.concatenate([[0], np.cumsum(self.symbol_widths)[:-1]])
+        self.states = [(symbol, offset) for symbol, width in zip(self.symbols, self.symbol_widths)
+                       for offset in range(width)]
+
+    def get_state_index(self, symbol_index: int, offset: int) -> int:
+        return self.symbol_starts[symbol_index] + offset
+
+    def get_window_state_indices(self, original_image: OriginalImage, pixelized_image: PixelizedImage,
+                                 n_windows: int) -> np.ndarray:
+        """
+        State of every window of a training image, from the position of its left edge relative to the characters
+        """
+        block_size: int = self.picture_parameters.block_size
+        font = self.picture_parameters.font
+        text: str = original_image.text
+        index_of_symbol: Dict[str, int] = {symbol: i for i, symbol in enumerate(self.symbols)}
+
+        character_starts: np.ndarray = np.array([round(font.getlength(text[:i])) for i in range(len(text) + 1)])
+        text_left: int = original_image.image_creation_options.padding[0]
+        window_lefts: np.ndarray = pixelized_image.origin[0] - text_left + block_size*np.arange(n_windows)
+
+        state_indices: np.ndarray = np.empty(n_windows, dtype=int)
+        for i, x in enumerate(window_lefts):
+            if x < 0:
+                symbol_index: int = index_of_symbol[BEGIN]
+                offset: int = max(0, self.symbol_widths[symbol_index] + x)
+            elif x >= character_starts[-1]:
+                symbol_index = index_of_symbol[END]
+                offset = min(x - character_starts[-1], block_size - 1)
+            else:
+                character: int = np.searchsorted(character_starts, x, side='right') - 1
+                symbol_index = index_of_symbol[text[character]]
+                offset = min(x - character_starts[character], self.symbol_widths[symbol_index] - 1)
+            state_indices[i] = self.get_state_index(symbol_index, offset)
+        return state_indices
+
+    def calculate_factorized_hmm_properties(self, texts: List[str], windows: List[Window], state_indices: np.ndarray,
+                                            is_first: np.ndarray) -> None:
+        """
+        Estimate the starting and emission probabilities from the training windows and their states, and the
+        transitions from the character bigrams of the training texts. is_first marks the first window of every image
+        """
+        time_logger: logging.Logger = logging.getLogger('time_logger')
+        t: float = time.perf_counter()
+
+        block_size: int = self.picture_parameters.block_size
+        smoothing: float = self.training_parameters.smoothing
+        n_states: int = len(self.states)
+
+        with span('hmm.estimate', n_items=len(windows)):
+            self.starting_probabilities = self.normalize_rows(
+                np.bincount(state_indices[is_first], minlength=n_states).astype(float) + smoothing
+            )
+
+            self.calculate_emissions(windows, state_indices)
+
+            bigram_probabilities: np.ndarray = self.get_bigram_probabilities(texts, self.symbols, smoothing)
+            with np.errstate(divide='ignore'):
+                self.log_bigram_probabilities = np.log(bigram_probabilities).astype(self.dtype)
+            self.sparse_transitions = self.get_factorized_transitions(bigram_probabilities)
+
+        # Indices of the structured viterbi step: states with an offset of at least one block are reached from the
+        # same character, the first block of every symbol is reached by wrapping from the last block of any symbol
+        offsets: np.ndarray = np.array([offset for _, offset in self.states], dtype=int)
+        self.shift_targets: np.ndarray = np.flatnonzero(offsets >= block_size)
+        self.wrap_sources: np.ndarray = (self.symbol_starts + self.symbol_widths - block_size)[:, np.newaxis] \
+            + np.arange(block_size)[np.newaxis, :]
+        self.wrap_targets: np.ndarray = self.symbol_starts[:, np.newaxis] + np.arange(block_size)[np.newaxis, :]
+
+        self.set_precision()
+
+        time_logger.info(f'Calculated HMM Properties in {time.perf_counter() - t} seconds')
+
+    @staticmethod
+    def get_bigram_probabilities(texts: List[str], symbols: List[str], smoothing: float = 0.0) -> np.ndarray:
+        """
+        Probability that symbol Y follows symbol X in the training texts, which start with BEGIN and end with END.
+        The background before the text repeats itself with probability 0.5, since the number of background blocks
+        left of the text is unknown. Nothing follows END but END, and nothing is followed by BEGIN but BEGIN.
+        With smoothing, k is added to the count of every other bigram
+        """
+        index_of_symbol: Dict[str, int] = {symbol: i for i, symbol in enumerate(symbols)}
+        begin, end = index_of_symbol[BEGIN], index_of_symbol[END]
+
+        counts: np.ndarray = np.zeros((len(symbols), len(symbols)))
+        for text in texts:
+            sequence: List[int] = [begin] + [index_of_symbol[c] for c in text] + [end]
+            np.add.at(counts, (sequence[:-1], sequence[1:]), 1)
+
+        counts += smoothing
+        counts[:, begin] = 0
+        counts[begin, end] = 0
+        probabilities: np.ndarray = DepixHMM.normalize_rows(counts)
+
+        probabilities[begin] *= 0.5
+        probabilities[begin, begin] = 0.5
+        probabilities[end] = 0
+        probabilities[end, end] = 1
+        return probabilities
+
+    def get_factorized_transitions(self, bigram_probabilities: np.ndarray) -> SparseTransitions:
+        """
+        Sparse transitions of the states. Decoding doesn't need them (see viterbi_step), but they keep the model
+        usable by everything that works on a plain HMM, which builds the dense matrix from them on access
+        """
+        block_size: int = self.picture_parameters.block_size
+        symbol_indices: np.ndarray = np.repeat(np.arange(len(self.symbols)), self.symbol_widths)
+        offsets: np.ndarray = np.array([offset for _, offset in self.states], dtype=int)
+        # Offset of the next window relative to the end of the character, where it is the offset in the next one
+        next_offsets: np.ndarray = offsets + block_size - self.symbol_widths[symbol_indices]
+
+        shift_sources: np.ndarray = np.flatnonzero(next_offsets < 0)
+        wrap_sources: np.ndarray = np.flatnonzero(next_offsets >= 0)
+        wrap_targets: np.ndarray = self.symbol_starts[np.newaxis, :] + next_offsets[wrap_sources, np.newaxis]
+        wrap_probabilities: np.ndarray = bigram_probabilities[symbol_indices[wrap_sources]]
+        possible: np.ndarray = wrap_probabilities > 0
+
+        return SparseTransitions.from_pairs(
+            len(self.states),
+            np.concatenate([shift_sources, np.broadcast_to(wrap_sources[:, np.newaxis], possible.shape)[possible]]),
+            np.concatenate([shift_sources + block_size, wrap_targets[possible]]),
+            np.concatenate([np.ones(len(shift_sources)), wrap_probabilities[possible]])
+        )
+
+    @property
+    def viterbi_step_size(self) -> int:
+        return len(self.states) + len(self.symbols)**2 * self.picture_parameters.block_size
+
+    def viterbi_step(self, v: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Structured viterbi step, whose cost is linear in the number of states plus n_symbols^2 * block_size,
+        instead of quadratic in the number of states
+        """
+        block_size: int = self.picture_parameters.block_size
+        best: np.ndarray = np.empty_like(v)
+        pointers: np.ndarray = np.empty(v.shape, dtype=int)
+
+        # Within a character, the only predecessor is one block to the left
+        best[:, self.shift_targets] = v[:, self.shift_targets - block_size]
+        pointers[:, self.shift_targets] = self.shift_targets - block_size
+
+        # candidates[b, x, y, o]: score of wrapping from the end of symbol x to offset o of symbol y
+        candidates: np.ndarray = v[:, self.wrap_sources][:, :, np.newaxis, :] \
+            + self.log_bigram_probabilities[np.newaxis, :, :, np.newaxis]
+        best_symbol: np.ndarray = np.argmax(candidates, axis=1)
+        best[:, self.wrap_targets] = np.take_along_axis(candidates, best_symbol[:, np.newaxis], axis=1)[:, 0]
+        pointers[:, self.wrap_targets] = self.wrap_sources[best_symbol, np.arange(block_size)]
+        return best, pointers
+
+    def get_block_values(self, pixelized_image: PixelizedImage) -> np.ndarray:
+        """
+        Features of the blocks of a generated image, which has the colors of the picture parameters
+        """
+        pp: PictureParameters = self.picture_parameters
+        block_values: np.ndarray = get_block_values(np.asarray(pixelized_image.image.convert('RGB')),
+                                                    pixelized_image.origin, pixelized_image.n_tiles, pp.block_size)
+        return get_features(block_values, pp.features, (pp.font_color, pp.background_color))
+
+    def get_padded_window_values(self, block_values: np.ndarray) -> np.ndarray:
+        """
+        Windows of the sampled blocks, after appending window_size - 1 columns of background, so there is one
+        window per block column
+        """
+        n_rows, _, n_channels = block_values.shape
+        padding: np.ndarray = np.empty((n_rows, self.picture_parameters.window_size - 1, n_channels),
+                                       dtype=block_values.dtype)
+        padding[:] = get_background_features(self.picture_parameters.features, self.picture_parameters.background_color)
+        return get_window_values(np.concatenate([block_values, padding], axis=1), self.picture_parameters.window_size)
+
+    def get_window_values(self, img: Image, colors: Optional[Tuple[Color, Color]] = None) -> np.ndarray:
+        block_size: int = self.picture_parameters.block_size
+        n_tiles: Tuple[int, int] = (img.size[0] // block_size, img.size[1] // block_size)
+        return self.get_padded_window_values(get_features(
+            get_block_values(np.asarray(img.convert('RGB')), (0, 0), n_tiles, block_size),
+            self.picture_parameters.features, colors, self.ink_percentile
+        ))
+
+    def get_test_window_values(self, pixelized_images: List[PixelizedImage],
+                               windows: List[List[Window]]) -> List[np.ndarray]:
+        return [
+            self.get_padded_window_values(self.get_block_values(pixelized_image)) for pixelized_image in pixelized_images
+        ]
+
+    def reconstruct_strings(self, results: List[List[Tuple[str, int]]]) -> List[str]:
+        with span('reconstruct', n_items=len(results)):
+            return [self.reconstruct_string(result) for result in results]
+
+    @staticmethod
+    def reconstruct_string(states: List[Tuple[str, int]]) -> str:
+        """
+        A character starts wherever the symbol changes or the offset wraps around
+        """
+        characters: List[str] = []
+        previous_symbol, previous_offset = None, None
+        for symbol, offset in states:
+            is_new: bool = symbol != previous_symbol or offset <= previous_offset
+            if is_new and symbol not in (BEGIN, END):
+                characters.append(symbol)
+            previous_symbol, previous_offset = symbol, offset
+        return ''.join(characters)
+
+    def to_compact_model(self):
+        raise ValueError('Only models with the tuples state model can be exported to a compact model')
+
+    def print_states(self):
+        logging.warning(f'Found {len(self.states)} states for {len(self.symbols) - 2} characters')
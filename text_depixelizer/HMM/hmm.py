@@ -1,15 +1,128 @@
 import logging
+import math
 from dataclasses import dataclass
 from functools import cached_property
-from typing import List, Optional, Any
+from typing import List, Optional, Any, Tuple, Sequence
 
 import numpy as np
 
+from text_depixelizer.instrumentation import span
+
 
 class HmmAttributeException(Exception):
     pass
 
 
+# Upper bound for the number of elements of the (batch, n_states, n_predecessors) score tensor in the batched viterbi
+MAX_BATCH_ELEMENTS: int = 2**24
+
+# Upper bound for the number of elements of the (batch, n_steps, n_states) backpointers and padded emissions in the
+# batched viterbi. Sequences that alone exceed it are decoded with checkpoints
+MAX_POINTER_ELEMENTS: int = 2**24
+
+
+def get_pointer_dtype(n_states: int) -> np.dtype:
+    """
+    Smallest unsigned integer type that holds the index of every state, e.g. uint8 for up to 256 states
+    """
+    return np.min_scalar_type(max(n_states - 1, 0))
+
+
+def get_checkpoint_interval(n_steps: int) -> int:
+    """
+    Steps between the checkpoints of HMM.log_viterbi_checkpointed that keep the fewest columns: about sqrt(n_steps)
+    checkpoints of scores and sqrt(n_steps) steps of backpointers
+    """
+    return max(1, math.ceil(math.sqrt(n_steps)))
+
+
+@dataclass
+class SparseTransitions:
+    """
+    Log transition probabilities, stored per target state as the states it can be reached from.
+    States with fewer predecessors than the maximum are padded with state 0 and a log-probability of -inf
+    """
+    predecessors: np.ndarray  # (n_states, max_predecessors)
+    log_probabilities: np.ndarray  # (n_states, max_predecessors)
+
+    @staticmethod
+    def from_dense(transition_probabilities: np.ndarray) -> 'SparseTransitions':
+        with np.errstate(divide='ignore'):
+            return SparseTransitions.from_dense_log(np.log(transition_probabilities))
+
+    @staticmethod
+    def from_dense_log(log_transition_probabilities: np.ndarray) -> 'SparseTransitions':
+        possible: np.ndarray = log_transition_probabilities > -np.inf
+        n_predecessors: int = max(1, int(possible.sum(axis=0).max(initial=0)))
+
+        # Possible predecessors first, each in ascending order, so ties are broken like in the dense viterbi
+        predecessors: np.ndarray = np.argsort(~possible, axis=0, kind='stable')[:n_predecessors].T
+        targets: np.ndarray = np.arange(len(log_transition_probabilities))[:, np.newaxis]
+        log_probabilities: np.ndarray = np.where(
+            possible[predecessors, targets], log_transition_probabilities[predecessors, targets], -np.inf
+        )
+        return SparseTransitions(predecessors=predecessors, log_probabilities=log_probabilities)
+
+    @staticmethod
+    def from_pairs(n_states: int, sources: np.ndarray, targets: np.ndarray,
+                   probabilities: np.ndarray) -> 'SparseTransitions':
+        """
+        Sparse log transitions from the probabilities of the possible transitions, without a dense matrix. Same as
+        from_dense of the matrix that is 0 for all other transitions
+        """
+        # Sorted by target, and the predecessors of every target in ascending order like in from_dense_log
+        order: np.ndarray = np.lexsort((sources, targets))
+        sources, targets, probabilities = sources[order], targets[order], probabilities[order]
+        counts: np.ndarray = np.bincount(targets, minlength=n_states)
+        positions: np.ndarray = np.arange(len(targets)) - np.repeat(np.cumsum(counts) - counts, counts)
+
+        predecessors: np.ndarray = np.zeros((n_states, max(1, int(counts.max(initial=0)))), dtype=np.intp)
+        log_probabilities: np.ndarray = np.full(predecessors.shape, -np.inf)
+        predecessors[targets, positions] = sources
+        with np.errstate(divide='ignore'):
+            log_probabilities[targets, positions] = np.log(probabilities)
+        return SparseTransitions(predecessors=predecessors, log_probabilities=log_probabilities)
+
+    def to_dense_log(self) -> np.ndarray:
+        """
+        Dense matrix of the log transition probabilities, e.g. for a model that doesn't decode with the sparse form
+        """
+        n_states: int = len(self.predecessors)
+        log_transition_probabilities: np.ndarray = np.full((n_states, n_states), -np.inf,
+                                                           dtype=self.log_probabilities.dtype)
+        possible: np.ndarray = self.log_probabilities > -np.inf
+        targets: np.ndarray = np.broadcast_to(np.arange(n_states)[:, np.newaxis], self.predecessors.shape)
+        log_transition_probabilities[self.predecessors[possible], targets[possible]] = self.log_probabilities[possible]
+        return log_transition_probabilities
+
+    @property
+    def n_predecessors(self) -> int:
+        return self.predecessors.shape[1]
+
+    @property
+    def is_sparse(self) -> bool:
+        """
+        Whether most transitions are impossible, so the batched viterbi is faster with the sparse form
+        """
+        return 2 * self.n_predecessors <= len(self.predecessors)
+
+
+@dataclass
+class ObservationEmissions:
+    """
+    Emission log-likelihoods of every step of an observation sequence, looked up when a step needs them instead of
+    stored as an (n_steps, n_states) array
+    """
+    log_emission_probabilities: np.ndarray  # (n_states, n_observations)
+    observations: np.ndarray  # (n_steps,)
+
+    def __len__(self) -> int:
+        return len(self.observations)
+
+    def __getitem__(self, step: int) -> np.ndarray:
+        return self.log_emission_probabilities[:, self.observations[step]]
+
+
 @dataclass
 class HMM:
     observations: List[Any]
@@ -18,17 +131,39 @@ class HMM:
     transition_probabilities: np.ndarray
     emission_probabilities: np.ndarray
 
+    @property
+    def dtype(self) -> np.dtype:
+        """
+        Floating point type of the log-probability tables and of the viterbi scores
+        """
+        return np.dtype(np.float64)
+
     @cached_property
     def log_starting_probabilities(self) -> np.ndarray:
-        return np.log(self.starting_probabilities)
+        with np.errstate(divide='ignore'):
+            return np.log(self.starting_probabilities).astype(self.dtype, copy=False)
 
     @cached_property
     def log_transition_probabilities(self) -> np.ndarray:
-        return np.log(self.transition_probabilities)
+        with np.errstate(divide='ignore'):
+            return np.log(self.transition_probabilities).astype(self.dtype, copy=False)
 
     @cached_property
     def log_emission_probabilities(self) -> np.ndarray:
-        return np.log(self.emission_probabilities)
+        with np.errstate(divide='ignore'):
+            return np.log(self.emission_probabilities).astype(self.dtype, copy=False)
+
+    @cached_property
+    def sparse_log_transitions(self) -> Optional[SparseTransitions]:
+        """
+        Sparse log transitions, if most transitions are impossible. The batched viterbi then only considers the
+        possible predecessors of every state instead of all states
+        """
+        sparse_transitions: SparseTransitions = SparseTransitions.from_dense(self.transition_probabilities)
+        if not sparse_transitions.is_sparse:
+            return None
+        sparse_transitions.log_probabilities = sparse_transitions.log_probabilities.astype(self.dtype, copy=False)
+        return sparse_transitions
 
     def validate_attributes(self) -> None:
         if len(self.starting_probabilities) != len(self.states):
@@ -60,7 +195,7 @@ class HMM:
                 v[:, i] = np.max(v[:, i-1] * self.transition_probabilities.T * self.emission_probabilities[np.newaxis, :, sequence[i]].T, 1)
                 pointers[:, i] = np.argmax(v[:, i-1] * self.transition_probabilities.T, 1)
 
-        x = np.empty(len(sequence), 'B')
+        x = np.empty(len(sequence), int)
         x[-1] = np.argmax(v[:, len(sequence)-1])
         for i in reversed(range(1, len(sequence))):
             x[i-1] = pointers[x[i], i]
@@ -68,23 +203,170 @@ class HMM:
         return [self.states[i] for i in x]
 
     def log_viterbi(self, sequence: List[Any]):
-        # Initialize tables
-        v: np.ndarray[float, float] = np.zeros((len(self.states), len(sequence)))
-        pointers: np.ndarray[Optional[float], Optional[float]] = np.empty(v.shape)
+        """
+        Most likely states of an observation sequence. Only keeps two columns of scores, see log_viterbi_checkpointed
+        """
+        state_indices, _ = self.log_viterbi_checkpointed(
+            ObservationEmissions(self.log_emission_probabilities, np.asarray(sequence, dtype=int))
+        )
+        return [self.states[i] for i in state_indices]
 
-        for i, observation in enumerate(sequence):
-            if i==0:
-                v[:, i] = self.log_starting_probabilities + self.log_emission_probabilities[:, observation]
-                pointers[:, i] = 0
+    def log_viterbi_checkpointed(self, log_emissions: Sequence[np.ndarray],
+                                 checkpoint_interval: Optional[int] = None) -> Tuple[np.ndarray, float]:
+        """
+        Log-viterbi of a single sequence, given the emission log-likelihoods of every step (an array of shape
+        (n_steps, n_states)). Returns the indices of the most likely states and their log-likelihood.
+        Only the scores of the previous step are kept, and the backpointers in the smallest integer type. Without a
+        checkpoint_interval, all n_steps columns of backpointers are kept. With one, e.g. get_checkpoint_interval, the
+        steps are split into segments of checkpoint_interval steps, and only the scores before every segment and the
+        backpointers of one segment are kept: the backtracking recomputes the backpointers of every segment from its
+        checkpoint, which runs the forward pass about twice, with O(n_states * sqrt(n_steps)) memory
+        """
+        n_steps: int = len(log_emissions)
+        if n_steps == 0:
+            return np.empty(0, dtype=int), 0.0
+        interval: int = checkpoint_interval or n_steps
+        n_segments: int = math.ceil(n_steps / interval)
 
-            else:
-                v[:, i] = np.max(v[:, i-1] + self.log_transition_probabilities.T + self.log_emission_probabilities[np.newaxis, :, sequence[i]].T, 1)
-                pointers[:, i] = np.argmax(v[:, i-1] + self.log_transition_probabilities.T, 1)
+        # pointers[i % interval]: state at step i - 1 that the best path to every state at step i comes from
+        pointers: np.ndarray = np.zeros((interval, len(self.states)), dtype=get_pointer_dtype(len(self.states)))
+        checkpoints: List[np.ndarray] = []  # Scores of the step before every segment but the first
+        v: np.ndarray = self.log_starting_probabilities + log_emissions[0]
+        for segment in range(n_segments):
+            if segment > 0:
+                checkpoints.append(v)
+            v = self.viterbi_steps(v, log_emissions, range(max(1, segment * interval),
+                                                           min((segment + 1) * interval, n_steps)), pointers)
 
-        x = np.empty(len(sequence), 'B')
-        x[-1] = np.argmax(v[:, len(sequence)-1])
-        for i in reversed(range(1, len(sequence))):
-            x[i-1] = pointers[x[i], i]
+        x: np.ndarray = np.empty(n_steps, dtype=int)
+        x[-1] = np.argmax(v)
+        score: float = float(v[x[-1]])
+        for segment in reversed(range(n_segments)):
+            steps: range = range(max(1, segment * interval), min((segment + 1) * interval, n_steps))
+            if segment < n_segments - 1:
+                # The backpointers of the last segment are still there from the forward pass
+                v = self.log_starting_probabilities + log_emissions[0] if segment == 0 else checkpoints[segment - 1]
+                self.viterbi_steps(v, log_emissions, steps, pointers)
+            for i in reversed(steps):
+                x[i - 1] = pointers[i % interval, x[i]]
 
-        return [self.states[i] for i in x]
+        return x, score
+
+    def viterbi_steps(self, v: np.ndarray, log_emissions: Sequence[np.ndarray], steps: range,
+                      pointers: np.ndarray) -> np.ndarray:
+        """
+        Run the steps of the log-viterbi of a single sequence from the scores v of the step before them, and store the
+        backpointers of every step i in pointers[i % len(pointers)]. Returns the scores of the last step
+        """
+        for i in steps:
+            best, step_pointers = self.viterbi_step(v[np.newaxis])
+            pointers[i % len(pointers)] = step_pointers[0]
+            v = best[0] + log_emissions[i]
+        return v
+
+    def log_viterbi_batch(self, sequences: List[List[Any]]) -> Tuple[List[List[Any]], np.ndarray]:
+        """
+        Runs the log-viterbi algorithm on several observation sequences at once.
+        Returns the most likely state sequence and its log-likelihood for every observation sequence
+        """
+        log_emissions: List[np.ndarray] = [
+            self.log_emission_probabilities[:, np.asarray(sequence, dtype=int)].T for sequence in sequences
+        ]
+        state_indices, scores = self.log_viterbi_from_log_emissions(log_emissions)
+        return [[self.states[i] for i in indices] for indices in state_indices], scores
+
+    @property
+    def viterbi_step_size(self) -> int:
+        """
+        Number of candidate scores that viterbi_step computes per sequence, used to size the batches
+        """
+        sparse_transitions: Optional[SparseTransitions] = self.sparse_log_transitions
+        n_predecessors: int = sparse_transitions.n_predecessors if sparse_transitions else len(self.states)
+        return len(self.states) * n_predecessors
+
+    def viterbi_step(self, v: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        One step of the batched log-viterbi: from the scores v of shape (batch, n_states) of the previous step,
+        returns the best score of reaching every state and the previous state it is reached from
+        """
+        sparse_transitions: Optional[SparseTransitions] = self.sparse_log_transitions
+        if sparse_transitions is None:
+            # candidates[b, j, k]: score of being in state j at the previous step and moving to state k
+            candidates: np.ndarray = v[:, :, np.newaxis] + self.log_transition_probabilities[np.newaxis]
+            pointers: np.ndarray = np.argmax(candidates, axis=1)
+            best: np.ndarray = np.take_along_axis(candidates, pointers[:, np.newaxis, :], axis=1)[:, 0]
+            return best, pointers
+
+        # candidates[b, k, p]: score of moving from the p-th predecessor of state k to state k
+        candidates = v[:, sparse_transitions.predecessors] + sparse_transitions.log_probabilities
+        best_predecessor: np.ndarray = np.argmax(candidates, axis=2)
+        pointers = np.take_along_axis(
+            sparse_transitions.predecessors[np.newaxis], best_predecessor[:, :, np.newaxis], axis=2
+        )[:, :, 0]
+        best = np.take_along_axis(candidates, best_predecessor[:, :, np.newaxis], axis=2)[:, :, 0]
+        return best, pointers
+
+    def log_viterbi_from_log_emissions(self, log_emissions: List[np.ndarray]) -> Tuple[List[np.ndarray], np.ndarray]:
+        """
+        Batched log-viterbi on precomputed emission log-likelihoods, one array of shape (sequence_length, n_states)
+        per sequence. Returns the indices of the most likely states and the log-likelihood of each sequence.
+        Sequences of similar length are decoded together in chunks that respect MAX_BATCH_ELEMENTS and
+        MAX_POINTER_ELEMENTS. Sequences that alone have more backpointers are decoded with checkpoints
+        """
+        n_states: int = len(self.states)
+        lengths: np.ndarray = np.array([len(e) for e in log_emissions], dtype=int)
+        state_indices: List[np.ndarray] = [np.empty(0, dtype=int) for _ in log_emissions]
+        scores: np.ndarray = np.zeros(len(log_emissions))
+
+        order: np.ndarray = np.argsort(lengths, kind='stable')
+        order = order[lengths[order] > 0]
+        if len(order) == 0:
+            return state_indices, scores
+        chunk_size: int = max(1, MAX_BATCH_ELEMENTS // self.viterbi_step_size)
+        pointer_dtype: np.dtype = get_pointer_dtype(n_states)
+
+        with span('viterbi', n_items=len(log_emissions)):
+            for sequence_index in order[lengths[order] * n_states > MAX_POINTER_ELEMENTS]:
+                state_indices[sequence_index], scores[sequence_index] = self.log_viterbi_checkpointed(
+                    log_emissions[sequence_index], get_checkpoint_interval(lengths[sequence_index])
+                )
+            order = order[lengths[order] * n_states <= MAX_POINTER_ELEMENTS]
+
+            chunk_start: int = 0
+            while chunk_start < len(order):
+                # The last sequence is the longest, it bounds the backpointers of the chunk
+                chunk_end: int = min(chunk_start + chunk_size, len(order))
+                chunk_end = min(chunk_end, chunk_start + max(
+                    1, MAX_POINTER_ELEMENTS // (lengths[order[chunk_end - 1]] * n_states)
+                ))
+                chunk: np.ndarray = order[chunk_start:chunk_end]
+                chunk_start = chunk_end
+                chunk_lengths: np.ndarray = lengths[chunk]
+                n_steps: int = chunk_lengths.max()
+
+                emissions: np.ndarray = np.zeros((len(chunk), n_steps, n_states), dtype=self.dtype)
+                for row, sequence_index in enumerate(chunk):
+                    emissions[row, :chunk_lengths[row]] = log_emissions[sequence_index]
+
+                v: np.ndarray = self.log_starting_probabilities[np.newaxis, :] + emissions[:, 0]
+                pointers: np.ndarray = np.zeros((len(chunk), n_steps, n_states), dtype=pointer_dtype)
+                for i in range(1, n_steps):
+                    best, pointers[:, i] = self.viterbi_step(v)
+
+                    # Sequences that already ended keep their final column
+                    active: np.ndarray = i < chunk_lengths
+                    v = np.where(active[:, np.newaxis], best + emissions[:, i], v)
+
+                # Backtracking, starting from the last step of every sequence
+                rows: np.ndarray = np.arange(len(chunk))
+                x: np.ndarray = np.zeros((len(chunk), n_steps), dtype=int)
+                x[rows, chunk_lengths - 1] = np.argmax(v, axis=1)
+                for i in reversed(range(1, n_steps)):
+                    active = i < chunk_lengths
+                    x[active, i-1] = pointers[rows[active], i, x[active, i]]
+
+                for row, sequence_index in enumerate(chunk):
+                    state_indices[sequence_index] = x[row, :chunk_lengths[row]]
+                    scores[sequence_index] = v[row, x[row, chunk_lengths[row] - 1]]
 
+        return state_indices, scores
@@ -0,0 +1,79 @@
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import List, Tuple, Dict
+
+import numpy as np
+
+
+@dataclass
+class HMMCounts:
+    """
+    How often every state starts an image, follows another state and emits every cluster, see
+    DepixHMM.count_windows. Counts of different images add up, so the counts of the shards of the training data
+    merge into the counts of all of it, and the model estimated from them is the same.
+    Only the transitions that occur are stored, as source and target state index and count, see
+    DepixHMM.count_transition_pairs
+    """
+    states: List[Tuple[str, ...]]
+    starting_counts: np.ndarray  # (n_states,)
+    transition_sources: np.ndarray  # (n_transitions,)
+    transition_targets: np.ndarray  # (n_transitions,)
+    transition_counts: np.ndarray  # (n_transitions,)
+    emission_counts: np.ndarray  # (n_states, n_observations)
+
+    @staticmethod
+    def merge(counts: List['HMMCounts']) -> 'HMMCounts':
+        """
+        Add up the counts of several shards. The states are sorted again, like the states of a model trained on the
+        windows of all shards
+        """
+        states: List[Tuple[str, ...]] = sorted({state for shard_counts in counts for state in shard_counts.states})
+        index_of_state: Dict[Tuple[str, ...], int] = {state: i for i, state in enumerate(states)}
+        n_observations: int = max(shard_counts.emission_counts.shape[1] for shard_counts in counts)
+        starting_counts: np.ndarray = np.zeros(len(states))
+        emission_counts: np.ndarray = np.zeros((len(states), n_observations))
+        pairs: List[np.ndarray] = []  # source * n_states + target of the transitions of every shard
+        for shard_counts in counts:
+            indices: np.ndarray = np.array([index_of_state[state] for state in shard_counts.states], dtype=int)
+            starting_counts[indices] += shard_counts.starting_counts
+            emission_counts[indices, :shard_counts.emission_counts.shape[1]] += shard_counts.emission_counts
+            pairs.append(indices[shard_counts.transition_sources] * len(states)
+                         + indices[shard_counts.transition_targets])
+
+        # Transitions that occur in several shards add up, ordered by source and target like count_transition_pairs
+        merged_pairs, pair_indices = np.unique(np.concatenate(pairs).astype(np.int64), return_inverse=True)
+        return HMMCounts(
+            states=states,
+            starting_counts=starting_counts,
+            transition_sources=merged_pairs // len(states),
+            transition_targets=merged_pairs % len(states),
+            transition_counts=np.bincount(pair_indices.ravel(), weights=np.concatenate(
+                [shard_counts.transition_counts for shard_counts in counts]
+            ), minlength=len(merged_pairs)),
+            emission_counts=emission_counts
+        )
+
+    def save(self, path: Path) -> None:
+        with open(path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                states=np.array(json.dumps(self.states)),
+                starting_counts=self.starting_counts,
+                transition_sources=self.transition_sources,
+                transition_targets=self.transition_targets,
+                transition_counts=self.transition_counts,
+                emission_counts=self.emission_counts
+            )
+
+    @staticmethod
+    def load(path: Path) -> 'HMMCounts':
+        with np.load(path, allow_pickle=False) as data:
+            return HMMCounts(
+                states=[tuple(state) for state in json.loads(str(data['states']))],
+                starting_counts=data['starting_counts'],
+                transition_sources=data['transition_sources'],
+                transition_targets=data['transition_targets'],
+                transition_counts=data['transition_counts'],
+                emission_counts=data['emission_counts']
+            )
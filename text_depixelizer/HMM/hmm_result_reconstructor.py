@@ -1,4 +1,4 @@
-from typing import List, Tuple
+from typing import List, Tuple, Dict, Set
 
 from PIL import ImageFont
 
@@ -8,6 +8,17 @@ def reconstruct_string_from_window_characters(window_characters: List[Tuple[str]
     Reconstruct the string from the HMM results, e.g.
     [('a', 'b'), ('b', 'c')] -> 'abc'
     """
+    characters: Set[str] = {c for characters_in_one_window in window_characters for c in characters_in_one_window}
+    return reconstruct_string_from_character_widths(
+        window_characters, block_size, {c: font.getsize(c)[0] for c in characters}
+    )
+
+
+def reconstruct_string_from_character_widths(window_characters: List[Tuple[str]], block_size: int,
+                                             character_widths: Dict[str, int]) -> str:
+    """
+    Same as reconstruct_string_from_window_characters, with the width of every character instead of the font
+    """
 
     reconstructed_result: List[str] = []
     estimated_positions: List[Tuple[int, int]] = []
@@ -18,18 +29,18 @@ def reconstruct_string_from_window_characters(window_characters: List[Tuple[str]
             char
             for char, pos
             in zip(reconstructed_result, estimated_positions)
-            if pos[1] >= (block_start_position - font.getsize(characters_in_one_window[0])[0])]
+            if pos[1] >= (block_start_position - character_widths[characters_in_one_window[0]])]
         overlap: int = get_overlap(possible_overlap_area, characters_in_one_window)
 
         offset: int = 0
         for i in range(overlap, len(list(characters_in_one_window))):
             character_to_be_added = characters_in_one_window[i]
             estimated_start: int = block_start_position + offset
-            estimated_end: int = block_start_position + font.getsize(character_to_be_added)[0] + offset
+            estimated_end: int = block_start_position + character_widths[character_to_be_added] + offset
             estimated_positions.append((estimated_start, estimated_end))
             reconstructed_result.append(characters_in_one_window[i])
 
-            offset = offset + font.getsize(character_to_be_added)[0]
+            offset = offset + character_widths[character_to_be_added]
 
     reconstructed_string: str = ''.join(reconstructed_result)
     return reconstructed_string
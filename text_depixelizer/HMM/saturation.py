@@ -0,0 +1,64 @@
+import logging
+from dataclasses import dataclass, field
+from typing import List, Set, Tuple, Optional
+
+from text_depixelizer.training_pipeline.windows import Window
+
+
+@dataclass
+class SaturationPoint:
+    n_img: int
+    n_states: int
+    n_transitions: int
+    n_emission_pairs: int  # Distinct (state, cluster) pairs
+
+
+@dataclass
+class CoverageSaturation:
+    """
+    Distinct states, transitions and (state, cluster) emission pairs of the training images, counted after every
+    increment of images. The training data is saturated once an increment adds fewer than threshold new items of
+    every kind, relative to the ones that were already seen, e.g. 0.01 for less than 1% new states, transitions and
+    emission pairs
+    """
+    threshold: float
+    states: Set[Tuple[str, ...]] = field(default_factory=set)
+    transitions: Set[Tuple[Tuple[str, ...], Tuple[str, ...]]] = field(default_factory=set)
+    emission_pairs: Set[Tuple[Tuple[str, ...], int]] = field(default_factory=set)
+    curve: List[SaturationPoint] = field(default_factory=list)
+
+    @property
+    def n_img(self) -> int:
+        return self.curve[-1].n_img if self.curve else 0
+
+    def add(self, windows: List[List[Window]], clusters: List[List[int]]) -> None:
+        """
+        Count the windows of an increment of images, and the clusters that the windows of every image belong to
+        """
+        for image_windows, image_clusters in zip(windows, clusters):
+            for window, k in zip(image_windows, image_clusters):
+                self.states.add(window.characters)
+                self.emission_pairs.add((window.characters, int(k)))
+            for window, next_window in zip(image_windows, image_windows[1:]):
+                self.transitions.add((window.characters, next_window.characters))
+
+        self.curve.append(SaturationPoint(self.n_img + len(windows), len(self.states), len(self.transitions),
+                                          len(self.emission_pairs)))
+        logging.info(f'Coverage of {self.n_img} training images: {len(self.states)} states, {len(self.transitions)} '
+                     f'transitions, {len(self.emission_pairs)} emission pairs')
+
+    @property
+    def discovery_rate(self) -> Optional[float]:
+        """
+        Largest relative growth of states, transitions and emission pairs in the last increment
+        """
+        if len(self.curve) < 2:
+            return None
+        previous, last = self.curve[-2], self.curve[-1]
+        return max((new - old) / max(old, 1) for old, new in [(previous.n_states, last.n_states),
+                                                              (previous.n_transitions, last.n_transitions),
+                                                              (previous.n_emission_pairs, last.n_emission_pairs)])
+
+    def is_saturated(self) -> bool:
+        discovery_rate: Optional[float] = self.discovery_rate
+        return discovery_rate is not None and discovery_rate < self.threshold
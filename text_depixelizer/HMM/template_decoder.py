@@ -0,0 +1,278 @@
+import logging
+import math
+import pickle
+import time
+from pathlib import Path
+from typing import List, Tuple, Optional
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+from text_depixelizer.HMM.evaluation import SequentialEvaluation, evaluate_sequentially
+from text_depixelizer.instrumentation import instrumented, span
+from text_depixelizer.parameters import PictureParameters, TrainingParameters
+from text_depixelizer.seeding import get_seed_sequence, TEST_DATA
+from text_depixelizer.training_pipeline.pixelized_image import determine_origin, determine_number_of_tiles
+from text_depixelizer.training_pipeline.text_generator import parse_pattern, PatternElement, RegexTextGenerator
+from text_depixelizer.training_pipeline.training_pipeline import create_training_data, TrainingData
+from text_depixelizer.training_pipeline.windows import get_block_values
+
+# Same as the padding of the generated training images, only the vertical position of the text depends on it
+PADDING: Tuple[int, int] = (20, 20)
+
+
+class TemplateDecoder:
+    """
+    Decoder for monospaced fonts, which needs no training data and no HMM.
+    With a monospaced font, the position of every character is known once the position of the text within the block
+    grid is known. The color of a block is the background plus the ink of the characters that overlap it, so every
+    block can be predicted from templates: the ink coverage of the blocks of every character, rendered at every
+    phase relative to the block grid. Decoding tries every phase of the text and every possible text length, and finds
+    the characters whose templates best explain the blocks with dynamic programming over the character positions.
+    The state of the dynamic programming is the character at a position, since a block column can also contain ink of
+    the following character.
+    """
+    picture_parameters: PictureParameters
+    training_parameters: TrainingParameters
+
+    states: List[str]  # The characters of the pattern
+    text_lengths: List[int]
+    advance: int
+    n_rows: int
+    templates: np.ndarray  # (n_characters, block_size, n_rows, n_columns), ink coverage between 0 and 1
+
+    def __init__(self, picture_parameters: PictureParameters, training_parameters: TrainingParameters):
+        self.picture_parameters = picture_parameters
+        self.training_parameters = training_parameters
+
+    @instrumented('train')
+    def train(self, training_data: Optional[TrainingData] = None):
+        """
+        Render the templates of the characters. No training data is needed, if some is given it is ignored
+        """
+        time_logger: logging.Logger = logging.getLogger('time_logger')
+        t: float = time.perf_counter()
+
+        font = self.picture_parameters.font
+        block_size: int = self.picture_parameters.block_size
+        self.states, self.text_lengths = self.get_alphabet_and_lengths(self.picture_parameters.pattern)
+
+        advances: List[int] = sorted({round(font.getlength(c)) for c in self.states})
+        if len(advances) > 1:
+            raise ValueError(f'The characters of {self.picture_parameters.pattern} have different widths {advances}, '
+                             f'templates only work for monospaced fonts')
+        self.advance = advances[0]
+        if self.advance < block_size:
+            raise ValueError(f'Characters of {self.advance} pixels are narrower than a block of {block_size} pixels')
+
+        offset_y: int = self.picture_parameters.offset_y % block_size
+        self.n_rows = determine_number_of_tiles(0, font.getmetrics(), (0, offset_y), block_size)[1]
+        with span('render_templates', n_items=len(self.states) * block_size):
+            self.templates = np.array([
+                [self.render_template(c, phase) for phase in range(block_size)] for c in self.states
+            ])
+
+        time_logger.info(f'Rendered {self.templates.shape[0]*self.templates.shape[1]} templates in '
+                         f'{time.perf_counter() - t} seconds')
+
+    @staticmethod
+    def get_alphabet_and_lengths(pattern: str) -> Tuple[List[str], List[int]]:
+        """
+        Characters and possible text lengths of a pattern. Patterns that can't be parsed are sampled instead
+        """
+        try:
+            elements: List[PatternElement] = parse_pattern(pattern)
+            alphabet: set = {c for element in elements for c in element.alphabet}
+            min_length: int = sum(element.min_count for element in elements)
+            max_length: int = sum(element.max_count for element in elements)
+            return sorted(alphabet), list(range(min_length, max_length + 1))
+        except ValueError:
+            texts: List[str] = RegexTextGenerator(pattern).generate_batch(1000)
+            return sorted(set(''.join(texts))), sorted({len(text) for text in texts})
+
+    def render_template(self, c: str, phase: int) -> np.ndarray:
+        """
+        Average ink coverage of the blocks of a character that starts phase pixels right of a block boundary
+        """
+        font = self.picture_parameters.font
+        block_size: int = self.picture_parameters.block_size
+        n_columns: int = self.get_n_template_columns()
+
+        _, origin_y = determine_origin(
+            PADDING, font.getmetrics(), (0, self.picture_parameters.offset_y % block_size), block_size
+        )
+        img: Image = Image.new('L', (PADDING[0] + (n_columns + 1)*block_size, origin_y + (self.n_rows + 1)*block_size))
+        ImageDraw.Draw(img).text((PADDING[0] + phase, PADDING[1]), c, font=font, fill=255)
+
+        coverage: np.ndarray = np.asarray(img, dtype=float)[
+            origin_y:origin_y + self.n_rows*block_size,
+            PADDING[0]:PADDING[0] + n_columns*block_size
+        ] / 255
+        return coverage.reshape(self.n_rows, block_size, n_columns, block_size).mean(axis=(1, 3))
+
+    def get_n_template_columns(self) -> int:
+        """
+        Number of block columns a character can overlap, including the ink that reaches beyond its advance width
+        """
+        font = self.picture_parameters.font
+        ink_right: int = max([self.advance] + [font.getbbox(c)[2] for c in self.states])
+        return math.ceil((self.picture_parameters.block_size - 1 + ink_right) / self.picture_parameters.block_size)
+
+    def get_coverage(self, block_values: np.ndarray) -> np.ndarray:
+        """
+        Ink coverage of the blocks, from their position on the line between the background and the font color
+        """
+        background: np.ndarray = np.array(self.picture_parameters.background_color, dtype=float)
+        ink: np.ndarray = np.array(self.picture_parameters.font_color, dtype=float) - background
+        return (block_values[:, :, :3].astype(float) - background) @ ink / (ink @ ink)
+
+    @property
+    def noise_variance(self) -> float:
+        """
+        Variance of the coverage of a block that comes from rounding its color to integers
+        """
+        ink: np.ndarray = np.array(self.picture_parameters.font_color, dtype=float) \
+            - np.array(self.picture_parameters.background_color, dtype=float)
+        return 1 / (12 * (ink @ ink))
+
+    def decode_coverage(self, coverage: np.ndarray) -> Tuple[str, float]:
+        """
+        Most likely text of the coverage of the blocks, and its log-likelihood under the rounding noise.
+        Tries every phase of the text start and every text length that results in the given number of block columns
+        """
+        block_size: int = self.picture_parameters.block_size
+        n_rows, n_columns = coverage.shape
+        if n_rows != self.n_rows:
+            raise ValueError(f'Expected an image with {self.n_rows} rows of blocks, got {n_rows}')
+
+        best_text, best_error = '', np.inf
+        for phase in range(block_size):
+            for n_characters in self.text_lengths:
+                if math.ceil((n_characters*self.advance + phase) / block_size) != n_columns:
+                    continue
+                text, error = self.decode_alignment(coverage, phase, n_characters)
+                if error < best_error:
+                    best_text, best_error = text, error
+
+        return best_text, -0.5 * best_error / self.noise_variance
+
+    def decode_alignment(self, coverage: np.ndarray, phase: int, n_characters: int) -> Tuple[str, float]:
+        """
+        Best characters for a text of n_characters that starts phase pixels right of the first block boundary.
+        Returns the text and its squared error
+        """
+        block_size: int = self.picture_parameters.block_size
+        n_columns: int = coverage.shape[1]
+        n_template_columns: int = self.templates.shape[3]
+
+        starts: np.ndarray = phase + self.advance*np.arange(n_characters + 1)
+        first_columns: np.ndarray = starts // block_size
+
+        # Every block column belongs to the character at its left edge, it only overlaps that one and the next.
+        # columns[i, j] is the j-th column of position i, padded with invalid columns to the same number per position
+        owners: np.ndarray = np.clip((block_size*np.arange(n_columns) - phase) // self.advance, 0, n_characters - 1)
+        counts: np.ndarray = np.bincount(owners, minlength=n_characters)
+        first_owned: np.ndarray = np.concatenate([[0], np.cumsum(counts)[:-1]])
+        columns: np.ndarray = first_owned[:, np.newaxis] + np.arange(max(counts.max(), 1))[np.newaxis, :]
+        valid: np.ndarray = np.arange(columns.shape[1])[np.newaxis, :] < counts[:, np.newaxis]
+        columns = np.where(valid, columns, 0)
+
+        def ink(position: np.ndarray) -> np.ndarray:
+            # Ink of every character at the given positions on the columns of each position, of shape
+            # (n_characters, columns per position, n_states, n_rows)
+            relative_columns: np.ndarray = columns - first_columns[position][:, np.newaxis]
+            overlaps: np.ndarray = valid & (relative_columns >= 0) & (relative_columns < n_template_columns) \
+                & (position < n_characters)[:, np.newaxis]
+            phases: np.ndarray = np.broadcast_to((starts[position] % block_size)[:, np.newaxis], columns.shape)
+            values: np.ndarray = self.templates[:, phases, :, np.clip(relative_columns, 0, n_template_columns - 1)]
+            return np.where(overlaps[:, :, np.newaxis, np.newaxis], values, 0.0)
+
+        # (n_characters, n_states, n_columns * n_rows)
+        positions: np.ndarray = np.arange(n_characters)
+        observed: np.ndarray = np.where(valid[:, :, np.newaxis], coverage.T[columns], 0.0)
+        residuals: np.ndarray = (observed[:, :, np.newaxis, :] - ink(positions)).transpose(0, 2, 1, 3)
+        residuals = residuals.reshape(n_characters, len(self.states), -1)
+        inks: np.ndarray = ink(positions + 1).transpose(0, 2, 1, 3).reshape(n_characters, len(self.states), -1)
+
+        # errors[i, x, y]: Squared error of the columns of position i, with character x at i and y at i+1
+        errors: np.ndarray = (residuals**2).sum(axis=2)[:, :, np.newaxis] \
+            - 2 * residuals @ inks.transpose(0, 2, 1) + (inks**2).sum(axis=2)[:, np.newaxis, :]
+
+        total: np.ndarray = np.zeros(len(self.states))
+        pointers: List[np.ndarray] = []
+        for position in range(n_characters - 1):
+            candidates: np.ndarray = total[:, np.newaxis] + errors[position]
+            pointers.append(np.argmin(candidates, axis=0))
+            total = candidates[pointers[-1], np.arange(len(self.states))]
+
+        # The last character is only followed by background, so its error doesn't depend on the second index
+        total = total + errors[-1][:, 0]
+        characters: List[int] = [int(np.argmin(total))]
+        for position_pointers in reversed(pointers):
+            characters.append(int(position_pointers[characters[-1]]))
+
+        return ''.join(self.states[i] for i in reversed(characters)), float(total.min())
+
+    def test_image(self, img: Image) -> str:
+        return self.test_images([img])[0]
+
+    def test_images(self, imgs: List[Image]) -> List[str]:
+        reconstructed_strings, _ = self.score_images(imgs)
+        return reconstructed_strings
+
+    @instrumented('decode')
+    def score_images(self, imgs: List[Image]) -> Tuple[List[str], np.ndarray]:
+        """
+        Reconstructs the hidden strings of pixelized images, whose top-left corner is the pixelization origin, and
+        returns the log-likelihood of every result
+        """
+        block_size: int = self.picture_parameters.block_size
+        block_values: List[np.ndarray] = [
+            get_block_values(np.asarray(img.convert('RGB')), (0, 0),
+                             (img.size[0] // block_size, img.size[1] // block_size), block_size)
+            for img in imgs
+        ]
+        return self.score_block_values(block_values)
+
+    def score_block_values(self, block_values: List[np.ndarray]) -> Tuple[List[str], np.ndarray]:
+        results: List[Tuple[str, float]] = [self.decode_coverage(self.get_coverage(values)) for values in block_values]
+        return [text for text, _ in results], np.array([score for _, score in results])
+
+    @instrumented('evaluate')
+    def evaluate(self, best_to_beat: Optional[float] = None) -> Tuple[float, float]:
+        """
+        Decode generated test images, see DepixHMM.evaluate
+        """
+        seed_sequence: Optional[np.random.SeedSequence] = get_seed_sequence(self.training_parameters.seed, TEST_DATA)
+
+        def decode_test_images(first_image: int, n_img: int) -> Tuple[List[str], List[str]]:
+            texts, _, pixelized_images, _ = create_training_data(
+                n_img=n_img,
+                picture_parameters=self.picture_parameters,
+                seed_sequence=seed_sequence,
+                first_image=first_image
+            )
+            reconstructed_texts, _ = self.score_block_values([
+                get_block_values(np.asarray(pixelized_image.image.convert('RGB')), pixelized_image.origin,
+                                 pixelized_image.n_tiles, pixelized_image.block_size)
+                for pixelized_image in pixelized_images
+            ])
+            return texts, reconstructed_texts
+
+        evaluation: SequentialEvaluation = evaluate_sequentially(
+            decode_test_images,
+            n_img=self.training_parameters.n_img_test,
+            chunk_size=self.training_parameters.evaluation_chunk_size,
+            tolerance=self.training_parameters.evaluation_tolerance,
+            best_to_beat=best_to_beat
+        )
+        return evaluation.accuracy, evaluation.average_similarity
+
+    def save(self, path: Path) -> None:
+        with open(path, 'wb') as f:
+            pickle.dump(self, f)
+
+    @staticmethod
+    def load(path: Path) -> 'TemplateDecoder':
+        with open(path, 'rb') as f:
+            return pickle.load(f)
@@ -0,0 +1,3 @@
+from text_depixelizer.cli import main
+
+main()
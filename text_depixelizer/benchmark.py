@@ -0,0 +1,285 @@
+import json
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import Dict, List, Callable, Any, Tuple, Optional
+
+import numpy as np
+import PIL
+from PIL import Image
+
+from text_depixelizer.HMM.clusterer import KmeansClusterer
+from text_depixelizer.HMM.depix_hmm import DepixHMM
+from text_depixelizer.HMM.hmm_result_reconstructor import reconstruct_string_from_window_characters
+from text_depixelizer.model_registry import train_model
+from text_depixelizer.parameters import PictureParameters, TrainingParameters
+from text_depixelizer.training_pipeline.original_image import OriginalImage
+from text_depixelizer.training_pipeline.pixelized_image import PixelizedImage
+from text_depixelizer.training_pipeline.training_pipeline import create_training_data, generate_texts, \
+    generate_original_images, generate_pixelized_images, generate_windows
+from text_depixelizer.training_pipeline.windows import Window
+
+
+def crop_pixelized_area(pixelized_image: PixelizedImage) -> Image:
+    """
+    Crop a pixelized image to its pixelized area, which is what a user would feed into DepixHMM.test_image
+    """
+    left, top = pixelized_image.origin
+    return pixelized_image.image.crop((
+        left,
+        top,
+        left + pixelized_image.n_tiles[0]*pixelized_image.block_size,
+        top + pixelized_image.n_tiles[1]*pixelized_image.block_size
+    ))
+
+
+def run_pipeline_benchmark(picture_parameters: PictureParameters,
+                           training_parameters: TrainingParameters,
+                           n_img_decode: int = 100) -> Dict[str, float]:
+    """
+    Time training, evaluation and decoding of a model with the given parameters. Returns the timings in seconds
+    """
+    timings: Dict[str, float] = {}
+
+    t: float = time.perf_counter()
+    hmm: DepixHMM = train_model(picture_parameters, training_parameters)
+    timings['train'] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    accuracy, average_similarity = hmm.evaluate()
+    timings['evaluate'] = time.perf_counter() - t
+
+    _, _, pixelized_images, _ = create_training_data(n_img_decode, picture_parameters)
+    imgs: List[Image] = [crop_pixelized_area(pixelized_image) for pixelized_image in pixelized_images]
+    t = time.perf_counter()
+    hmm.test_images(imgs)
+    timings['decode'] = time.perf_counter() - t
+    timings['decode_per_image'] = timings['decode'] / max(1, n_img_decode)
+
+    timings['accuracy'] = accuracy
+    timings['average_similarity'] = average_similarity
+    return timings
+
+
+@dataclass
+class BenchmarkScale:
+    name: str
+    n_img_train: int
+    n_img_test: int
+    n_clusters: int
+
+
+@dataclass
+class BenchmarkResult:
+    stage: str
+    scale: str
+    n_items: int
+    repeats: int
+    min_seconds: float
+    median_seconds: float
+
+    @property
+    def items_per_second(self) -> float:
+        return self.n_items / self.min_seconds if self.min_seconds > 0 else float('inf')
+
+
+default_scales: List[BenchmarkScale] = [
+    BenchmarkScale(name='small', n_img_train=100, n_img_test=20, n_clusters=50),
+    BenchmarkScale(name='medium', n_img_train=1000, n_img_test=100, n_clusters=300),
+    BenchmarkScale(name='large', n_img_train=5000, n_img_test=200, n_clusters=300)
+]
+
+
+def seed_random_state(seed: int) -> None:
+    """
+    Text generation (rstr), the random pixelization origin and KMeans all draw from the global random states
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+
+
+def time_stage(function: Callable[[], Any], repeats: int, seed: int) -> Tuple[Any, List[float]]:
+    """
+    Run a stage several times with the same seed, so every repeat does exactly the same work.
+    Returns the result of the last run and the durations of all runs
+    """
+    durations: List[float] = []
+    result: Any = None
+    for _ in range(repeats):
+        seed_random_state(seed)
+        t: float = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - t)
+    return result, durations
+
+
+def benchmark_scale(picture_parameters: PictureParameters, scale: BenchmarkScale, repeats: int = 3,
+                    seed: int = 0) -> List[BenchmarkResult]:
+    """
+    Time every stage of the pipeline separately. The input of every stage is the output of the previous one
+    """
+    results: List[BenchmarkResult] = []
+
+    def run(stage: str, function: Callable[[], Any], n_items: int, stage_repeats: int = repeats) -> Any:
+        result, durations = time_stage(function, stage_repeats, seed)
+        results.append(BenchmarkResult(
+            stage=stage,
+            scale=scale.name,
+            n_items=n_items,
+            repeats=stage_repeats,
+            min_seconds=min(durations),
+            median_seconds=statistics.median(durations)
+        ))
+        return result
+
+    pp: PictureParameters = picture_parameters
+    n_img: int = scale.n_img_train
+
+    texts: List[str] = run('text_generation', lambda: generate_texts(n_img, pp.pattern), n_img)
+    original_images: List[OriginalImage] = run(
+        'rendering', lambda: generate_original_images(texts, pp.font, pp.font_color, pp.background_color), n_img
+    )
+    pixelized_images: List[PixelizedImage] = run(
+        'pixelization',
+        lambda: generate_pixelized_images(original_images, pp.block_size, pp.randomize_pixelization_origin_x,
+                                          pp.offset_y),
+        n_img
+    )
+    windows: List[List[Window]] = run(
+        'windows', lambda: generate_windows(original_images, pixelized_images, pp.window_size), n_img
+    )
+    windows_flattened: List[Window] = [window for image_windows in windows for window in image_windows]
+
+    clusterer: KmeansClusterer = run(
+        'clustering_fit', lambda: KmeansClusterer(windows_flattened, scale.n_clusters), len(windows_flattened)
+    )
+    run('clustering_assign', lambda: clusterer.map_windows_to_cluster(windows_flattened), len(windows_flattened))
+
+    hmm: DepixHMM = DepixHMM(pp, TrainingParameters(
+        n_img_train=scale.n_img_train, n_img_test=scale.n_img_test, n_clusters=scale.n_clusters
+    ))
+    hmm.clusterer = clusterer
+    run('hmm_estimation', lambda: hmm.calculate_hmm_properties(windows_flattened), len(windows_flattened))
+
+    # Decoding stages run on separate test data
+    seed_random_state(seed + 1)
+    _, _, pixelized_images_test, windows_test = create_training_data(scale.n_img_test, pp)
+    clusterer.map_windows_to_cluster([window for image_windows in windows_test for window in image_windows])
+    sequences: List[List[int]] = [[window.k for window in image_windows] for image_windows in windows_test]
+
+    viterbi_results, _ = run('viterbi', lambda: hmm.log_viterbi_batch(sequences), scale.n_img_test)
+    run(
+        'reconstruction',
+        lambda: [reconstruct_string_from_window_characters(result, pp.block_size, pp.font) for result in viterbi_results],
+        scale.n_img_test
+    )
+    imgs: List[Image] = [crop_pixelized_area(pixelized_image) for pixelized_image in pixelized_images_test]
+    run('decode', lambda: hmm.test_images(imgs), scale.n_img_test)
+    run('evaluate', lambda: hmm.evaluate(), scale.n_img_test)
+
+    return results
+
+
+def run_benchmark_suite(picture_parameters: PictureParameters,
+                        scales: Optional[List[BenchmarkScale]] = None,
+                        repeats: int = 3,
+                        seed: int = 0) -> Dict[str, Any]:
+    """
+    Benchmark all stages of the pipeline at several scales with fixed seeds.
+    Returns a JSON serializable report, including the versions of the environment, so runs can be compared
+    """
+    import sklearn
+
+    if scales is None:
+        scales = default_scales
+    results: List[BenchmarkResult] = [
+        result for scale in scales for result in benchmark_scale(picture_parameters, scale, repeats, seed)
+    ]
+
+    return {
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'numpy': np.__version__,
+            'pillow': PIL.__version__,
+            'scikit-learn': sklearn.__version__
+        },
+        'parameters': {
+            'pattern': picture_parameters.pattern,
+            'font': ' '.join(picture_parameters.font.getname()),
+            'font_size': picture_parameters.font.size,
+            'block_size': picture_parameters.block_size,
+            'window_size': picture_parameters.window_size,
+            'repeats': repeats,
+            'seed': seed
+        },
+        'scales': [asdict(scale) for scale in scales],
+        'results': [{**asdict(result), 'items_per_second': result.items_per_second} for result in results]
+    }
+
+
+def compare_benchmarks(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float = 0.2) -> List[str]:
+    """
+    Compare two reports of run_benchmark_suite and describe every stage that got slower by more than the tolerance
+    """
+    baseline_seconds: Dict[Tuple[str, str], float] = {
+        (result['scale'], result['stage']): result['min_seconds'] for result in baseline['results']
+    }
+
+    regressions: List[str] = []
+    for result in current['results']:
+        before: float = baseline_seconds.get((result['scale'], result['stage']))
+        if before and result['min_seconds'] > before*(1 + tolerance):
+            regressions.append(
+                f'{result["scale"]}/{result["stage"]}: {before:.4f}s -> {result["min_seconds"]:.4f}s '
+                f'({result["min_seconds"]/before - 1:+.0%})'
+            )
+    return regressions
+
+
+# Run in a fresh interpreter, so the measurements don't include anything the benchmark itself imported
+DECODE_WORKER_SCRIPT: str = '''
+import json, sys, time
+from pathlib import Path
+model_path = Path(sys.argv[1])
+t = time.perf_counter()
+if model_path.suffix == '.npz':
+    from text_depixelizer.HMM.compact_model import CompactModel as Model
+else:
+    from text_depixelizer.HMM.depix_hmm import DepixHMM as Model
+import_seconds = time.perf_counter() - t
+t = time.perf_counter()
+model = Model.load(model_path)
+load_seconds = time.perf_counter() - t
+# ru_maxrss survives exec, so it would include the parent process. VmHWM is the peak of this process only
+try:
+    max_rss_kb = next(int(line.split()[1]) for line in open('/proc/self/status') if line.startswith('VmHWM'))
+except OSError:
+    # No /proc outside of Linux, and no resource module on Windows
+    from text_depixelizer.instrumentation import get_peak_rss
+    max_rss_kb = get_peak_rss() / 1024
+print(json.dumps({
+    'import_seconds': import_seconds,
+    'load_seconds': load_seconds,
+    'max_rss_mb': max_rss_kb / 1024,
+    'sklearn_imported': 'sklearn' in sys.modules
+}))
+'''
+
+
+def measure_decode_worker(model_path: Path) -> Dict[str, Any]:
+    """
+    Start a new python process that loads a model like a decode worker. Returns the time to import the decoding code,
+    the time to load the model, the peak resident memory of the process in MB and whether scikit-learn was imported
+    """
+    result: subprocess.CompletedProcess = subprocess.run(
+        [sys.executable, '-c', DECODE_WORKER_SCRIPT, str(model_path)],
+        capture_output=True, text=True, check=True,
+        cwd=Path(__file__).resolve().parent.parent
+    )
+    return json.loads(result.stdout)
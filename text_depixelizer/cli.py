@@ -0,0 +1,398 @@
+import argparse
+import dataclasses
+import functools
+import json
+import logging
+import random
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Tuple, Iterator, Union, Dict, Any, Callable
+
+import numpy as np
+from PIL import Image, ImageFont
+
+from resources.fonts import DemoFontPaths
+from text_depixelizer.HMM.compact_model import CompactModel
+from text_depixelizer.HMM.depix_hmm import DepixHMM
+from text_depixelizer.benchmark import run_pipeline_benchmark, run_benchmark_suite, compare_benchmarks, \
+    default_scales, BenchmarkScale
+from text_depixelizer.depix_hmm import align_image
+from text_depixelizer.ensemble import EnsembleDecoder
+from text_depixelizer.instrumentation import record_run, Recorder
+from text_depixelizer.model_registry import ModelRegistry, get_model_key, train_model
+from text_depixelizer.parameters import PictureParameters, TrainingParameters
+from text_depixelizer.sharded_training import train_sharded
+
+IMAGE_SUFFIXES: Tuple[str, ...] = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.tif', '.tiff')
+
+
+def parse_color(value: str) -> Tuple[int, int, int]:
+    """
+    Parse a color given as 'r,g,b'
+    """
+    color: Tuple[int, ...] = tuple(int(channel) for channel in value.split(','))
+    if len(color) != 3:
+        raise argparse.ArgumentTypeError(f'Expected a color as r,g,b, got {value}')
+    return color
+
+
+def parse_scales(value: str) -> List[BenchmarkScale]:
+    """
+    Parse the names of benchmark scales given as 'small,medium'
+    """
+    scales: Dict[str, BenchmarkScale] = {scale.name: scale for scale in default_scales}
+    unknown: List[str] = [name for name in value.split(',') if name not in scales]
+    if unknown:
+        raise argparse.ArgumentTypeError(f'Unknown scales {",".join(unknown)}, expected any of {",".join(scales)}')
+    return [scales[name] for name in value.split(',')]
+
+
+def resolve_font_path(font: str) -> str:
+    demo_fonts = {'arial': DemoFontPaths.arial, 'micr': DemoFontPaths.micr}
+    return str(demo_fonts.get(font.lower(), font))
+
+
+def get_picture_parameters(args: argparse.Namespace) -> PictureParameters:
+    return PictureParameters(
+        pattern=args.pattern,
+        font=ImageFont.truetype(resolve_font_path(args.font), args.font_size),
+        font_color=args.font_color,
+        background_color=args.background_color,
+        block_size=args.block_size,
+        randomize_pixelization_origin_x=args.randomize_origin_x,
+        window_size=args.window_size,
+        offset_y=args.offset_y,
+        features=args.features
+    )
+
+
+def get_training_parameters(args: argparse.Namespace) -> TrainingParameters:
+    return TrainingParameters(
+        n_img_train=args.n_img_train,
+        n_img_test=args.n_img_test,
+        n_clusters=args.n_clusters,
+        seed=args.seed,
+        text_generation=args.text_generation,
+        smoothing=args.smoothing,
+        smoothing_backoff=args.smoothing_backoff,
+        pruning_threshold=args.pruning_threshold,
+        state_model=args.state_model,
+        emission_model=args.emission_model,
+        clustering=args.clustering,
+        precision=args.precision,
+        evaluation_tolerance=args.evaluation_tolerance,
+        saturation_threshold=args.saturation_threshold,
+        saturation_increment=args.saturation_increment
+    )
+
+
+def seed_everything(seed: Optional[int]) -> None:
+    if seed is not None:
+        random.seed(seed)
+        np.random.seed(seed)
+
+
+def find_images(paths: List[Path]) -> List[Path]:
+    """
+    Expand directories into the images they contain
+    """
+    images: List[Path] = []
+    for path in paths:
+        if path.is_dir():
+            images.extend(sorted(p for p in path.iterdir() if p.suffix.lower() in IMAGE_SUFFIXES))
+        else:
+            images.append(path)
+    return images
+
+
+_worker_model: Optional[Union[DepixHMM, CompactModel, EnsembleDecoder]] = None
+
+
+def load_model(model_path: Path) -> Union[DepixHMM, CompactModel]:
+    """
+    Models exported with the export command are .npz files, that are decoded without scikit-learn
+    """
+    if model_path.suffix == '.npz':
+        return CompactModel.load(model_path)
+    return DepixHMM.load(model_path)
+
+
+def _init_decode_worker(model_paths: List[Path], fuse: bool = False) -> None:
+    """
+    Load the model, or an ensemble if several models are given
+    """
+    global _worker_model
+    models: List[Union[DepixHMM, CompactModel]] = [load_model(model_path) for model_path in model_paths]
+    _worker_model = models[0] if len(models) == 1 else EnsembleDecoder(models, fuse=fuse)
+
+
+def _decode_paths(paths: List[Path], align: bool) -> List[str]:
+    imgs: List[Image.Image] = []
+    for path in paths:
+        with Image.open(path) as img:
+            img.load()
+            if align:
+                img, _ = align_image(img, _worker_model.picture_parameters)
+            imgs.append(img)
+
+    try:
+        return _worker_model.test_images(imgs)
+    except ValueError:
+        # Decode the images one by one, so a single image that doesn't fit the model only fails itself
+        texts: List[str] = []
+        for path, img in zip(paths, imgs):
+            try:
+                texts.append(_worker_model.test_image(img))
+            except ValueError as e:
+                logging.error(f'Could not decode {path}: {e}')
+                texts.append('')
+        return texts
+
+
+def chunks(items: List[Path], size: int) -> Iterator[List[Path]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def train_sharded_model(picture_parameters: PictureParameters, training_parameters: TrainingParameters,
+                        n_shards: int, shard_dir: Optional[Path], n_workers: int) -> DepixHMM:
+    """
+    Train a model with train_sharded, in a temporary shard directory if none is given
+    """
+    with tempfile.TemporaryDirectory() as temporary_dir:
+        return train_sharded(picture_parameters, training_parameters, n_shards, shard_dir or Path(temporary_dir),
+                             n_workers=n_workers)
+
+
+def train(args: argparse.Namespace) -> None:
+    picture_parameters: PictureParameters = get_picture_parameters(args)
+    training_parameters: TrainingParameters = get_training_parameters(args)
+
+    build_model: Callable[[PictureParameters, TrainingParameters], DepixHMM] = train_model
+    if args.shards:
+        build_model = functools.partial(train_sharded_model, n_shards=args.shards, shard_dir=args.shard_dir,
+                                        n_workers=args.workers)
+
+    model_path: Optional[Path] = None
+    if args.cache_dir:
+        hmm: DepixHMM = ModelRegistry(cache_dir=args.cache_dir, build_model=build_model).get(picture_parameters,
+                                                                                             training_parameters)
+        model_path = args.cache_dir / f'{get_model_key(picture_parameters, training_parameters)}.pickle'
+    else:
+        hmm = build_model(picture_parameters, training_parameters)
+
+    if args.output:
+        hmm.save(args.output)
+        model_path = args.output
+
+    result: Dict[str, Any] = {'model': str(model_path), 'n_states': len(hmm.states)}
+    if getattr(hmm, 'saturation', None) is not None:
+        result['n_img_train'] = hmm.saturation.n_img
+        result['saturation_curve'] = [dataclasses.asdict(point) for point in hmm.saturation.curve]
+    print(json.dumps(result))
+
+
+def resolve_model_path(model: Path, cache_dir: Optional[Path]) -> Path:
+    """
+    Models can be given as path, or as the key of a model in the cache directory
+    """
+    if not model.exists() and cache_dir and (cache_dir / f'{model}.pickle').exists():
+        return cache_dir / f'{model}.pickle'
+    return model
+
+
+def evaluate(args: argparse.Namespace) -> None:
+    hmm: DepixHMM = DepixHMM.load(resolve_model_path(args.model, args.cache_dir))
+    if args.n_img_test:
+        hmm.training_parameters = dataclasses.replace(hmm.training_parameters, n_img_test=args.n_img_test)
+    if args.evaluation_tolerance is not None:
+        hmm.training_parameters = dataclasses.replace(hmm.training_parameters,
+                                                      evaluation_tolerance=args.evaluation_tolerance)
+    accuracy, average_similarity = hmm.evaluate()
+    print(json.dumps({'accuracy': accuracy, 'average_similarity': average_similarity}))
+
+
+def export(args: argparse.Namespace) -> None:
+    hmm: DepixHMM = DepixHMM.load(resolve_model_path(args.model, args.cache_dir))
+    if not hasattr(hmm, 'to_compact_model'):
+        raise ValueError(f'Models of type {type(hmm).__name__} can not be exported')
+    hmm.to_compact_model().save(args.output)
+    print(json.dumps({'model': str(args.output), 'n_states': len(hmm.states)}))
+
+
+def decode(args: argparse.Namespace) -> None:
+    model_paths: List[Path] = [resolve_model_path(model, args.cache_dir) for model in args.model]
+    paths: List[Path] = find_images(args.images)
+    batches: List[List[Path]] = list(chunks(paths, args.batch_size))
+
+    if args.workers > 1:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_decode_worker,
+                                 initargs=(model_paths, args.fuse)) as executor:
+            results: List[List[str]] = list(executor.map(_decode_paths, batches, [args.align] * len(batches)))
+    else:
+        _init_decode_worker(model_paths, args.fuse)
+        results = [_decode_paths(batch, args.align) for batch in batches]
+
+    for path, text in zip(paths, (text for texts in results for text in texts)):
+        print(f'{path}\t{text}')
+
+
+def bench(args: argparse.Namespace) -> None:
+    if args.suite:
+        report: dict = run_benchmark_suite(get_picture_parameters(args), args.scales, args.repeats,
+                                           args.seed if args.seed is not None else 0)
+    else:
+        report = run_pipeline_benchmark(get_picture_parameters(args), get_training_parameters(args),
+                                        args.n_img_decode)
+
+    output: str = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(output)
+    print(output)
+
+    if args.baseline:
+        regressions: List[str] = compare_benchmarks(json.loads(args.baseline.read_text()), report)
+        for regression in regressions:
+            print(f'Regression: {regression}', file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+def add_common_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--cache-dir', type=Path, default=None, help='Directory to store and reuse trained models')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the random number generators')
+    parser.add_argument('--log-level', default='WARNING', help='Log level, e.g. INFO or DEBUG')
+    parser.add_argument('--profile', type=Path, default=None,
+                        help='Write the time and memory spent in every stage as JSON to this file')
+    parser.add_argument('--trace-memory', action='store_true', help='Also trace python memory allocations per stage')
+
+
+def add_model_arguments(parser: argparse.ArgumentParser) -> None:
+    parser.add_argument('--pattern', required=True, help='Regex pattern of the texts to train on, e.g. "\\d{8,12}"')
+    parser.add_argument('--font', default='arial', help='Path to a .ttf file, or one of the demo fonts: arial, micr')
+    parser.add_argument('--font-size', type=int, default=50)
+    parser.add_argument('--font-color', type=parse_color, default=(0, 0, 0), help='Text color as r,g,b')
+    parser.add_argument('--background-color', type=parse_color, default=(255, 255, 255), help='Background color as r,g,b')
+    parser.add_argument('--block-size', type=int, required=True)
+    parser.add_argument('--window-size', type=int, default=5)
+    parser.add_argument('--offset-y', type=int, default=0)
+    parser.add_argument('--randomize-origin-x', action='store_true')
+    parser.add_argument('--features', choices=('rgb', 'coverage'), default='rgb',
+                        help='Windows of the colors of the blocks, or of their ink coverage, given the font and background '
+                             'color detected in every image. Coverage models decode any color scheme')
+    parser.add_argument('--n-img-train', type=int, default=1000)
+    parser.add_argument('--n-img-test', type=int, default=100)
+    parser.add_argument('--n-clusters', type=int, default=300)
+    parser.add_argument('--text-generation', choices=('random', 'coverage'), default='random',
+                        help='Sample the training texts at random, or cover all character n-grams evenly')
+    parser.add_argument('--smoothing', type=float, default=0.0,
+                        help='Pseudo count added to every starting state, transition and emission')
+    parser.add_argument('--smoothing-backoff', action='store_true',
+                        help='Spread the transition pseudo counts like the transitions of states with the same suffix')
+    parser.add_argument('--pruning-threshold', type=float, default=0.0, help='Drop less likely transitions')
+    parser.add_argument('--state-model', choices=('tuples', 'factorized', 'templates'), default='tuples',
+                        help='States are the tuples of characters in a window, or a character and an offset within it. '
+                             'Monospaced fonts can be decoded with rendered templates of the characters instead')
+    parser.add_argument('--emission-model', choices=('clusters', 'gaussian'), default='clusters',
+                        help='States emit the k-means cluster of a window, or its pixel values from a normal distribution')
+    parser.add_argument('--clustering', choices=('kmeans', 'bisecting'), default='kmeans',
+                        help='Cluster the windows with k-means, or with a tree of 2-means splits')
+    parser.add_argument('--precision', choices=('float64', 'float32'), default='float64',
+                        help='Type of the centroids, probability tables and viterbi scores. float32 halves the model')
+    parser.add_argument('--evaluation-tolerance', type=float, default=0.0,
+                        help='Stop evaluating once the 95%% confidence intervals of accuracy and similarity are within '
+                             '+- this tolerance, e.g. 0.02. 0 decodes all test images')
+    parser.add_argument('--saturation-threshold', type=float, default=0.0,
+                        help='Size the training data automatically: --n-img-train becomes a maximum, and images are '
+                             'generated until an increment adds fewer new states, transitions and emission pairs than '
+                             'this fraction, e.g. 0.01')
+    parser.add_argument('--saturation-increment', type=int, default=100,
+                        help='Training images per increment when sizing the training data automatically')
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser: argparse.ArgumentParser = argparse.ArgumentParser(
+        prog='text_depixelizer', description='Recover text from pixelized images with Hidden Markov Models'
+    )
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    train_parser = subparsers.add_parser('train', help='Train a model and save it')
+    add_model_arguments(train_parser)
+    train_parser.add_argument('--output', type=Path, default=None, help='Path of the saved model')
+    train_parser.add_argument('--shards', type=int, default=0,
+                              help='Split the training images into this many shards, that --workers processes cluster '
+                                   'and count separately before their counts are merged into one model')
+    train_parser.add_argument('--workers', type=int, default=1, help='Number of processes of sharded training')
+    train_parser.add_argument('--shard-dir', type=Path, default=None,
+                              help='Shared directory of the windows, centroids and counts of the shards. Defaults to a '
+                                   'temporary directory')
+    train_parser.set_defaults(function=train)
+
+    evaluate_parser = subparsers.add_parser('evaluate', help='Evaluate a saved model on generated test images')
+    evaluate_parser.add_argument('--model', type=Path, required=True, help='Path or key of a cached model')
+    evaluate_parser.add_argument('--n-img-test', type=int, default=None)
+    evaluate_parser.add_argument('--evaluation-tolerance', type=float, default=None,
+                                 help='Stop once the 95%% confidence intervals are within +- this tolerance')
+    evaluate_parser.set_defaults(function=evaluate)
+
+    export_parser = subparsers.add_parser('export', help='Export a saved model for decoding without scikit-learn')
+    export_parser.add_argument('--model', type=Path, required=True, help='Path or key of a cached model')
+    export_parser.add_argument('--output', type=Path, required=True, help='Path of the exported model, a .npz file')
+    export_parser.set_defaults(function=export)
+
+    decode_parser = subparsers.add_parser('decode', help='Decode pixelized images with a saved model')
+    decode_parser.add_argument('--model', type=Path, nargs='+', required=True,
+                               help='Path or key of a cached model. With several models, e.g. one per offset_y, every '
+                                    'image is decoded with all of them and the most likely result is kept')
+    decode_parser.add_argument('--fuse', action='store_true',
+                               help='Add up the likelihoods of the models of an ensemble that decode the same text')
+    decode_parser.add_argument('images', type=Path, nargs='+', help='Images or directories of images')
+    decode_parser.add_argument('--batch-size', type=int, default=32)
+    decode_parser.add_argument('--workers', type=int, default=1, help='Number of processes that decode the batches')
+    decode_parser.add_argument('--align', action='store_true', help='Crop the images to their detected block grid')
+    decode_parser.set_defaults(function=decode)
+
+    bench_parser = subparsers.add_parser('bench', help='Time training, evaluation and decoding')
+    add_model_arguments(bench_parser)
+    bench_parser.add_argument('--n-img-decode', type=int, default=100)
+    bench_parser.add_argument('--output', type=Path, default=None, help='Write the results as JSON to this file')
+    bench_parser.add_argument('--suite', action='store_true',
+                              help='Time every stage of the pipeline separately at several scales')
+    bench_parser.add_argument('--scales', type=parse_scales, default='small,medium,large',
+                              help=f'Scales of the suite, any of {",".join(scale.name for scale in default_scales)}')
+    bench_parser.add_argument('--repeats', type=int, default=3, help='Repetitions of every stage of the suite')
+    bench_parser.add_argument('--baseline', type=Path, default=None,
+                              help='Suite results of an earlier run. Exits with an error if a stage got slower')
+    bench_parser.set_defaults(function=bench)
+
+    for subparser in (train_parser, evaluate_parser, export_parser, decode_parser, bench_parser):
+        add_common_arguments(subparser)
+
+    return parser
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    args: argparse.Namespace = get_parser().parse_args(argv)
+
+    if args.command == 'train' and not args.output and not args.cache_dir:
+        get_parser().error('train requires --output or --cache-dir')
+
+    logging.basicConfig(level=args.log_level.upper())
+    seed_everything(args.seed)
+
+    if not args.profile:
+        args.function(args)
+        return
+
+    recorder: Recorder
+    with record_run(trace_memory=args.trace_memory) as recorder:
+        args.function(args)
+    recorder.to_json(args.profile)
+    args.profile.with_suffix('.folded').write_text(recorder.collapsed_stacks())
+    print(recorder.format_summary(), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
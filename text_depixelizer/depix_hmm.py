@@ -1,14 +1,23 @@
+import dataclasses
 import itertools
 import logging
 from pathlib import Path
-from typing import Optional
+from typing import Optional, Tuple, List, Dict
 
 from PIL import ImageFont, Image
 
 from resources.fonts import DemoFontPaths
+from text_depixelizer.HMM.clusterer import BisectingClusterer
 from text_depixelizer.HMM.depix_hmm import DepixHMM
+from text_depixelizer.ensemble import EnsembleDecoder, EnsembleResult
+from text_depixelizer.inference_pipeline.block_grid_detection import BlockGrid, detect_block_grid, align_to_block_grid
+from text_depixelizer.model_registry import ModelRegistry, create_model
 from text_depixelizer.parameters import PictureParameters, TrainingParameters, LoggingParameters, \
     PictureParametersGridSearch, TrainingParametersGridSearch
+from text_depixelizer.search import SearchResult, get_rungs, successive_halving
+from text_depixelizer.training_pipeline.training_data_cache import TrainingDataCache
+from text_depixelizer.training_pipeline.training_pipeline import TrainingData
+from text_depixelizer.training_pipeline.windows import Window
 
 
 def init_logging(logging_parameters: LoggingParameters):
@@ -17,40 +26,175 @@ def init_logging(logging_parameters: LoggingParameters):
     time_logger.setLevel(logging_parameters.timer_log_level)
 
 
+def align_image(img: Image.Image, picture_parameters: PictureParameters) -> Tuple[Image.Image, PictureParameters]:
+    """
+    Detect the block grid of a pixelized image and crop the image to the grid origin.
+    If the block size of the picture parameters is unset, it is inferred as well and a copy of the picture parameters
+    with the detected block size is returned. An image of one color has no grid, it is only decoded as it is if the
+    block size is known
+    """
+    block_sizes: Optional[List[int]] = None if picture_parameters.block_size is None else [picture_parameters.block_size]
+    block_grid: Optional[BlockGrid] = detect_block_grid(img, block_sizes)
+    if block_grid is None:
+        if picture_parameters.block_size is None:
+            raise ValueError('Could not detect a block grid, the image has only one color')
+        logging.warning('Could not detect a block grid, the image has only one color and is not aligned')
+        return img, picture_parameters
+
+    logging.info(f'Detected block size {block_grid.block_size} and grid origin {block_grid.origin} '
+                 f'with confidence {block_grid.confidence:.2f}')
+    if block_grid.confidence < 0.5:
+        logging.warning(f'Low confidence in the detected block grid, check the block size and the crop of the image')
+
+    if picture_parameters.block_size is None:
+        picture_parameters = dataclasses.replace(picture_parameters, block_size=block_grid.block_size)
+
+    return align_to_block_grid(img, block_grid), picture_parameters
+
+
+def load_image(img_path: Optional[Path], picture_parameters: PictureParameters,
+               align: bool = False) -> Tuple[Optional[Image.Image], PictureParameters]:
+    """
+    Load the image to be decoded, if there is one. It is aligned to its block grid if the block size is unset, or if
+    align is set. Otherwise it has to be cropped to the grid already
+    """
+    if img_path is None:
+        if picture_parameters.block_size is None:
+            raise ValueError('The block size can only be inferred if an image is given')
+        return None, picture_parameters
+
+    with Image.open(img_path) as img:
+        img.load()
+        if align or picture_parameters.block_size is None:
+            return align_image(img, picture_parameters)
+        return img, picture_parameters
+
+
 def depix_hmm(picture_parameters: PictureParameters,
               training_parameters: TrainingParameters,
               logging_parameters: LoggingParameters = None,
-              img_path: Path = None) -> Optional[str]:
+              img_path: Path = None,
+              model_registry: ModelRegistry = None,
+              align: bool = False) -> Optional[str]:
+    """
+    Train and evaluate a model and use it to decode the image, if one is given.
+    With a model registry, the model is taken from the registry instead and isn't evaluated again.
+    The image is aligned to its block grid if the block size is unset or align is set
+    """
 
     if logging_parameters:
         init_logging(logging_parameters)
 
-    # Train and evaluate the HMM
-    hmm: DepixHMM = DepixHMM(picture_parameters, training_parameters)
-    hmm.train()
-    accuracy, average_distance = hmm.evaluate()
-    logging.info(f'Accuracy: {accuracy}, Avg. Distance: {average_distance}')
+    # Align the image to its block grid, this also infers an unset block size
+    img, picture_parameters = load_image(img_path, picture_parameters, align)
+
+    if model_registry:
+        hmm: DepixHMM = model_registry.get(picture_parameters, training_parameters)
+    else:
+        # Train and evaluate the HMM
+        hmm = create_model(picture_parameters, training_parameters)
+        hmm.train()
+        accuracy, average_distance = hmm.evaluate()
+        logging.info(f'Accuracy: {accuracy}, Avg. Distance: {average_distance}')
 
     # If a path to an image was given, analyze the image
-    if img_path:
-        with Image.open(img_path) as img:
-            reconstructed_string: str = hmm.test_image(img)
-            return reconstructed_string
+    if img is not None:
+        reconstructed_string: str = hmm.test_image(img)
+        return reconstructed_string
 
     return None
 
 
+def depix_hmm_ensemble(picture_parameters: PictureParameters,
+                       training_parameters: TrainingParameters,
+                       offsets_y: Optional[List[int]] = None,
+                       logging_parameters: LoggingParameters = None,
+                       img_path: Path = None,
+                       model_registry: ModelRegistry = None,
+                       align: bool = False) -> Optional[str]:
+    """
+    Decode an image whose vertical offset is unknown with one model per offset, instead of picking a single model with
+    a grid search over offset_y. By default, all offsets within a block are tried
+    """
+    if logging_parameters:
+        init_logging(logging_parameters)
+
+    img, picture_parameters = load_image(img_path, picture_parameters, align)
+    ensemble: EnsembleDecoder = EnsembleDecoder.from_offsets(
+        picture_parameters, training_parameters, offsets_y, model_registry=model_registry
+    )
+    try:
+        if img is None:
+            return None
+        result: EnsembleResult = ensemble.decode_images([img])[0]
+        if result.model_index >= 0:
+            logging.info(f'Best offset: {ensemble.models[result.model_index].picture_parameters.offset_y}, '
+                         f'log-likelihood: {result.log_likelihood}')
+        return result.text
+    finally:
+        ensemble.close()
+
+
+def get_fields(parameters: object, cls: type) -> Dict[str, object]:
+    """
+    Values of the fields of the dataclass cls, e.g. of the parameters of a grid search that extends it
+    """
+    return {field.name: getattr(parameters, field.name) for field in dataclasses.fields(cls)}
+
+
+def get_grid_cell(picture_parameters_grid_search: PictureParametersGridSearch,
+                  training_parameters_grid_search: TrainingParametersGridSearch,
+                  window_size: int, n_clusters: int, n_img_train: int,
+                  offset_y: int) -> Tuple[PictureParameters, TrainingParameters]:
+    """
+    Parameters of one cell of the grid
+    """
+    picture_parameters: PictureParameters = PictureParameters(**{
+        **get_fields(picture_parameters_grid_search, PictureParameters),
+        'window_size': window_size,
+        'offset_y': offset_y
+    })
+    training_parameters: TrainingParameters = TrainingParameters(**{
+        **get_fields(training_parameters_grid_search, TrainingParameters),
+        'n_img_train': n_img_train,
+        'n_clusters': n_clusters
+    })
+    return picture_parameters, training_parameters
+
+
+def get_cluster_tree(hmm: DepixHMM, training_data: TrainingData, k: int,
+                     cluster_trees: Dict[Tuple[int, int, int], BisectingClusterer],
+                     key: Tuple[int, int, int]) -> BisectingClusterer:
+    """
+    Tree with the largest n_clusters of a grid search, fitted once on the windows of every window size, n_img_train and
+    offset_y. The cells of the other n_clusters cut it, and only estimate their emissions again
+    """
+    if key not in cluster_trees:
+        windows: List[Window] = [window for image_windows in training_data[3] for window in image_windows]
+        cluster_trees[key] = hmm.create_clusterer(windows, k)
+    return cluster_trees[key]
+
+
 def depix_hmm_grid_search(picture_parameters_grid_search: PictureParametersGridSearch,
                           training_parameters_grid_search: TrainingParametersGridSearch,
                           logging_parameters: LoggingParameters = None,
-                          img_path: Path = None) -> Optional[str]:
+                          img_path: Path = None,
+                          align: bool = False) -> Optional[str]:
     if logging_parameters:
         init_logging(logging_parameters)
 
+    img, picture_parameters_grid_search = load_image(img_path, picture_parameters_grid_search, align)
+
     best_hmm: Optional[DepixHMM] = None
     best_accuracy: float = 0.0
     best_avg_distance: float = 1.0
 
+    # Cells that only differ in window size, clusters or training images share the rendered images
+    training_data_cache: TrainingDataCache = TrainingDataCache(training_parameters_grid_search.seed,
+                                                               training_parameters_grid_search.text_generation)
+    # With bisecting clustering, cells that only differ in n_clusters share one tree, see get_cluster_tree
+    cluster_trees: Dict[Tuple[int, int, int], BisectingClusterer] = {}
+
     # Iterate through grid and find best
     for window_size, n_clusters, n_img_train, offset_y in itertools.product(
             *[picture_parameters_grid_search.window_size,
@@ -58,30 +202,30 @@ def depix_hmm_grid_search(picture_parameters_grid_search: PictureParametersGridS
               training_parameters_grid_search.n_img_train,
               picture_parameters_grid_search.offset_y]):
 
-        picture_parameters: PictureParameters = PictureParameters(
-            pattern=picture_parameters_grid_search.pattern,
-            font=picture_parameters_grid_search.font,
-            block_size=picture_parameters_grid_search.block_size,
-            window_size=window_size,
-            offset_y=offset_y
+        picture_parameters, training_parameters = get_grid_cell(
+            picture_parameters_grid_search, training_parameters_grid_search, window_size, n_clusters, n_img_train,
+            offset_y
         )
 
-        training_parameters: TrainingParameters = TrainingParameters(
-            n_img_test=training_parameters_grid_search.n_img_test,
-            n_img_train=n_img_train,
-            n_clusters=n_clusters
-        )
-
-        hmm: DepixHMM = DepixHMM(picture_parameters, training_parameters)
-        hmm.train()
-        accuracy, average_distance = hmm.evaluate()
+        hmm: DepixHMM = create_model(picture_parameters, training_parameters)
+        training_data: TrainingData = training_data_cache.get(picture_parameters, n_img_train)
+        if training_parameters.clustering == 'bisecting' and training_parameters.state_model == 'tuples' \
+                and training_parameters.emission_model == 'clusters':
+            cluster_tree: BisectingClusterer = get_cluster_tree(
+                hmm, training_data, max(training_parameters_grid_search.n_clusters), cluster_trees,
+                (window_size, n_img_train, offset_y)
+            )
+            hmm.train(training_data, cluster_tree.cut(min(n_clusters, cluster_tree.k)))
+        else:
+            hmm.train(training_data)
+        # Cells that can't beat the best accuracy so far stop evaluating early
+        accuracy, average_distance = hmm.evaluate(best_to_beat=best_accuracy if best_hmm else None)
         logging.info(f'Window Size: {window_size}, Clusters: {n_clusters}, Training Images: {n_img_train}, Offset Y: {offset_y}')
         logging.info(f'Accuracy: {accuracy}, Avg. Distance: {average_distance} \n')
 
-        if img_path:
-            with Image.open(img_path) as img:
-                reconstructed_string: str = hmm.test_image(img)
-                logging.warning(f'Reconstructed string: {reconstructed_string}')
+        if img is not None:
+            reconstructed_string: str = hmm.test_image(img)
+            logging.warning(f'Reconstructed string: {reconstructed_string}')
 
         if accuracy > best_accuracy:
             best_hmm = hmm
@@ -96,10 +240,54 @@ def depix_hmm_grid_search(picture_parameters_grid_search: PictureParametersGridS
     logging.warning(f'    Training Images: {best_hmm.training_parameters.n_img_train}')
 
     # If a path to an image was given, analyze the image
-    if img_path:
-        with Image.open(img_path) as img:
-            reconstructed_string: str = best_hmm.test_image(img)
-            return reconstructed_string
+    if img is not None:
+        reconstructed_string: str = best_hmm.test_image(img)
+        return reconstructed_string
+
+    return None
+
+
+def depix_hmm_successive_halving(picture_parameters_grid_search: PictureParametersGridSearch,
+                                 training_parameters_grid_search: TrainingParametersGridSearch,
+                                 logging_parameters: LoggingParameters = None,
+                                 img_path: Path = None,
+                                 eta: int = 3,
+                                 align: bool = False) -> Optional[str]:
+    """
+    Same search space as depix_hmm_grid_search, but instead of training every cell on every n_img_train, all
+    combinations of window_size, n_clusters and offset_y are trained on the fewest training images, and only the best
+    1/eta of them move on to the next larger n_img_train, see successive_halving
+    """
+    if logging_parameters:
+        init_logging(logging_parameters)
+
+    img, picture_parameters_grid_search = load_image(img_path, picture_parameters_grid_search, align)
+
+    candidates: List[Tuple[PictureParameters, TrainingParameters]] = [
+        get_grid_cell(picture_parameters_grid_search, training_parameters_grid_search, window_size, n_clusters,
+                      max(training_parameters_grid_search.n_img_train), offset_y)
+        for window_size, n_clusters, offset_y in itertools.product(picture_parameters_grid_search.window_size,
+                                                                   training_parameters_grid_search.n_clusters,
+                                                                   picture_parameters_grid_search.offset_y)
+    ]
+    rungs: List[int] = get_rungs(training_parameters_grid_search.n_img_train, len(candidates), eta)
+    best_hmm, results = successive_halving(candidates, rungs, eta)
+    if best_hmm is None:
+        return None
+
+    best: SearchResult = max((result for result in results if result.rung == len(rungs) - 1 and result.error is None),
+                             key=lambda result: (result.accuracy, result.average_similarity))
+    logging.warning(f'Found HMM with accuracy {best.accuracy} and average similarity {best.average_similarity} after '
+                    f'training {len(results)} models on {sum(r.training_parameters.n_img_train for r in results)} '
+                    f'images in total')
+    logging.warning(f'Associated parameters: ')
+    logging.warning(f'    Window Size: {best_hmm.picture_parameters.window_size}')
+    logging.warning(f'    Clusters: {best_hmm.training_parameters.n_clusters}')
+    logging.warning(f'    Training Images: {best_hmm.training_parameters.n_img_train}')
+    logging.warning(f'    Offset Y: {best_hmm.picture_parameters.offset_y}')
+
+    if img is not None:
+        return best_hmm.test_image(img)
 
     return None
 
@@ -0,0 +1,125 @@
+import dataclasses
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, Future
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple, Iterable
+
+import numpy as np
+from PIL import Image
+
+from text_depixelizer.HMM.depix_hmm import DepixHMM
+from text_depixelizer.instrumentation import instrumented
+from text_depixelizer.model_registry import ModelRegistry, train_model
+from text_depixelizer.parameters import PictureParameters, TrainingParameters
+
+
+@dataclass
+class EnsembleResult:
+    text: str
+    log_likelihood: float
+    model_index: int  # Model that produced the text, -1 if no model could decode the image
+    candidates: List[Tuple[str, float]] = field(default_factory=list)  # Text and log-likelihood of every model
+
+
+class EnsembleDecoder:
+    """
+    Decodes images with several models, e.g. one per vertical offset of the pixelization grid when the offset of the
+    image is unknown, and picks the result with the highest viterbi log-likelihood.
+    The models decode a batch concurrently in a thread pool, the heavy parts (cluster assignment, viterbi) run in numpy
+    and release the GIL, so decoding takes about as long as with the slowest single model.
+    Models that don't fit an image, e.g. because they expect a different number of block rows, are skipped.
+    With fuse, models that agree on a text pool their likelihoods, instead of only counting the best model.
+    """
+
+    def __init__(self, models: List[DepixHMM], n_workers: Optional[int] = None, fuse: bool = False):
+        self.models = models
+        self.fuse = fuse
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(
+            max_workers=n_workers or max(1, min(len(models), os.cpu_count() or 1))
+        )
+
+    @property
+    def picture_parameters(self) -> PictureParameters:
+        return self.models[0].picture_parameters
+
+    @staticmethod
+    def from_offsets(picture_parameters: PictureParameters,
+                     training_parameters: TrainingParameters,
+                     offsets_y: Optional[Iterable[int]] = None,
+                     model_registry: Optional[ModelRegistry] = None,
+                     n_workers: Optional[int] = None,
+                     fuse: bool = False) -> 'EnsembleDecoder':
+        """
+        One model per vertical offset of the pixelization grid, by default for every offset within a block.
+        The models are trained concurrently, or taken from the model registry
+        """
+        if offsets_y is None:
+            offsets_y = range(picture_parameters.block_size)
+        parameters: List[PictureParameters] = [
+            dataclasses.replace(picture_parameters, offset_y=offset_y) for offset_y in offsets_y
+        ]
+
+        def build(pp: PictureParameters) -> DepixHMM:
+            if model_registry:
+                return model_registry.get(pp, training_parameters)
+            return train_model(pp, training_parameters)
+
+        with ThreadPoolExecutor(max_workers=n_workers or min(len(parameters), os.cpu_count() or 1)) as executor:
+            models: List[DepixHMM] = list(executor.map(build, parameters))
+        return EnsembleDecoder(models, n_workers=n_workers, fuse=fuse)
+
+    def test_image(self, img: Image) -> str:
+        return self.test_images([img])[0]
+
+    def test_images(self, imgs: List[Image]) -> List[str]:
+        return [result.text for result in self.decode_images(imgs)]
+
+    def score_images(self, imgs: List[Image]) -> Tuple[List[str], np.ndarray]:
+        """
+        Same interface as DepixHMM.score_images, so an ensemble can be used wherever a single model is
+        """
+        results: List[EnsembleResult] = self.decode_images(imgs)
+        return [result.text for result in results], np.array([result.log_likelihood for result in results])
+
+    @instrumented('ensemble.decode')
+    def decode_images(self, imgs: List[Image]) -> List[EnsembleResult]:
+        futures: List[Future] = [self.executor.submit(model.score_images, imgs) for model in self.models]
+
+        # scores[m, i]: log-likelihood of model m for image i
+        texts: List[List[str]] = []
+        scores: np.ndarray = np.full((len(self.models), len(imgs)), -np.inf)
+        for model_index, future in enumerate(futures):
+            try:
+                model_texts, scores[model_index] = future.result()
+            except ValueError as e:
+                logging.debug(f'Model {model_index} of the ensemble can not decode the images: {e}')
+                model_texts = [''] * len(imgs)
+            texts.append(model_texts)
+
+        return [self.combine([texts[m][i] for m in range(len(self.models))], scores[:, i]) for i in range(len(imgs))]
+
+    def combine(self, texts: List[str], scores: np.ndarray) -> EnsembleResult:
+        """
+        Pick the text of the most likely model. With fuse, the likelihoods of all models that decoded the same text
+        are added up first
+        """
+        candidates: List[Tuple[str, float]] = [(text, float(score)) for text, score in zip(texts, scores)]
+        if not np.isfinite(scores).any():
+            return EnsembleResult(text='', log_likelihood=-np.inf, model_index=-1, candidates=candidates)
+
+        if not self.fuse:
+            best: int = int(np.argmax(scores))
+            return EnsembleResult(texts[best], float(scores[best]), best, candidates)
+
+        unique_texts: List[str] = list(dict.fromkeys(text for text, score in candidates if np.isfinite(score)))
+        pooled: np.ndarray = np.array([
+            np.logaddexp.reduce([score for text, score in candidates if text == unique_text])
+            for unique_text in unique_texts
+        ])
+        best_text: str = unique_texts[int(np.argmax(pooled))]
+        best = max((m for m, text in enumerate(texts) if text == best_text), key=lambda m: scores[m])
+        return EnsembleResult(best_text, float(pooled.max()), best, candidates)
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,83 @@
+from dataclasses import dataclass
+from typing import Tuple, Optional, Iterable, List
+
+import numpy as np
+from PIL import Image
+
+
+@dataclass
+class BlockGrid:
+    block_size: int
+    origin: Tuple[int, int]
+    confidence: float
+
+
+def pack_colors(pixels: np.ndarray) -> np.ndarray:
+    """
+    Pack the RGB channels of an image array into one integer per pixel, so colors can be compared in one operation
+    """
+    pixels = pixels.astype(np.int32)
+    return (pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]
+
+
+def get_change_profiles(pixels: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Count the color changes between neighboring columns and rows of an image.
+    Entry i of a profile counts the changes between column (row) i-1 and i, so it is the number of pixels for which a
+    new block would start at position i
+    """
+    packed_pixels: np.ndarray = pack_colors(pixels)
+    changes_x: np.ndarray = np.count_nonzero(packed_pixels[:, 1:] != packed_pixels[:, :-1], axis=0)
+    changes_y: np.ndarray = np.count_nonzero(packed_pixels[1:, :] != packed_pixels[:-1, :], axis=1)
+    return np.concatenate([[0], changes_x]), np.concatenate([[0], changes_y])
+
+
+def score_block_size(profile: np.ndarray, block_size: int) -> Tuple[int, float]:
+    """
+    Find the grid phase that explains the most color changes of a profile for the given block size.
+    Returns the phase and the number of changes that lie on the grid lines
+    """
+    changes_per_phase: np.ndarray = np.bincount(
+        np.arange(len(profile)) % block_size, weights=profile, minlength=block_size
+    )
+    phase: int = int(np.argmax(changes_per_phase))
+    return phase, changes_per_phase[phase]
+
+
+def detect_block_grid(img: Image,
+                      block_sizes: Optional[Iterable[int]] = None,
+                      tolerance: float = 0.1) -> Optional[BlockGrid]:
+    """
+    Infer the block size and the grid origin of a pixelized image from the positions of its color changes.
+    Inside a pixelized area, the color only changes on the grid lines. For every candidate block size, the share of
+    changes on the best grid that exceeds what a random grid would catch (1/block_size) is used as its score.
+    Divisors of the true block size catch the same changes, so the largest block size within tolerance of the best
+    score is chosen. The score of the chosen grid is returned as confidence, between 0 (no grid) and 1 (every color
+    change lies on the grid). Returns None if the image has no color changes at all
+    """
+    profile_x, profile_y = get_change_profiles(np.asarray(img.convert('RGB')))
+    n_changes: int = profile_x.sum() + profile_y.sum()
+    if n_changes == 0:
+        return None
+
+    if block_sizes is None:
+        block_sizes = range(2, max(3, min(img.size) // 2 + 1))
+
+    grids: List[BlockGrid] = []
+    for block_size in block_sizes:
+        phase_x, on_grid_x = score_block_size(profile_x, block_size)
+        phase_y, on_grid_y = score_block_size(profile_y, block_size)
+        share_on_grid: float = (on_grid_x + on_grid_y) / n_changes
+        score: float = (share_on_grid - 1/block_size) / (1 - 1/block_size)
+        grids.append(BlockGrid(block_size=block_size, origin=(phase_x, phase_y), confidence=max(0.0, float(score))))
+
+    best_score: float = max(grid.confidence for grid in grids)
+    candidates: List[BlockGrid] = [grid for grid in grids if grid.confidence >= best_score * (1 - tolerance)]
+    return max(candidates, key=lambda grid: grid.block_size)
+
+
+def align_to_block_grid(img: Image, block_grid: BlockGrid) -> Image:
+    """
+    Crop an image, so that its top-left corner is the origin of the block grid
+    """
+    return img.crop((block_grid.origin[0], block_grid.origin[1], img.size[0], img.size[1]))
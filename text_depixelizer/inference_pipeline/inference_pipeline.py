@@ -0,0 +1,123 @@
+import logging
+import time
+from dataclasses import dataclass
+from typing import List, Tuple, Optional
+
+import numpy as np
+from PIL import Image
+
+from text_depixelizer.HMM.depix_hmm import DepixHMM
+from text_depixelizer.inference_pipeline.block_grid_detection import pack_colors
+from text_depixelizer.inference_pipeline.region_detection import PixelizedRegion, detect_pixelized_regions, \
+    split_into_lines, get_most_common_color
+from text_depixelizer.instrumentation import span
+from text_depixelizer.parameters import PictureParameters
+from text_depixelizer.training_pipeline.pixelized_image import determine_number_of_tiles
+
+
+@dataclass
+class DecodedLine:
+    region: PixelizedRegion
+    text: str
+    log_likelihood: float
+
+
+def get_rows_per_line(picture_parameters: PictureParameters) -> int:
+    """
+    Number of block rows that one line of text covers in the training data of a model with these parameters
+    """
+    block_size: int = picture_parameters.block_size
+    _, n_rows = determine_number_of_tiles(
+        text_width=0,
+        font_metrics=picture_parameters.font.getmetrics(),
+        offset=(0, picture_parameters.offset_y % block_size),
+        block_size=block_size
+    )
+    return n_rows
+
+
+def get_line_candidates(line: PixelizedRegion, rows_per_line: int, min_columns: int) -> List[PixelizedRegion]:
+    """
+    The detected blocks of a line don't include the background colored block rows above and below the text,
+    but the model was trained on crops that do. Returns all vertical placements of a crop with rows_per_line rows that
+    contain the detected line (or are contained in it, if the line is higher than expected)
+    """
+    n_rows: int = line.n_tiles[1]
+    first_row: int = -max(0, rows_per_line - n_rows)
+    last_row: int = max(0, n_rows - rows_per_line)
+    n_columns: int = max(line.n_tiles[0], min_columns)
+
+    return [
+        PixelizedRegion(
+            n_tiles=(n_columns, rows_per_line),
+            block_size=line.block_size,
+            origin=(line.origin[0], line.origin[1] + row*line.block_size),
+            block_mask=np.zeros((rows_per_line, n_columns), dtype=bool)
+        )
+        for row in range(first_row, last_row + 1)
+    ]
+
+
+def crop_region(img: Image, region: PixelizedRegion, background_color: Tuple[int, int, int]) -> Image:
+    """
+    Crop a region out of the image. Parts of the region outside of the image are filled with the background color
+    """
+    left, top, right, bottom = region.box
+    crop: Image = Image.new('RGB', (right - left, bottom - top), background_color)
+    visible: Tuple[int, int, int, int] = (max(left, 0), max(top, 0), min(right, img.size[0]), min(bottom, img.size[1]))
+    if visible[0] < visible[2] and visible[1] < visible[3]:
+        crop.paste(img.crop(visible), (visible[0] - left, visible[1] - top))
+    return crop
+
+
+def decode_screenshots(hmm: DepixHMM,
+                       imgs: List[Image],
+                       background_color: Optional[Tuple[int, int, int]] = None) -> List[List[DecodedLine]]:
+    """
+    Find all pixelized lines of text in full screenshots and decode them with a trained model.
+    The crops of all screenshots are decoded in a single batch, for every line the vertical placement with the highest
+    viterbi log-likelihood is kept. Returns the decoded lines of each screenshot from top to bottom
+    """
+    time_logger: logging.Logger = logging.getLogger('time_logger')
+    t: float = time.perf_counter()
+
+    block_size: int = hmm.picture_parameters.block_size
+    rows_per_line: int = get_rows_per_line(hmm.picture_parameters)
+
+    crops: List[Image] = []
+    candidates: List[PixelizedRegion] = []
+    candidate_owners: List[Tuple[int, int]] = []
+    n_lines: List[int] = []
+
+    for image_index, img in enumerate(imgs):
+        img = img.convert('RGB')
+        image_background_color: Tuple[int, int, int] = background_color
+        if image_background_color is None:
+            packed_color: int = get_most_common_color(pack_colors(np.asarray(img)))
+            image_background_color = ((packed_color >> 16) & 255, (packed_color >> 8) & 255, packed_color & 255)
+
+        with span('detect_regions'):
+            regions: List[PixelizedRegion] = detect_pixelized_regions(img, block_size, image_background_color)
+        lines: List[PixelizedRegion] = [line for region in regions for line in split_into_lines(region, rows_per_line)]
+        n_lines.append(len(lines))
+
+        for line_index, line in enumerate(lines):
+            for candidate in get_line_candidates(line, rows_per_line, hmm.picture_parameters.window_size):
+                crops.append(crop_region(img, candidate, image_background_color))
+                candidates.append(candidate)
+                candidate_owners.append((image_index, line_index))
+
+    time_logger.info(f'Detected {sum(n_lines)} lines in {len(imgs)} images in {time.perf_counter() - t} seconds')
+
+    texts, scores = hmm.score_images(crops) if crops else ([], np.empty(0))
+
+    # Keep the best vertical placement of every line
+    decoded_lines: List[List[Optional[DecodedLine]]] = [[None]*n for n in n_lines]
+    for (image_index, line_index), candidate, text, score in zip(candidate_owners, candidates, texts, scores):
+        best: Optional[DecodedLine] = decoded_lines[image_index][line_index]
+        if best is None or score > best.log_likelihood:
+            decoded_lines[image_index][line_index] = DecodedLine(region=candidate, text=text, log_likelihood=float(score))
+
+    time_logger.info(f'Decoded {len(imgs)} images in {time.perf_counter() - t} seconds')
+
+    return decoded_lines
@@ -0,0 +1,189 @@
+from collections import deque
+from dataclasses import dataclass
+from typing import List, Tuple, Optional, Set
+
+import numpy as np
+from PIL import Image
+
+from text_depixelizer.inference_pipeline.block_grid_detection import BlockGrid, detect_block_grid, pack_colors
+
+
+@dataclass
+class PixelizedRegion:
+    n_tiles: Tuple[int, int]
+    block_size: int
+    origin: Tuple[int, int]
+    block_mask: np.ndarray
+
+    @property
+    def box(self) -> Tuple[int, int, int, int]:
+        """
+        Pixel coordinates (left, top, right, bottom) of the region, right and bottom being exclusive
+        """
+        return (self.origin[0],
+                self.origin[1],
+                self.origin[0] + self.n_tiles[0]*self.block_size,
+                self.origin[1] + self.n_tiles[1]*self.block_size)
+
+
+def get_most_common_color(packed_pixels: np.ndarray) -> int:
+    """
+    Estimate the background color as the most common color of the (sub-sampled) image
+    """
+    colors, counts = np.unique(packed_pixels[::2, ::2], return_counts=True)
+    return int(colors[np.argmax(counts)])
+
+
+def box_sums(values: np.ndarray, box_shape: Tuple[int, int]) -> np.ndarray:
+    """
+    Sum of values inside every box of the given shape, indexed by the top-left corner of the box
+    """
+    h, w = box_shape
+    integral: np.ndarray = np.pad(values.astype(np.int32).cumsum(axis=0).cumsum(axis=1), ((1, 0), (1, 0)))
+    return integral[h:, w:] - integral[:-h, w:] - integral[h:, :-w] + integral[:-h, :-w]
+
+
+def find_block_seeds(packed_pixels: np.ndarray, block_size: int, background_color: int) -> np.ndarray:
+    """
+    Find the top-left corners of squares with edge length block_size that look like a pixelization block:
+    The square has one constant color different from the background and the color changes exactly at its left or
+    right edge as well as at its top or bottom edge.
+    Returns a boolean array of shape (height - block_size + 1, width - block_size + 1)
+    """
+    height, width = packed_pixels.shape
+
+    change_x: np.ndarray = packed_pixels[:, 1:] != packed_pixels[:, :-1]
+    change_y: np.ndarray = packed_pixels[1:, :] != packed_pixels[:-1, :]
+
+    constant: np.ndarray = \
+        (box_sums(change_x, (block_size, block_size - 1)) == 0) & \
+        (box_sums(change_y, (block_size - 1, block_size)) == 0)
+
+    # The image border counts as an edge
+    edges_x: np.ndarray = np.pad(change_x, ((0, 0), (1, 1)), constant_values=True)
+    edges_y: np.ndarray = np.pad(change_y, ((1, 1), (0, 0)), constant_values=True)
+    n_y, n_x = height - block_size + 1, width - block_size + 1
+
+    left_or_right: np.ndarray = edges_x[:n_y, :n_x] | edges_x[:n_y, block_size:block_size + n_x]
+    top_or_bottom: np.ndarray = edges_y[:n_y, :n_x] | edges_y[block_size:block_size + n_y, :n_x]
+    not_background: np.ndarray = packed_pixels[:n_y, :n_x] != background_color
+
+    return constant & left_or_right & top_or_bottom & not_background
+
+
+def group_blocks(blocks: Set[Tuple[int, int]], gap: Tuple[int, int]) -> List[Set[Tuple[int, int]]]:
+    """
+    Group blocks given as (row, column) into connected components. Blocks that are at most gap=(rows, columns)
+    apart are connected, so that the background colored blocks between characters don't split a line
+    """
+    components: List[Set[Tuple[int, int]]] = []
+    unvisited: Set[Tuple[int, int]] = set(blocks)
+
+    while unvisited:
+        start: Tuple[int, int] = unvisited.pop()
+        component: Set[Tuple[int, int]] = {start}
+        queue: deque = deque([start])
+        while queue:
+            row, column = queue.popleft()
+            for d_row in range(-gap[0], gap[0] + 1):
+                for d_column in range(-gap[1], gap[1] + 1):
+                    neighbor: Tuple[int, int] = (row + d_row, column + d_column)
+                    if neighbor in unvisited:
+                        unvisited.remove(neighbor)
+                        component.add(neighbor)
+                        queue.append(neighbor)
+        components.append(component)
+
+    return components
+
+
+def detect_pixelized_regions(img: Image,
+                             block_size: Optional[int] = None,
+                             background_color: Optional[Tuple[int, int, int]] = None,
+                             min_blocks: int = 4,
+                             gap: Tuple[int, int] = (1, 3)) -> List[PixelizedRegion]:
+    """
+    Detect the pixelized areas of a screenshot together with their block grid.
+    Every detected region is the bounding box of a group of pixelization blocks that share the same grid origin.
+    Regions with less than min_blocks non-background blocks are discarded.
+    If no block size is given, it is inferred from the whole image
+    """
+    if block_size is None:
+        block_grid: Optional[BlockGrid] = detect_block_grid(img)
+        if block_grid is None:
+            return []
+        block_size = block_grid.block_size
+
+    packed_pixels: np.ndarray = pack_colors(np.asarray(img.convert('RGB')))
+    if block_size < 2 or min(packed_pixels.shape) < block_size:
+        return []
+
+    if background_color is None:
+        packed_background_color: int = get_most_common_color(packed_pixels)
+    else:
+        packed_background_color = int(pack_colors(np.array(background_color)))
+
+    seeds_y, seeds_x = np.nonzero(find_block_seeds(packed_pixels, block_size, packed_background_color))
+
+    # Blocks of one pixelized area share the grid origin, i.e. the position modulo block_size
+    regions: List[PixelizedRegion] = []
+    phases: np.ndarray = np.stack([seeds_y % block_size, seeds_x % block_size], axis=1)
+    for phase_y, phase_x in np.unique(phases, axis=0):
+        in_phase: np.ndarray = (phases[:, 0] == phase_y) & (phases[:, 1] == phase_x)
+        if np.count_nonzero(in_phase) < min_blocks:
+            continue
+
+        blocks: Set[Tuple[int, int]] = set(zip(
+            ((seeds_y[in_phase] - phase_y) // block_size).tolist(),
+            ((seeds_x[in_phase] - phase_x) // block_size).tolist()
+        ))
+
+        for component in group_blocks(blocks, gap):
+            if len(component) < min_blocks:
+                continue
+            rows, columns = np.array(list(component)).T
+            block_mask: np.ndarray = np.zeros((rows.max() - rows.min() + 1, columns.max() - columns.min() + 1), dtype=bool)
+            block_mask[rows - rows.min(), columns - columns.min()] = True
+
+            regions.append(PixelizedRegion(
+                n_tiles=(block_mask.shape[1], block_mask.shape[0]),
+                block_size=block_size,
+                origin=(int(phase_x + columns.min()*block_size), int(phase_y + rows.min()*block_size)),
+                block_mask=block_mask
+            ))
+
+    return sorted(regions, key=lambda region: (region.origin[1], region.origin[0]))
+
+
+def split_into_lines(region: PixelizedRegion, rows_per_line: int) -> List[PixelizedRegion]:
+    """
+    Split a region into lines of text. Lines are separated by block rows without any non-background block,
+    bands of rows that are higher than rows_per_line are split evenly into several lines.
+    The columns of every line are trimmed to its non-background blocks
+    """
+    occupied_rows: np.ndarray = region.block_mask.any(axis=1)
+    padded: np.ndarray = np.concatenate([[False], occupied_rows, [False]]).astype(int)
+    band_starts: np.ndarray = np.flatnonzero(np.diff(padded) == 1)
+    band_ends: np.ndarray = np.flatnonzero(np.diff(padded) == -1)
+
+    lines: List[PixelizedRegion] = []
+    for band_start, band_end in zip(band_starts, band_ends):
+        n_lines: int = max(1, round((band_end - band_start) / rows_per_line))
+        bounds: np.ndarray = np.linspace(band_start, band_end, n_lines + 1).round().astype(int)
+
+        for line_start, line_end in zip(bounds[:-1], bounds[1:]):
+            line_mask: np.ndarray = region.block_mask[line_start:line_end]
+            occupied_columns: np.ndarray = np.flatnonzero(line_mask.any(axis=0))
+            if len(occupied_columns) == 0:
+                continue
+            first_column, last_column = occupied_columns[0], occupied_columns[-1]
+
+            lines.append(PixelizedRegion(
+                n_tiles=(int(last_column - first_column + 1), int(line_end - line_start)),
+                block_size=region.block_size,
+                origin=(int(region.origin[0] + first_column*region.block_size),
+                        int(region.origin[1] + line_start*region.block_size)),
+                block_mask=line_mask[:, first_column:last_column + 1]
+            ))
+
+    return lines
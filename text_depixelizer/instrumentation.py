@@ -0,0 +1,253 @@
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+from dataclasses import dataclass, asdict
+from pathlib import Path
+from typing import List, Optional, Dict, Tuple, Iterator, Callable
+
+try:
+    import resource
+except ImportError:
+    # Only available on Unix, the peak RSS is reported as 0 elsewhere
+    resource = None
+
+
+@dataclass
+class SpanRecord:
+    path: Tuple[str, ...]
+    start: float
+    wall_time: float
+    cpu_time: float
+    n_items: int
+    peak_rss: int
+    peak_traced_memory: Optional[int] = None
+
+
+@dataclass
+class StageSummary:
+    path: Tuple[str, ...]
+    calls: int = 0
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    n_items: int = 0
+    peak_rss: int = 0
+    peak_traced_memory: Optional[int] = None
+
+
+class Span:
+    """
+    A running stage. Item counts that are only known inside the span can be added with add_items
+    """
+
+    def __init__(self, recorder: 'Recorder', name: str, n_items: int):
+        self.recorder = recorder
+        self.name = name
+        self.n_items = n_items
+        self.peak_traced_memory: int = 0
+
+    def add_items(self, n_items: int) -> None:
+        self.n_items += n_items
+
+    def __enter__(self) -> 'Span':
+        stack: List[Span] = self.recorder.stack
+        if self.recorder.trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            if stack:
+                stack[-1].peak_traced_memory = max(stack[-1].peak_traced_memory, peak)
+            # Python 3.9+, before that the peaks of a span include the ones of the spans before it
+            if hasattr(tracemalloc, 'reset_peak'):
+                tracemalloc.reset_peak()
+        stack.append(self)
+        self._path: Tuple[str, ...] = tuple(span.name for span in stack)
+        self._wall_start: float = time.perf_counter()
+        self._cpu_start: float = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        wall_time: float = time.perf_counter() - self._wall_start
+        cpu_time: float = time.process_time() - self._cpu_start
+
+        stack: List[Span] = self.recorder.stack
+        stack.pop()
+        peak_traced_memory: Optional[int] = None
+        if self.recorder.trace_memory:
+            peak_traced_memory = max(self.peak_traced_memory, tracemalloc.get_traced_memory()[1])
+            if stack:
+                stack[-1].peak_traced_memory = max(stack[-1].peak_traced_memory, peak_traced_memory)
+
+        self.recorder.records.append(SpanRecord(
+            path=self._path,
+            start=self._wall_start,
+            wall_time=wall_time,
+            cpu_time=cpu_time,
+            n_items=self.n_items,
+            peak_rss=get_peak_rss(),
+            peak_traced_memory=peak_traced_memory
+        ))
+
+
+class NullSpan:
+    """
+    Returned while instrumentation is off, so instrumented code costs a function call and nothing else
+    """
+
+    def add_items(self, n_items: int) -> None:
+        pass
+
+    def __enter__(self) -> 'NullSpan':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+_null_span: NullSpan = NullSpan()
+_recorder: Optional['Recorder'] = None
+
+
+class Recorder:
+    """
+    Collects the spans of one run. Spans are nested per thread, spans of worker threads become roots of their own
+    """
+
+    def __init__(self, trace_memory: bool = False):
+        self.trace_memory = trace_memory
+        self.records: List[SpanRecord] = []
+        self._local: threading.local = threading.local()
+
+    @property
+    def stack(self) -> List[Span]:
+        if not hasattr(self._local, 'stack'):
+            self._local.stack = []
+        return self._local.stack
+
+    def summarize(self) -> List[StageSummary]:
+        """
+        Aggregate the records by their path. Stages are ordered like a tree, nested stages follow their parent and
+        siblings are in the order in which they were first entered
+        """
+        first_start: Dict[Tuple[str, ...], float] = {}
+        summaries: Dict[Tuple[str, ...], StageSummary] = {}
+        for record in self.records:
+            first_start[record.path] = min(first_start.get(record.path, record.start), record.start)
+            summary: StageSummary = summaries.setdefault(record.path, StageSummary(path=record.path))
+            summary.calls += 1
+            summary.wall_time += record.wall_time
+            summary.cpu_time += record.cpu_time
+            summary.n_items += record.n_items
+            summary.peak_rss = max(summary.peak_rss, record.peak_rss)
+            if record.peak_traced_memory is not None:
+                summary.peak_traced_memory = max(summary.peak_traced_memory or 0, record.peak_traced_memory)
+        return sorted(
+            summaries.values(),
+            key=lambda s: [first_start.get(s.path[:depth], 0.0) for depth in range(1, len(s.path) + 1)]
+        )
+
+    def to_dict(self) -> Dict[str, list]:
+        return {
+            'stages': [{**asdict(summary), 'path': '/'.join(summary.path)} for summary in self.summarize()]
+        }
+
+    def to_json(self, path: Path) -> None:
+        Path(path).write_text(json.dumps(self.to_dict(), indent=2))
+
+    def collapsed_stacks(self) -> str:
+        """
+        Self time of every stage in microseconds, one 'parent;child value' line per stage.
+        This is the input format of flamegraph.pl and speedscope
+        """
+        summaries: List[StageSummary] = self.summarize()
+        lines: List[str] = []
+        for summary in summaries:
+            children_time: float = sum(
+                child.wall_time for child in summaries
+                if len(child.path) == len(summary.path) + 1 and child.path[:-1] == summary.path
+            )
+            self_time: int = round(max(0.0, summary.wall_time - children_time) * 1e6)
+            lines.append(f'{";".join(summary.path)} {self_time}')
+        return '\n'.join(lines)
+
+    def format_summary(self, width: int = 30) -> str:
+        """
+        Indented tree of the stages with a bar for the share of the total wall time
+        """
+        summaries: List[StageSummary] = self.summarize()
+        total: float = sum(summary.wall_time for summary in summaries if len(summary.path) == 1) or 1.0
+
+        lines: List[str] = [f'{"stage":<40} {"wall [s]":>9} {"cpu [s]":>9} {"items":>8} {"peak rss":>9}']
+        for summary in summaries:
+            name: str = '  ' * (len(summary.path) - 1) + summary.path[-1]
+            bar: str = '#' * round(width * summary.wall_time / total)
+            lines.append(
+                f'{name:<40} {summary.wall_time:>9.3f} {summary.cpu_time:>9.3f} {summary.n_items:>8} '
+                f'{format_bytes(summary.peak_rss):>9} {bar}'
+            )
+        return '\n'.join(lines)
+
+
+def get_peak_rss() -> int:
+    """
+    Peak resident set size of the process in bytes, 0 where it can't be measured (Windows)
+    """
+    if resource is None:
+        return 0
+    peak_rss: int = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss if sys.platform == 'darwin' else peak_rss * 1024
+
+
+def format_bytes(n_bytes: int) -> str:
+    for unit in ('B', 'KB', 'MB'):
+        if n_bytes < 1024:
+            return f'{n_bytes:.0f}{unit}'
+        n_bytes /= 1024
+    return f'{n_bytes:.1f}GB'
+
+
+def span(name: str, n_items: int = 0):
+    """
+    Time a stage of the pipeline, e.g.
+        with span('kmeans.fit', n_items=len(windows)):
+            ...
+    Does nothing unless a recording was started with record_run
+    """
+    if _recorder is None:
+        return _null_span
+    return Span(_recorder, name, n_items)
+
+
+def instrumented(name: str) -> Callable[[Callable], Callable]:
+    """
+    Decorator that runs the whole function in a span
+    """
+    def decorator(function: Callable) -> Callable:
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def record_run(trace_memory: bool = False) -> Iterator[Recorder]:
+    """
+    Record all spans inside this context. Tracing memory allocations is precise but slows python code down noticeably
+    """
+    global _recorder
+    previous: Optional[Recorder] = _recorder
+    recorder: Recorder = Recorder(trace_memory=trace_memory)
+
+    started_tracing: bool = trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _recorder = recorder
+    try:
+        yield recorder
+    finally:
+        _recorder = previous
+        if started_tracing:
+            tracemalloc.stop()
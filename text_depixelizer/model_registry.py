@@ -0,0 +1,166 @@
+import dataclasses
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Dict, Optional, Any
+
+import numpy as np
+from PIL.ImageFont import FreeTypeFont
+
+from text_depixelizer.HMM.depix_hmm import DepixHMM
+from text_depixelizer.HMM.factorized_hmm import FactorizedDepixHMM
+from text_depixelizer.HMM.template_decoder import TemplateDecoder
+from text_depixelizer.parameters import PictureParameters, TrainingParameters
+
+
+def get_model_key(picture_parameters: PictureParameters, training_parameters: TrainingParameters) -> str:
+    """
+    Identity of the model that is trained with the given parameters.
+    Fonts are identified by their name, style and size instead of the path of the font file
+    """
+    identity: Dict[str, Any] = {}
+    for parameters in (picture_parameters, training_parameters):
+        for field in dataclasses.fields(parameters):
+            value: Any = getattr(parameters, field.name)
+            if isinstance(value, FreeTypeFont):
+                value = (*value.getname(), value.size, value.index)
+            identity[f'{type(parameters).__name__}.{field.name}'] = value
+
+    return hashlib.sha1(repr(sorted(identity.items())).encode()).hexdigest()[:16]
+
+
+def estimate_model_size(model: DepixHMM) -> int:
+    """
+    Estimate the memory footprint of a model in bytes from its numpy arrays.
+    The log-probability tables are counted even if they were not computed yet, since decoding will create them
+    """
+    def nbytes(obj: Any) -> int:
+        return sum(value.nbytes for value in vars(obj).values() if isinstance(value, np.ndarray))
+
+    size: int = nbytes(model)
+    for name in ('starting_probabilities', 'transition_probabilities', 'emission_probabilities'):
+        # The transition matrix is stored privately, or not at all if the model stores its sparse transitions
+        value: Any = vars(model).get(name, vars(model).get(f'_{name}'))
+        if f'log_{name}' not in vars(model) and isinstance(value, np.ndarray):
+            size += value.nbytes
+
+    sparse_transitions: Any = getattr(model, 'sparse_transitions', None)
+    if sparse_transitions is not None:
+        size += nbytes(sparse_transitions)
+
+    clusterer: Any = getattr(model, 'clusterer', None)
+    if clusterer is not None:
+        size += nbytes(clusterer)
+        if hasattr(clusterer, 'kmeans'):
+            size += nbytes(clusterer.kmeans)
+
+    gaussian_emissions: Any = getattr(model, 'gaussian_emissions', None)
+    if gaussian_emissions is not None:
+        size += 3 * nbytes(gaussian_emissions)
+
+    return size
+
+
+def create_model(picture_parameters: PictureParameters, training_parameters: TrainingParameters) -> DepixHMM:
+    """
+    Untrained model of the kind selected by TrainingParameters.state_model
+    """
+    state_models: Dict[str, type] = {'tuples': DepixHMM, 'factorized': FactorizedDepixHMM, 'templates': TemplateDecoder}
+    if training_parameters.state_model not in state_models:
+        raise ValueError(f'Unknown state model {training_parameters.state_model}, '
+                         f'expected one of {", ".join(state_models)}')
+    return state_models[training_parameters.state_model](picture_parameters, training_parameters)
+
+
+def train_model(picture_parameters: PictureParameters, training_parameters: TrainingParameters) -> DepixHMM:
+    model: DepixHMM = create_model(picture_parameters, training_parameters)
+    model.train()
+    return model
+
+
+class ModelRegistry:
+    """
+    Keeps trained models for many combinations of parameters.
+    Models are loaded from the cache directory or trained on first use, and the least recently used models are
+    evicted once the resident models exceed the memory budget. Concurrent requests for a model that is not resident
+    yet wait for a single build instead of each training their own.
+    """
+
+    def __init__(self,
+                 memory_budget: int = 2**30,
+                 cache_dir: Optional[Path] = None,
+                 build_model: Callable[[PictureParameters, TrainingParameters], DepixHMM] = train_model):
+        self.memory_budget = memory_budget
+        self.cache_dir = cache_dir
+        self.build_model = build_model
+
+        self._models: 'OrderedDict[str, DepixHMM]' = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._builds: Dict[str, Future] = {}
+        self._lock: threading.Lock = threading.Lock()
+
+    @property
+    def resident_size(self) -> int:
+        return sum(self._sizes.values())
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._models
+
+    def get(self, picture_parameters: PictureParameters, training_parameters: TrainingParameters) -> DepixHMM:
+        key: str = get_model_key(picture_parameters, training_parameters)
+
+        with self._lock:
+            if key in self._models:
+                self._models.move_to_end(key)
+                return self._models[key]
+
+            build: Optional[Future] = self._builds.get(key)
+            is_builder: bool = build is None
+            if is_builder:
+                build = Future()
+                self._builds[key] = build
+
+        if not is_builder:
+            return build.result()
+
+        try:
+            model: DepixHMM = self._load_or_build(key, picture_parameters, training_parameters)
+        except BaseException as e:
+            with self._lock:
+                del self._builds[key]
+            build.set_exception(e)
+            raise
+
+        with self._lock:
+            self._insert(key, model)
+            del self._builds[key]
+        build.set_result(model)
+
+        return model
+
+    def _load_or_build(self, key: str, picture_parameters: PictureParameters,
+                       training_parameters: TrainingParameters) -> DepixHMM:
+        path: Optional[Path] = self.cache_dir / f'{key}.pickle' if self.cache_dir else None
+        if path and path.exists():
+            logging.info(f'Loading model {key} from {path}')
+            return DepixHMM.load(path)
+
+        logging.info(f'Building model {key}')
+        model: DepixHMM = self.build_model(picture_parameters, training_parameters)
+        if path:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            model.save(path)
+        return model
+
+    def _insert(self, key: str, model: DepixHMM) -> None:
+        self._models[key] = model
+        self._sizes[key] = estimate_model_size(model)
+
+        # The newest model always stays resident, even if it exceeds the budget on its own
+        while self.resident_size > self.memory_budget and len(self._models) > 1:
+            evicted_key, _ = self._models.popitem(last=False)
+            del self._sizes[evicted_key]
+            logging.info(f'Evicted model {evicted_key}')
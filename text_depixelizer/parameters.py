@@ -1,6 +1,6 @@
 from dataclasses import dataclass, field
 import logging
-from typing import List, Tuple
+from typing import List, Tuple, Optional
 
 from PIL.ImageFont import FreeTypeFont
 
@@ -11,10 +11,12 @@ class PictureParameters:
     font: FreeTypeFont
     font_color: Tuple[int, int, int] = (0, 0, 0)
     background_color: Tuple[int, int, int] = (255, 255, 255)
-    block_size: int = None # ToDo: can be inferred
+    block_size: int = None  # Inferred from the image to be decoded if unset
     randomize_pixelization_origin_x: bool = False
     window_size: int = 5
     offset_y: int = 0
+    features: str = 'rgb'  # Windows of the 'rgb' values of the blocks, or of their ink 'coverage', which doesn't depend
+                           # on the font and background color
 
 
 @dataclass
@@ -28,6 +30,23 @@ class TrainingParameters:
     n_img_train: int
     n_img_test: int
     n_clusters: int
+    seed: Optional[int] = None  # Makes training and evaluation reproducible if set
+    text_generation: str = 'random'  # 'random' samples the training texts, 'coverage' covers all n-grams evenly
+    smoothing: float = 0.0  # Pseudo count added to every starting state, transition and emission
+    smoothing_backoff: bool = False  # Spread the transition pseudo counts like the transitions of similar states
+    pruning_threshold: float = 0.0  # Less likely transitions are dropped
+    state_model: str = 'tuples'  # 'tuples' of the characters in a window, 'factorized' into character and offset, or
+                                 # 'templates' of every character for monospaced fonts
+    emission_model: str = 'clusters'  # Emit the k-means 'clusters' of the windows, or their values from a 'gaussian'
+    clustering: str = 'kmeans'  # 'kmeans', or a 'bisecting' tree of 2-means splits, that can be cut at any n_clusters
+    precision: str = 'float64'  # Type of the centroids, probability tables and viterbi scores, 'float32' halves them
+    evaluation_tolerance: float = 0.0  # Stop evaluating once the 95% confidence intervals of accuracy and average
+                                       # similarity are within +- tolerance. 0 always decodes all n_img_test images
+    evaluation_chunk_size: int = 100  # Test images that are generated and decoded at once when evaluating in chunks
+    saturation_threshold: float = 0.0  # If set, n_img_train is a maximum: training images are generated in
+                                       # increments until one adds fewer new states, transitions and emission pairs
+                                       # than this fraction of the ones seen before, e.g. 0.01
+    saturation_increment: int = 100  # Training images per increment when sizing the training data automatically
 
 
 @dataclass
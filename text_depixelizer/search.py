@@ -0,0 +1,100 @@
+import dataclasses
+import logging
+import math
+from dataclasses import dataclass
+from typing import List, Tuple, Optional
+
+from text_depixelizer.HMM.depix_hmm import DepixHMM
+from text_depixelizer.model_registry import create_model
+from text_depixelizer.parameters import PictureParameters, TrainingParameters
+from text_depixelizer.training_pipeline.training_data_cache import TrainingDataCache
+
+
+@dataclass
+class SearchResult:
+    rung: int
+    picture_parameters: PictureParameters
+    training_parameters: TrainingParameters
+    accuracy: float
+    average_similarity: float
+    error: Optional[str] = None  # Why the model couldn't be trained, e.g. fewer windows than clusters
+
+
+def get_rungs(n_img_train: List[int], n_candidates: int, eta: int = 3) -> List[int]:
+    """
+    Number of training images of every rung of successive halving. With several sizes, these are the rungs.
+    With a single size, it is the last rung, and every rung before has eta times fewer images, until one rung is
+    left per reduction of the candidates by eta
+    """
+    sizes: List[int] = sorted(set(n_img_train))
+    if len(sizes) > 1:
+        return sizes
+
+    n_rungs: int = 1
+    while eta**n_rungs < n_candidates:
+        n_rungs += 1
+    return sorted({max(1, sizes[0] // eta**i) for i in range(n_rungs)})
+
+
+def successive_halving(candidates: List[Tuple[PictureParameters, TrainingParameters]],
+                       rungs: List[int],
+                       eta: int = 3,
+                       training_data_cache: Optional[TrainingDataCache] = None) \
+        -> Tuple[Optional[DepixHMM], List[SearchResult]]:
+    """
+    Train all candidates on the training images of the first rung, keep the best 1/eta of them and train those on the
+    images of the next rung, until the last rung decides on the best model. The models of later rungs reuse the
+    images of earlier ones, and a candidate stops evaluating once it can't make it into the kept fraction.
+    Returns the best model and the results of every candidate at every rung
+    """
+    if not candidates:
+        return None, []
+    if training_data_cache is None:
+        training_parameters: TrainingParameters = candidates[0][1]
+        training_data_cache = TrainingDataCache(training_parameters.seed, training_parameters.text_generation)
+
+    results: List[SearchResult] = []
+    survivors: List[Tuple[PictureParameters, TrainingParameters]] = candidates
+    best_hmm: Optional[DepixHMM] = None
+
+    for rung, n_img_train in enumerate(rungs):
+        is_last_rung: bool = rung == len(rungs) - 1
+        n_keep: int = 1 if is_last_rung else max(1, math.ceil(len(survivors) / eta))
+
+        rung_results: List[Tuple[SearchResult, Optional[DepixHMM]]] = []
+        for picture_parameters, training_parameters in survivors:
+            training_parameters = dataclasses.replace(training_parameters, n_img_train=n_img_train)
+
+            # Once n_keep candidates are evaluated, the others only need to beat the worst of them
+            accuracies: List[float] = sorted((r.accuracy for r, _ in rung_results if r.error is None), reverse=True)
+            best_to_beat: Optional[float] = accuracies[n_keep - 1] if len(accuracies) >= n_keep else None
+
+            hmm: Optional[DepixHMM] = create_model(picture_parameters, training_parameters)
+            try:
+                hmm.train(training_data_cache.get(picture_parameters, n_img_train))
+                accuracy, average_similarity = hmm.evaluate(best_to_beat=best_to_beat)
+                result: SearchResult = SearchResult(rung, picture_parameters, training_parameters, accuracy,
+                                                    average_similarity)
+            except ValueError as e:
+                logging.warning(f'Could not train {picture_parameters} {training_parameters}: {e}')
+                hmm = None
+                result = SearchResult(rung, picture_parameters, training_parameters, 0.0, 0.0, error=str(e))
+
+            logging.info(f'Rung {rung} ({n_img_train} training images): Window Size: {picture_parameters.window_size}, '
+                         f'Clusters: {training_parameters.n_clusters}, Offset Y: {picture_parameters.offset_y}, '
+                         f'Accuracy: {result.accuracy}, Avg. Similarity: {result.average_similarity}')
+            results.append(result)
+            rung_results.append((result, hmm))
+
+        ranked: List[Tuple[SearchResult, Optional[DepixHMM]]] = sorted(
+            [(result, hmm) for result, hmm in rung_results if result.error is None],
+            key=lambda item: (item[0].accuracy, item[0].average_similarity),
+            reverse=True
+        )[:n_keep]
+        if not ranked:
+            logging.error(f'None of the candidates of rung {rung} could be trained')
+            return None, results
+        survivors = [(result.picture_parameters, result.training_parameters) for result, _ in ranked]
+        best_hmm = ranked[0][1]
+
+    return best_hmm, results
@@ -0,0 +1,49 @@
+from typing import Optional, List
+
+import numpy as np
+
+# Independent random streams of a training run, derived from TrainingParameters.seed
+TRAINING_DATA: int = 0
+TEST_DATA: int = 1
+CLUSTERING: int = 2
+
+# Streams of the training data
+TEXTS: int = 0
+PIXELIZATION_ORIGINS: int = 1
+
+
+def get_seed_sequence(seed: Optional[int], stream: int) -> Optional[np.random.SeedSequence]:
+    """
+    Seed sequence of one stream of a run. Without a seed, None is returned and the global random state is used
+    """
+    if seed is None:
+        return None
+    return np.random.SeedSequence(seed, spawn_key=(stream,))
+
+
+def get_child_seed_sequence(seed_sequence: np.random.SeedSequence, key: int) -> np.random.SeedSequence:
+    """
+    Like SeedSequence.spawn, but the child only depends on its key and not on how many children were spawned before
+    """
+    return np.random.SeedSequence(seed_sequence.entropy, spawn_key=(*seed_sequence.spawn_key, key))
+
+
+def get_image_generators(seed_sequence: np.random.SeedSequence, n_img: int, first_image: int = 0) \
+        -> List[np.random.Generator]:
+    """
+    One random generator per image. Image i always gets the same generator, no matter how the images are split into
+    shards for parallel workers
+    """
+    return [
+        np.random.default_rng(get_child_seed_sequence(seed_sequence, i))
+        for i in range(first_image, first_image + n_img)
+    ]
+
+
+def get_random_state(seed_sequence: Optional[np.random.SeedSequence]) -> Optional[int]:
+    """
+    Integer seed for libraries that don't take numpy generators, e.g. the random_state of scikit-learn
+    """
+    if seed_sequence is None:
+        return None
+    return int(seed_sequence.generate_state(1)[0])
@@ -0,0 +1,207 @@
+import asyncio
+import io
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field, asdict
+from typing import Dict, List, Tuple, Set, Optional
+
+from PIL import Image
+
+from text_depixelizer.HMM.depix_hmm import DepixHMM
+from text_depixelizer.model_registry import ModelRegistry
+from text_depixelizer.parameters import PictureParameters, TrainingParameters
+
+
+HTTP_STATUS: Dict[int, str] = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 500: 'Internal Server Error'}
+
+
+@dataclass
+class DecodeResult:
+    text: str
+    log_likelihood: float
+    batch_size: int
+    timings: Dict[str, float] = field(default_factory=dict)
+
+
+@dataclass
+class PendingRequest:
+    img: Image
+    future: asyncio.Future
+    received: float
+
+
+class UnknownModelException(Exception):
+    pass
+
+
+class DecodeService:
+    """
+    Decodes pixelized images with the models of a registry.
+    Requests for the same model that arrive within batch_window seconds are decoded together: cluster assignment and
+    viterbi run once per batch in a worker pool, which amortizes the per-call overhead for small images.
+    """
+
+    def __init__(self,
+                 model_registry: ModelRegistry,
+                 models: Dict[str, Tuple[PictureParameters, TrainingParameters]],
+                 batch_window: float = 0.01,
+                 max_batch_size: int = 64,
+                 n_workers: int = 2):
+        self.model_registry = model_registry
+        self.models = models
+        self.batch_window = batch_window
+        self.max_batch_size = max_batch_size
+        self.executor: ThreadPoolExecutor = ThreadPoolExecutor(max_workers=n_workers)
+
+        self._pending: Dict[str, List[PendingRequest]] = {}
+        self._timers: Dict[str, asyncio.TimerHandle] = {}
+        # The event loop only keeps weak references to tasks
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def decode(self, model_name: str, img: Image) -> DecodeResult:
+        if model_name not in self.models:
+            raise UnknownModelException(f'Unknown model {model_name}')
+
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        request: PendingRequest = PendingRequest(img=img, future=loop.create_future(), received=time.perf_counter())
+
+        pending: List[PendingRequest] = self._pending.setdefault(model_name, [])
+        pending.append(request)
+        if len(pending) == 1:
+            self._timers[model_name] = loop.call_later(self.batch_window, self._flush, model_name)
+        elif len(pending) >= self.max_batch_size:
+            self._flush(model_name)
+
+        return await request.future
+
+    def _flush(self, model_name: str) -> None:
+        timer: Optional[asyncio.TimerHandle] = self._timers.pop(model_name, None)
+        if timer is not None:
+            timer.cancel()
+        # Only images of the same height in blocks can be decoded together
+        block_size: int = self.models[model_name][0].block_size
+        batches: Dict[int, List[PendingRequest]] = {}
+        for request in self._pending.pop(model_name, []):
+            batches.setdefault(request.img.size[1] // block_size, []).append(request)
+        for batch in batches.values():
+            self._start_task(self._decode_batch(model_name, batch))
+
+    def _start_task(self, coroutine) -> None:
+        task: asyncio.Task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _decode_batch(self, model_name: str, batch: List[PendingRequest]) -> None:
+        loop: asyncio.AbstractEventLoop = asyncio.get_running_loop()
+        started: float = time.perf_counter()
+        try:
+            texts, scores = await loop.run_in_executor(
+                self.executor, self._decode_images, model_name, [request.img for request in batch]
+            )
+        except Exception as e:
+            if len(batch) > 1:
+                # Decode the images one by one, so only the requests whose image fails get the error
+                logging.warning(f'Could not decode batch of {len(batch)} images for model {model_name}: {e}, '
+                                f'decoding them one by one')
+                for request in batch:
+                    self._start_task(self._decode_batch(model_name, [request]))
+                return
+            for request in batch:
+                if not request.future.done():
+                    request.future.set_exception(e)
+            return
+
+        finished: float = time.perf_counter()
+        logging.debug(f'Decoded batch of {len(batch)} images for model {model_name} in {finished - started} seconds')
+        for request, text, score in zip(batch, texts, scores):
+            if not request.future.done():
+                request.future.set_result(DecodeResult(
+                    text=text,
+                    log_likelihood=float(score),
+                    batch_size=len(batch),
+                    timings={
+                        'queue': started - request.received,
+                        'decode': finished - started,
+                        'total': finished - request.received
+                    }
+                ))
+
+    def _decode_images(self, model_name: str, imgs: List[Image]) -> Tuple[List[str], List[float]]:
+        hmm: DepixHMM = self.model_registry.get(*self.models[model_name])
+        texts, scores = hmm.score_images(imgs)
+        return texts, list(scores)
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Minimal HTTP/1.1 handler:
+        - GET /models lists the available models
+        - POST /decode/<model_name> with an image as body returns the decoded text and timings as JSON
+        """
+        try:
+            request_line: str = (await reader.readline()).decode('latin-1').strip()
+            headers: Dict[str, str] = {}
+            while True:
+                line: str = (await reader.readline()).decode('latin-1').strip()
+                if not line:
+                    break
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+            body: bytes = await reader.readexactly(int(headers.get('content-length', 0)))
+
+            status, response = await self.handle_request(request_line, body)
+        except Exception as e:
+            logging.exception('Could not handle request')
+            status, response = 500, {'error': str(e)}
+
+        payload: bytes = json.dumps(response).encode()
+        writer.write(
+            f'HTTP/1.1 {status} {HTTP_STATUS.get(status, "")}\r\n'
+            f'Content-Type: application/json\r\n'
+            f'Content-Length: {len(payload)}\r\n'
+            f'Connection: close\r\n\r\n'.encode('latin-1') + payload
+        )
+        await writer.drain()
+        writer.close()
+
+    async def handle_request(self, request_line: str, body: bytes) -> Tuple[int, dict]:
+        method, path, *_ = request_line.split(' ') + ['', '']
+
+        if method == 'GET' and path == '/models':
+            return 200, {'models': sorted(self.models)}
+
+        if method == 'POST' and path.startswith('/decode/'):
+            model_name: str = path[len('/decode/'):]
+            if model_name not in self.models:
+                return 404, {'error': f'Unknown model {model_name}'}
+            try:
+                img: Image = Image.open(io.BytesIO(body))
+                img.load()
+            except Exception:
+                return 400, {'error': 'Body is not a valid image'}
+
+            result: DecodeResult = await self.decode(model_name, img)
+            return 200, asdict(result)
+
+        return 404, {'error': f'Unknown endpoint {method} {path}'}
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8000) -> asyncio.AbstractServer:
+        server: asyncio.AbstractServer = await asyncio.start_server(self.handle_connection, host, port)
+        logging.info(f'Serving on {", ".join(str(socket.getsockname()) for socket in server.sockets)}')
+        return server
+
+    def close(self) -> None:
+        self.executor.shutdown(wait=False)
+
+
+def run_service(service: DecodeService, host: str = '127.0.0.1', port: int = 8000) -> None:
+    async def serve():
+        server: asyncio.AbstractServer = await service.start(host, port)
+        async with server:
+            await server.serve_forever()
+
+    try:
+        asyncio.run(serve())
+    finally:
+        service.close()
@@ -0,0 +1,244 @@
+import json
+import logging
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Tuple, Optional
+
+import numpy as np
+
+from text_depixelizer.HMM.clusterer import CentroidClusterer, get_nearest_centroids
+from text_depixelizer.HMM.depix_hmm import DepixHMM
+from text_depixelizer.HMM.hmm_counts import HMMCounts
+from text_depixelizer.parameters import PictureParameters, TrainingParameters
+from text_depixelizer.seeding import get_seed_sequence, get_random_state, CLUSTERING
+from text_depixelizer.training_pipeline.features import get_ink_percentile
+from text_depixelizer.training_pipeline.training_pipeline import create_seeded_training_data
+from text_depixelizer.training_pipeline.windows import Window
+
+# Windows of k-means++ initialization sampled per cluster
+N_INIT_SAMPLES_PER_CLUSTER: int = 10
+
+
+"""
+Map-reduce training of a DepixHMM. Every shard is one map task per step, that only exchanges files with the others
+through a shared directory, so the tasks can run in processes of one machine or on several machines:
+1. generate_shard: generate the training images of the shard and save their windows
+2. get_partial_sums: for every iteration of Lloyd's algorithm, the sums and counts of the windows of the shard per
+   nearest centroid. reduce_partial_sums merges them into the centroids of the next iteration
+3. count_shard: count starting states, transitions and emissions of the shard. reduce_counts merges them into a model
+train_sharded runs all steps on a process pool
+"""
+
+
+def get_shard_range(n_img: int, n_shards: int, shard: int) -> Tuple[int, int]:
+    """
+    First image and end of the images of a shard, in the seeded series of training images
+    """
+    return shard * n_img // n_shards, (shard + 1) * n_img // n_shards
+
+
+def get_windows_path(shard_dir: Path, shard: int) -> Path:
+    return shard_dir / f'windows-{shard}.npz'
+
+
+def generate_shard(picture_parameters: PictureParameters, training_parameters: TrainingParameters, n_shards: int,
+                   shard: int, shard_dir: Path) -> int:
+    """
+    Generate the training images of a shard and save the values, characters and indices of their windows.
+    Returns the number of windows
+    """
+    first_image, end = get_shard_range(training_parameters.n_img_train, n_shards, shard)
+    _, _, _, windows = create_seeded_training_data(
+        n_img=end - first_image,
+        picture_parameters=picture_parameters,
+        seed=training_parameters.seed,
+        text_generation=training_parameters.text_generation,
+        first_image=first_image
+    )
+    windows_flattened: List[Window] = [window for image_windows in windows for window in image_windows]
+    values: np.ndarray = np.array([window.values for window in windows_flattened])
+    with open(get_windows_path(shard_dir, shard), 'wb') as f:
+        np.savez(
+            f,
+            values=values,
+            window_indices=np.array([window.window_index for window in windows_flattened], dtype=int),
+            characters=np.array(json.dumps([window.characters for window in windows_flattened])),
+            value_counts=np.bincount(values.ravel().astype(int), minlength=256)
+        )
+    return len(windows_flattened)
+
+
+def load_shard(shard_dir: Path, shard: int) -> List[Window]:
+    with np.load(get_windows_path(shard_dir, shard), allow_pickle=False) as data:
+        return [
+            Window(characters=tuple(characters), values=values, window_index=int(window_index))
+            for characters, values, window_index
+            in zip(json.loads(str(data['characters'])), data['values'], data['window_indices'])
+        ]
+
+
+def load_shard_values(shard_dir: Path, shard: int) -> np.ndarray:
+    with np.load(get_windows_path(shard_dir, shard), allow_pickle=False) as data:
+        return data['values']
+
+
+def load_value_counts(shard_dir: Path, shard: int) -> np.ndarray:
+    """
+    Number of window values of the shard with every value from 0 to 255, see DepixHMM.set_ink_percentile
+    """
+    with np.load(get_windows_path(shard_dir, shard), allow_pickle=False) as data:
+        return data['value_counts']
+
+
+def get_shard_values(shard_dir: Path, shard: int, indices: np.ndarray) -> np.ndarray:
+    return load_shard_values(shard_dir, shard)[indices]
+
+
+def get_partial_sums(shard_dir: Path, shard: int, iteration: int) -> Path:
+    """
+    Assign the windows of a shard to the nearest centroids of the iteration, and save the sum of the values and the
+    number of windows per centroid, and the sum of squared distances
+    """
+    centroids: np.ndarray = np.load(shard_dir / f'centroids-{iteration}.npy')
+    values: np.ndarray = load_shard_values(shard_dir, shard).astype(np.float64)
+    k_values: np.ndarray = get_nearest_centroids(values, centroids)
+
+    sums: np.ndarray = np.zeros(centroids.shape, dtype=np.float64)
+    np.add.at(sums, k_values, values)
+    path: Path = shard_dir / f'partial-{iteration}-{shard}.npz'
+    with open(path, 'wb') as f:
+        np.savez(f, sums=sums, counts=np.bincount(k_values, minlength=len(centroids)),
+                 inertia=((values - centroids[k_values])**2).sum())
+    return path
+
+
+def reduce_partial_sums(paths: List[Path], centroids: np.ndarray) -> Tuple[np.ndarray, float]:
+    """
+    Centroids of the next iteration of Lloyd's algorithm from the partial sums of all shards, and the sum of squared
+    distances to the current centroids. Clusters without windows keep their centroid
+    """
+    sums: np.ndarray = np.zeros(centroids.shape, dtype=np.float64)
+    counts: np.ndarray = np.zeros(len(centroids), dtype=int)
+    inertia: float = 0.0
+    for path in paths:
+        with np.load(path, allow_pickle=False) as data:
+            sums += data['sums']
+            counts += data['counts']
+            inertia += float(data['inertia'])
+
+    new_centroids: np.ndarray = centroids.copy()
+    new_centroids[counts > 0] = sums[counts > 0] / counts[counts > 0, np.newaxis]
+    return new_centroids, inertia
+
+
+def count_shard(shard_dir: Path, shard: int, n_clusters: int) -> Path:
+    """
+    Assign the windows of a shard to the final centroids and save their counts
+    """
+    centroids: np.ndarray = np.load(shard_dir / 'centroids.npy')
+    windows: List[Window] = CentroidClusterer(centroids, centroids.dtype).map_windows_to_cluster(
+        load_shard(shard_dir, shard)
+    )
+    path: Path = shard_dir / f'counts-{shard}.npz'
+    DepixHMM.count_windows(windows, n_clusters).save(path)
+    return path
+
+
+def reduce_counts(paths: List[Path], picture_parameters: PictureParameters, training_parameters: TrainingParameters,
+                  centroids: np.ndarray) -> DepixHMM:
+    """
+    Merge the counts of all shards into a model. It is the same model as training on the windows of all shards in one
+    process with the same centroids
+    """
+    hmm: DepixHMM = DepixHMM(picture_parameters, training_parameters)
+    hmm.clusterer = CentroidClusterer(centroids, hmm.dtype)
+    hmm.calculate_hmm_properties_from_counts(HMMCounts.merge([HMMCounts.load(path) for path in paths]))
+    return hmm
+
+
+def get_initial_centroids(executor: Executor, shard_dir: Path, shards: List[int], n_windows: List[int], k: int,
+                          seed: Optional[int]) -> np.ndarray:
+    """
+    k-means++ on a random sample of the windows of all shards, with n_windows windows each
+    """
+    # Imported here, so decoding with a saved model doesn't need to import scikit-learn
+    from sklearn.cluster import kmeans_plusplus
+
+    n_total: int = sum(n_windows)
+    if n_total < k:
+        raise ValueError(f'n_samples={n_total} should be >= n_clusters={k}.')
+    random_state: Optional[int] = get_random_state(get_seed_sequence(seed, CLUSTERING))
+    rng: np.random.Generator = np.random.default_rng(random_state)
+    sample: np.ndarray = np.sort(rng.choice(n_total, size=min(n_total, N_INIT_SAMPLES_PER_CLUSTER * k), replace=False))
+
+    starts: np.ndarray = np.cumsum([0] + n_windows)
+    indices: List[np.ndarray] = [sample[(sample >= starts[i]) & (sample < starts[i + 1])] - starts[i]
+                                 for i in range(len(shards))]
+    values: np.ndarray = np.concatenate(
+        list(executor.map(get_shard_values, [shard_dir] * len(shards), shards, indices))
+    ).astype(np.float64)
+    centroids, _ = kmeans_plusplus(values, k, random_state=random_state)
+    return centroids
+
+
+def train_sharded(picture_parameters: PictureParameters, training_parameters: TrainingParameters, n_shards: int,
+                  shard_dir: Path, n_workers: Optional[int] = None, max_iter: int = 100,
+                  tolerance: float = 1e-4) -> DepixHMM:
+    """
+    Train a model on n_shards shards of the training images, with a pool of n_workers processes that exchange the
+    windows, centroids and counts through files in shard_dir. Lloyd's algorithm stops once an iteration improves the
+    sum of squared distances by less than the relative tolerance.
+    With a seed, the shards are the images that a model trained in one process generates, also with 'coverage' texts
+    (every shard generates the texts of the shards before it again), and the merged counts are its counts. The
+    clusters come from the distributed k-means instead of scikit-learn's
+    """
+    if training_parameters.state_model != 'tuples' or training_parameters.emission_model != 'clusters':
+        raise ValueError('Sharded training needs the tuples state model and cluster emissions')
+    if not 0 < n_shards <= training_parameters.n_img_train:
+        raise ValueError(f'Expected 1 to n_img_train={training_parameters.n_img_train} shards, got {n_shards}')
+    time_logger: logging.Logger = logging.getLogger('time_logger')
+    shard_dir.mkdir(parents=True, exist_ok=True)
+    shards: List[int] = list(range(n_shards))
+
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        t: float = time.perf_counter()
+        n_windows: List[int] = list(executor.map(
+            generate_shard, [picture_parameters] * n_shards, [training_parameters] * n_shards, [n_shards] * n_shards,
+            shards, [shard_dir] * n_shards
+        ))
+        time_logger.info(f'Generated {n_shards} shards with {sum(n_windows)} windows in {time.perf_counter() - t} '
+                         f'seconds')
+
+        # Images narrower than a window have none, a shard of them has nothing to contribute
+        shards = [shard for shard in shards if n_windows[shard] > 0]
+        n_windows = [n_windows[shard] for shard in shards]
+        n_shards = len(shards)
+
+        t = time.perf_counter()
+        centroids: np.ndarray = get_initial_centroids(executor, shard_dir, shards, n_windows,
+                                                      training_parameters.n_clusters, training_parameters.seed)
+        previous_inertia: float = np.inf
+        for iteration in range(max_iter):
+            np.save(shard_dir / f'centroids-{iteration}.npy', centroids)
+            paths: List[Path] = list(executor.map(
+                get_partial_sums, [shard_dir] * n_shards, shards, [iteration] * n_shards
+            ))
+            new_centroids, inertia = reduce_partial_sums(paths, centroids)
+            logging.info(f'Iteration {iteration} of k-means: inertia {inertia}')
+            converged: bool = previous_inertia - inertia <= tolerance * inertia
+            centroids, previous_inertia = new_centroids, inertia
+            if converged:
+                break
+        centroids = centroids.astype(np.dtype(training_parameters.precision))
+        np.save(shard_dir / 'centroids.npy', centroids)
+        time_logger.info(f'Performed distributed clustering in {iteration + 1} iterations in '
+                         f'{time.perf_counter() - t} seconds')
+
+        paths = list(executor.map(count_shard, [shard_dir] * n_shards, shards,
+                                  [training_parameters.n_clusters] * n_shards))
+
+    hmm: DepixHMM = reduce_counts(paths, picture_parameters, training_parameters, centroids)
+    if picture_parameters.features == 'coverage':
+        hmm.ink_percentile = get_ink_percentile(sum(load_value_counts(shard_dir, shard) for shard in shards))
+    return hmm
@@ -0,0 +1,82 @@
+from typing import Tuple, Optional
+
+import numpy as np
+
+Color = Tuple[int, int, int]
+
+# Percentile of the ink coverage of the blocks that are not background, that detect_colors calibrates the font color to
+INK_PERCENTILE: float = 95.0
+
+
+def get_ink_coverage(block_values: np.ndarray, font_color: Color, background_color: Color) -> np.ndarray:
+    """
+    Ink coverage of every block, from its position on the line between the background and the font color: 0 for
+    background, 255 for a block that is covered by the font completely. A block of a rendered text is the mean of its
+    anti-aliased pixels, each of which mixes the two colors, so the coverage doesn't depend on the colors.
+    Returns an array of shape (n_rows, n_columns, 1), uint8 like the block values
+    """
+    background: np.ndarray = np.array(background_color, dtype=float)
+    ink: np.ndarray = np.array(font_color, dtype=float) - background
+    coverage: np.ndarray = (block_values[:, :, :3].astype(float) - background) @ ink / (ink @ ink)
+    return np.round(np.clip(coverage, 0, 1) * 255).astype(np.uint8)[:, :, np.newaxis]
+
+
+def get_ink_percentile(coverage_counts: np.ndarray) -> float:
+    """
+    INK_PERCENTILE percentile of the ink coverage of the blocks that are not background, between 0 and 1, from the
+    number of blocks with every coverage value from 0 to 255. A model with coverage features stores it for its training
+    images, so that detect_colors can calibrate the font color of other images with it
+    """
+    ink_counts: np.ndarray = coverage_counts[1:]
+    if ink_counts.sum() == 0:
+        return 1.0
+    return float(np.searchsorted(np.cumsum(ink_counts), INK_PERCENTILE / 100 * ink_counts.sum()) + 1) / 255
+
+
+def detect_colors(block_values: np.ndarray, ink_percentile: float = 1.0) -> Tuple[Color, Color]:
+    """
+    Font and background color of a pixelized text. The background is the most common block color. All blocks lie on
+    the line from the background to the font color, but hardly any block is covered completely, so the font color is
+    placed where the INK_PERCENTILE percentile of the distances of the blocks from the background has the ink coverage
+    ink_percentile, e.g. that of the training images of a model, see get_ink_percentile
+    """
+    pixels: np.ndarray = block_values[:, :, :3].reshape(-1, 3).astype(int)
+    if len(pixels) == 0:
+        return (0, 0, 0), (255, 255, 255)
+    colors, counts = np.unique(pixels, axis=0, return_counts=True)
+    background: np.ndarray = colors[np.argmax(counts)]
+
+    ink: np.ndarray = pixels[(pixels != background).any(axis=1)] - background
+    if len(ink) == 0:
+        # No ink at all, any other color gives a coverage of 0
+        return tuple(int(c) for c in 255 - background), tuple(int(c) for c in background)
+    direction: np.ndarray = ink.sum(axis=0) / np.linalg.norm(ink.sum(axis=0))
+    distances: np.ndarray = np.sort(ink @ direction)
+    distance: float = distances[int(np.ceil(INK_PERCENTILE / 100 * len(distances))) - 1] / ink_percentile
+    font: np.ndarray = np.clip(np.round(background + distance * direction), 0, 255).astype(int)
+    return tuple(int(c) for c in font), tuple(int(c) for c in background)
+
+
+def get_features(block_values: np.ndarray, features: str, colors: Optional[Tuple[Color, Color]] = None,
+                 ink_percentile: float = 1.0) -> np.ndarray:
+    """
+    Features of the blocks of a pixelized image, that the windows are cut from:
+    - 'rgb': The values of the blocks
+    - 'coverage': The ink coverage of the blocks, given the font and background color, or the colors detected in the
+      blocks with the ink_percentile of a model. A model trained on one color scheme decodes the others
+    """
+    if features == 'rgb':
+        return block_values
+    if features == 'coverage':
+        font_color, background_color = colors or detect_colors(block_values, ink_percentile)
+        return get_ink_coverage(block_values, font_color, background_color)
+    raise ValueError(f'Unknown features {features}, expected rgb or coverage')
+
+
+def get_background_features(features: str, background_color: Color) -> np.ndarray:
+    """
+    Features of a block of background, e.g. to pad the windows at the end of an image
+    """
+    if features == 'coverage':
+        return np.zeros(1, dtype=np.uint8)
+    return np.array(background_color, dtype=np.uint8)
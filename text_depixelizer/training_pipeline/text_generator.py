@@ -1,8 +1,17 @@
+import itertools
 import random
 import string
 from abc import ABC, abstractmethod
+from collections import Counter
+from dataclasses import dataclass
+from typing import List, Dict, Set, Tuple, Optional
 
-import rstr
+import numpy as np
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
 
 
 class TextGenerator(ABC):
@@ -10,21 +19,233 @@ class TextGenerator(ABC):
     def generate_text(self) -> str:
         pass
 
+    def generate_batch(self, n: int) -> List[str]:
+        return [self.generate_text() for _ in range(n)]
+
 
 class RegexTextGenerator(TextGenerator):
 
-    def __init__(self, pattern: str):
+    def __init__(self, pattern: str, random_generator: random.Random = None):
         self.pattern = pattern
+        self.random_generator = random_generator or random
+
+        # Imported here, so decoding with a saved model doesn't need rstr
+        import rstr
+        self.rstr = rstr.Rstr(random_generator) if random_generator else rstr
+
+        try:
+            self.elements: Optional[List[PatternElement]] = parse_pattern(pattern)
+        except ValueError:
+            self.elements = None
 
     def generate_text(self) -> str:
-        return rstr.xeger(self.pattern)
+        return self.rstr.xeger(self.pattern)
+
+    def generate_batch(self, n: int) -> List[str]:
+        """
+        Patterns made of (repeated) character classes are generated in bulk with numpy, others fall back to xeger
+        """
+        if self.elements is None:
+            return super().generate_batch(n)
+        rng: np.random.Generator = np.random.default_rng(self.random_generator.getrandbits(64))
+        return generate_batch_from_elements(self.elements, n, rng)
 
 
 class NumberTextGenerator(TextGenerator):
 
-    def __init__(self, text_length: int):
+    def __init__(self, text_length: int, random_generator: random.Random = None):
         self.text_length = text_length
+        self.random_generator = random_generator or random
 
     def generate_text(self) -> str:
         digits = string.digits
-        return ''.join(random.choice(digits) for i in range(self.text_length))
+        return ''.join(self.random_generator.choice(digits) for i in range(self.text_length))
+
+    def generate_batch(self, n: int) -> List[str]:
+        rng: np.random.Generator = np.random.default_rng(self.random_generator.getrandbits(64))
+        return generate_batch_from_elements([PatternElement(string.digits, self.text_length, self.text_length)], n, rng)
+
+
+def get_code_points(characters: str) -> np.ndarray:
+    return np.frombuffer(characters.encode('utf-32-le'), dtype=np.uint32)
+
+
+def generate_batch_from_elements(elements: List['PatternElement'], n: int, rng: np.random.Generator) -> List[str]:
+    """
+    Draw n texts at once: the repetitions of every element and its characters are drawn as integer arrays and mapped to
+    unicode code points with a lookup table. The code points of each text are then read as one fixed-width string.
+    Like xeger, repetitions are uniform between min_count and max_count, and characters uniform over the alphabet
+    """
+    code_point_blocks: List[np.ndarray] = []
+    present_blocks: List[np.ndarray] = []
+    for element in elements:
+        lookup_table: np.ndarray = get_code_points(element.alphabet)
+        code_point_blocks.append(lookup_table[rng.integers(0, len(lookup_table), size=(n, element.max_count))])
+        counts: np.ndarray = rng.integers(element.min_count, element.max_count + 1, size=n)
+        present_blocks.append(np.arange(element.max_count)[np.newaxis, :] < counts[:, np.newaxis])
+
+    max_length: int = sum(element.max_count for element in elements)
+    if max_length == 0:
+        return [''] * n
+    code_points: np.ndarray = np.concatenate(code_point_blocks, axis=1)
+    present: np.ndarray = np.concatenate(present_blocks, axis=1)
+
+    # Move the characters of unused repetitions to the end of each row and blank them, numpy strips trailing zeros
+    order: np.ndarray = np.argsort(~present, axis=1, kind='stable')
+    code_points = np.where(
+        np.take_along_axis(present, order, axis=1), np.take_along_axis(code_points, order, axis=1), 0
+    ).astype(np.uint32)
+
+    return np.ascontiguousarray(code_points).view(f'<U{max_length}')[:, 0].tolist()
+
+
+@dataclass
+class PatternElement:
+    """
+    A character out of alphabet, repeated between min_count and max_count times
+    """
+    alphabet: str
+    min_count: int = 1
+    max_count: int = 1
+
+
+CATEGORY_ALPHABETS: Dict[str, str] = {
+    'CATEGORY_DIGIT': string.digits,
+    'CATEGORY_NOT_DIGIT': ''.join(c for c in string.printable if c not in string.digits),
+    'CATEGORY_SPACE': string.whitespace,
+    'CATEGORY_NOT_SPACE': ''.join(c for c in string.printable if c not in string.whitespace),
+    'CATEGORY_WORD': string.ascii_letters + string.digits + '_',
+    'CATEGORY_NOT_WORD': ''.join(c for c in string.printable if c not in string.ascii_letters + string.digits + '_')
+}
+
+
+def parse_pattern(pattern: str) -> List[PatternElement]:
+    """
+    Parse a regex into a sequence of (repeated) character classes, e.g. [A-Z]{2}\\d{8,10} becomes
+    [PatternElement('AB...Z', 2, 2), PatternElement('01...9', 8, 10)].
+    Raises a ValueError for patterns whose language can't be described like this, e.g. alternations of words or
+    unbounded repetitions
+    """
+    return parse_subpattern(sre_parse.parse(pattern))
+
+
+def parse_subpattern(subpattern) -> List[PatternElement]:
+    elements: List[PatternElement] = []
+    for opcode, argument in subpattern:
+        name: str = str(opcode)
+        if name in ('MAX_REPEAT', 'MIN_REPEAT'):
+            min_count, max_count, repeated = argument
+            if max_count == sre_parse.MAXREPEAT:
+                raise ValueError('Unbounded repetitions (*, +, {n,}) can not be enumerated')
+            repeated_elements: List[PatternElement] = parse_subpattern(repeated)
+            if len(repeated_elements) == 1 and repeated_elements[0].min_count == repeated_elements[0].max_count == 1:
+                elements.append(PatternElement(repeated_elements[0].alphabet, min_count, max_count))
+            elif min_count == max_count:
+                elements.extend(repeated_elements * min_count)
+            else:
+                raise ValueError('Variable repetitions are only supported for single characters')
+        elif name == 'SUBPATTERN':
+            elements.extend(parse_subpattern(argument[-1]))
+        elif name == 'BRANCH':
+            branches: List[List[PatternElement]] = [parse_subpattern(branch) for branch in argument[1]]
+            if not all(len(branch) == 1 and branch[0].min_count == branch[0].max_count == 1 for branch in branches):
+                raise ValueError('Alternations are only supported between single characters')
+            elements.append(PatternElement(unique_characters(''.join(branch[0].alphabet for branch in branches))))
+        elif name == 'AT':
+            continue
+        else:
+            elements.append(PatternElement(get_alphabet(opcode, argument)))
+    return elements
+
+
+def get_alphabet(opcode, argument) -> str:
+    """
+    Characters that a single character regex item, e.g. a literal or a character class, can match
+    """
+    name: str = str(opcode)
+    if name == 'LITERAL':
+        return chr(argument)
+    if name == 'NOT_LITERAL':
+        return ''.join(c for c in string.printable if c != chr(argument))
+    if name == 'ANY':
+        return ''.join(c for c in string.printable if c != '\n')
+    if name == 'RANGE':
+        return ''.join(chr(c) for c in range(argument[0], argument[1] + 1))
+    if name == 'CATEGORY':
+        return CATEGORY_ALPHABETS[str(argument)]
+    if name == 'IN':
+        negate: bool = any(str(item_opcode) == 'NEGATE' for item_opcode, _ in argument)
+        characters: str = unique_characters(''.join(
+            get_alphabet(item_opcode, item_argument) for item_opcode, item_argument in argument
+            if str(item_opcode) != 'NEGATE'
+        ))
+        return ''.join(c for c in string.printable if c not in characters) if negate else characters
+    raise ValueError(f'Unsupported regex element {name}')
+
+
+def unique_characters(characters: str) -> str:
+    return ''.join(dict.fromkeys(characters))
+
+
+class CoverageTextGenerator(TextGenerator):
+    """
+    Generates texts that cover all character n-grams of a pattern's language with as few texts as possible, instead of
+    sampling them at random. Every n-gram of a text, including the ones that overlap its start or end, counts.
+    The texts are built greedily, each character is chosen to complete an n-gram that wasn't covered yet. Once no new
+    n-gram was found for a full cycle over all text layouts, everything is covered and the coverage starts over, so the
+    n-grams are repeated evenly.
+    Only patterns that parse_pattern understands are supported.
+    """
+    start: str = '\x02'
+    end: str = '\x03'
+
+    def __init__(self, pattern: str, n: int, random_generator: random.Random = None):
+        self.pattern = pattern
+        self.n = n
+        self.random_generator = random_generator or random.Random()
+
+        elements: List[PatternElement] = parse_pattern(pattern)
+        self.layouts: List[List[str]] = [
+            [element.alphabet for element, count in zip(elements, counts) for _ in range(count)]
+            for counts in itertools.product(*[range(e.min_count, e.max_count + 1) for e in elements])
+        ]
+        self.layout_index: int = 0
+        self.covered: Set[str] = set()
+        self.covered_prefixes: Counter = Counter()
+        self.texts_without_new_ngrams: int = 0
+
+    def generate_text(self) -> str:
+        layout: List[str] = self.layouts[self.layout_index]
+        self.layout_index = (self.layout_index + 1) % len(self.layouts)
+
+        context: str = self.start
+        n_new: int = 0
+        for alphabet in layout:
+            # Prefer characters that complete an uncovered n-gram, and then the ones after which the fewest n-grams
+            # are covered already, so the next character is likely to find an uncovered n-gram as well
+            scores: List[Tuple[bool, int]] = [(
+                (context + c)[-self.n:] not in self.covered,
+                -self.covered_prefixes[(context + c)[-self.n + 1:]]
+            ) for c in alphabet]
+            best_score: Tuple[bool, int] = max(scores)
+            character: str = self.random_generator.choice(
+                [c for c, score in zip(alphabet, scores) if score == best_score]
+            )
+            context += character
+            n_new += self.cover(context[-self.n:])
+        n_new += self.cover((context + self.end)[-self.n:])
+
+        self.texts_without_new_ngrams = 0 if n_new else self.texts_without_new_ngrams + 1
+        if self.texts_without_new_ngrams >= len(self.layouts):
+            self.covered.clear()
+            self.covered_prefixes.clear()
+            self.texts_without_new_ngrams = 0
+
+        return context[len(self.start):]
+
+    def cover(self, ngram: str) -> int:
+        if ngram in self.covered:
+            return 0
+        self.covered.add(ngram)
+        self.covered_prefixes[ngram[:-1]] += 1
+        return 1
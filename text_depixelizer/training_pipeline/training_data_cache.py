@@ -0,0 +1,70 @@
+from typing import Optional, Dict, Tuple, List, Any
+
+from text_depixelizer.parameters import PictureParameters
+from text_depixelizer.training_pipeline.original_image import OriginalImage
+from text_depixelizer.training_pipeline.pixelized_image import PixelizedImage
+from text_depixelizer.training_pipeline.text_generator import TextGenerator
+from text_depixelizer.training_pipeline.training_pipeline import TrainingData, create_seeded_images, \
+    generate_block_columns, generate_windows_from_block_columns, create_seeded_text_generator
+from text_depixelizer.training_pipeline.windows import Window, BlockColumns
+
+
+class TrainingDataCache:
+    """
+    Training data that several models of a search share, e.g. models that only differ in the number of clusters or
+    that are trained again on more images. The images of every series are generated once and only extended when a
+    model needs more of them. The blocks of every image are sampled once, and the windows are cut from them once per
+    window size, so a search over window sizes renders the images only once.
+    With a seed, a model gets exactly the images it would have generated itself. The 'coverage' text generator of every
+    series is kept, so later images continue its texts
+    """
+
+    def __init__(self, seed: Optional[int] = None, text_generation: str = 'random'):
+        self.seed = seed
+        self.text_generation = text_generation
+        self.images: Dict[Tuple[Any, ...], Tuple[List[str], List[OriginalImage], List[PixelizedImage]]] = {}
+        self.text_generators: Dict[Tuple[Any, ...], Optional[TextGenerator]] = {}  # Continue 'coverage' series
+        self.block_columns: Dict[Tuple[Tuple[Any, ...], str], List[BlockColumns]] = {}
+        self.windows: Dict[Tuple[Tuple[Any, ...], str, int], List[List[Window]]] = {}
+
+    def get_images_key(self, picture_parameters: PictureParameters) -> Tuple[Any, ...]:
+        """
+        Parameters that the images depend on. The window size only matters for the texts of 'coverage' generation
+        """
+        pp: PictureParameters = picture_parameters
+        return (pp.pattern, *pp.font.getname(), pp.font.size, pp.font_color, pp.background_color, pp.block_size,
+                pp.randomize_pixelization_origin_x, pp.offset_y,
+                pp.window_size if self.text_generation == 'coverage' else None)
+
+    def get(self, picture_parameters: PictureParameters, n_img: int) -> TrainingData:
+        images_key: Tuple[Any, ...] = self.get_images_key(picture_parameters)
+        texts, original_images, pixelized_images = self.images.setdefault(images_key, ([], [], []))
+        features: str = picture_parameters.features
+        block_columns: List[BlockColumns] = self.block_columns.setdefault((images_key, features), [])
+        windows: List[List[Window]] = self.windows.setdefault((images_key, features, picture_parameters.window_size),
+                                                              [])
+
+        if len(texts) < n_img:
+            if images_key not in self.text_generators:
+                self.text_generators[images_key] = create_seeded_text_generator(picture_parameters, self.seed,
+                                                                                self.text_generation)
+            new_texts, new_original_images, new_pixelized_images = create_seeded_images(
+                n_img=n_img - len(texts),
+                picture_parameters=picture_parameters,
+                seed=self.seed,
+                text_generation=self.text_generation,
+                first_image=len(texts),
+                text_generator=self.text_generators[images_key]
+            )
+            texts.extend(new_texts)
+            original_images.extend(new_original_images)
+            pixelized_images.extend(new_pixelized_images)
+
+        if len(block_columns) < n_img:
+            block_columns.extend(generate_block_columns(original_images[len(block_columns):n_img],
+                                                        pixelized_images[len(block_columns):n_img], features))
+        if len(windows) < n_img:
+            windows.extend(generate_windows_from_block_columns(block_columns[len(windows):n_img],
+                                                               picture_parameters.window_size))
+
+        return texts[:n_img], original_images[:n_img], pixelized_images[:n_img], windows[:n_img]
@@ -1,24 +1,68 @@
 import logging
+import math
+import random
 from random import randint
 import time
-from typing import List, Tuple
+from typing import List, Tuple, Optional, Set
 
+import numpy as np
 from PIL.ImageFont import FreeTypeFont
 
+from text_depixelizer.instrumentation import span
 from text_depixelizer.parameters import PictureParameters
+from text_depixelizer.seeding import get_child_seed_sequence, get_image_generators, get_random_state, \
+    get_seed_sequence, TEXTS, PIXELIZATION_ORIGINS, TRAINING_DATA
 from text_depixelizer.training_pipeline.original_image import ImageCreationOptions, OriginalImage, generate_image_from_text
 from text_depixelizer.training_pipeline.pixelized_image import PixelizationOptions, PixelizedImage, pixelize_image
-from text_depixelizer.training_pipeline.windows import WindowOptions, Window, create_windows_from_image
-from text_depixelizer.training_pipeline.text_generator import RegexTextGenerator
+from text_depixelizer.training_pipeline.windows import Window, BlockColumns, create_block_columns
+from text_depixelizer.training_pipeline.text_generator import RegexTextGenerator, TextGenerator, \
+    CoverageTextGenerator, parse_pattern
 
+# Texts, original images, pixelized images and the windows of every pixelized image
+TrainingData = Tuple[List[str], List[OriginalImage], List[PixelizedImage], List[List[Window]]]
 
-def create_training_data(n_img: int, picture_parameters: PictureParameters) \
+
+def create_training_data(n_img: int,
+                         picture_parameters: PictureParameters,
+                         seed_sequence: Optional[np.random.SeedSequence] = None,
+                         first_image: int = 0,
+                         text_generator: Optional[TextGenerator] = None) \
         -> Tuple[List[str], List[OriginalImage], List[PixelizedImage], List[List[Window]]]:
     """
     Generates the data required for training the HMM.
+    With a seed sequence, the images first_image to first_image + n_img of a reproducible series are generated, so
+    parallel workers can each create a part of the same data. Otherwise, the global random state is used.
+    A text generator replaces the random regex texts, it brings its own random state
+    """
+    texts, original_images, pixelized_images = create_images(n_img, picture_parameters, seed_sequence, first_image,
+                                                             text_generator)
+    windows: List[List[Window]] = generate_windows(original_images, pixelized_images, picture_parameters.window_size,
+                                                   picture_parameters.features)
+    return texts, original_images, pixelized_images, windows
+
+
+def create_images(n_img: int,
+                  picture_parameters: PictureParameters,
+                  seed_sequence: Optional[np.random.SeedSequence] = None,
+                  first_image: int = 0,
+                  text_generator: Optional[TextGenerator] = None) \
+        -> Tuple[List[str], List[OriginalImage], List[PixelizedImage]]:
     """
+    Texts, original images and pixelized images of create_training_data, without sampling their windows
+    """
+    text_generators: Optional[List[np.random.Generator]] = None
+    origin_generators: Optional[List[np.random.Generator]] = None
+    if seed_sequence is not None:
+        text_generators = get_image_generators(get_child_seed_sequence(seed_sequence, TEXTS), n_img, first_image)
+        origin_generators = get_image_generators(
+            get_child_seed_sequence(seed_sequence, PIXELIZATION_ORIGINS), n_img, first_image
+        )
 
-    texts: List[str] = generate_texts(n_img, picture_parameters.pattern)
+    if text_generator is None:
+        texts: List[str] = generate_texts(n_img, picture_parameters.pattern, text_generators)
+    else:
+        with span('text_generation', n_items=n_img):
+            texts = text_generator.generate_batch(n_img)
     original_images: List[OriginalImage] = generate_original_images(
         texts=texts,
         font=picture_parameters.font,
@@ -30,22 +74,88 @@ def create_training_data(n_img: int, picture_parameters: PictureParameters) \
         original_images,
         picture_parameters.block_size,
         picture_parameters.randomize_pixelization_origin_x,
-        picture_parameters.offset_y
+        picture_parameters.offset_y,
+        origin_generators
     )
+    return texts, original_images, pixelized_images
+
 
-    windows: List[List[Window]] = generate_windows(original_images, pixelized_images, picture_parameters.window_size)
+def create_seeded_training_data(n_img: int,
+                                picture_parameters: PictureParameters,
+                                seed: Optional[int] = None,
+                                text_generation: str = 'random',
+                                first_image: int = 0,
+                                text_generator: Optional[TextGenerator] = None) -> TrainingData:
+    """
+    Training data of a model with the given seed and text generation: the images first_image to first_image + n_img
+    of its series, so a model trained on more images can reuse the data of a model trained on fewer.
+    Every 'coverage' text depends on all texts before it. A text generator of create_seeded_text_generator that
+    already generated the texts of the first first_image images continues the series, e.g. the one of an earlier call.
+    Without one, the texts of the first images are generated again and dropped
+    """
+    texts, original_images, pixelized_images = create_seeded_images(n_img, picture_parameters, seed,
+                                                                    text_generation, first_image, text_generator)
+    windows: List[List[Window]] = generate_windows(original_images, pixelized_images, picture_parameters.window_size,
+                                                   picture_parameters.features)
     return texts, original_images, pixelized_images, windows
 
 
-def generate_texts(n_img: int, pattern: str) -> List[str]:
+def create_seeded_images(n_img: int,
+                         picture_parameters: PictureParameters,
+                         seed: Optional[int] = None,
+                         text_generation: str = 'random',
+                         first_image: int = 0,
+                         text_generator: Optional[TextGenerator] = None) \
+        -> Tuple[List[str], List[OriginalImage], List[PixelizedImage]]:
+    """
+    Texts, original images and pixelized images of create_seeded_training_data, without sampling their windows
+    """
+    if text_generator is None:
+        text_generator = create_seeded_text_generator(picture_parameters, seed, text_generation)
+        if text_generator is not None and first_image > 0:
+            text_generator.generate_batch(first_image)
+
+    return create_images(
+        n_img=n_img,
+        picture_parameters=picture_parameters,
+        seed_sequence=get_seed_sequence(seed, TRAINING_DATA),
+        first_image=first_image,
+        text_generator=text_generator
+    )
+
+
+def create_seeded_text_generator(picture_parameters: PictureParameters, seed: Optional[int] = None,
+                                 text_generation: str = 'random') -> Optional[TextGenerator]:
+    """
+    Text generator of the series of training images of create_seeded_training_data, at its first image.
+    None for random texts, which are drawn per image
+    """
+    seed_sequence: Optional[np.random.SeedSequence] = get_seed_sequence(seed, TRAINING_DATA)
+    text_seed_sequence: Optional[np.random.SeedSequence] = None
+    if seed_sequence is not None:
+        text_seed_sequence = get_child_seed_sequence(seed_sequence, TEXTS)
+    return create_text_generator(picture_parameters, text_generation, text_seed_sequence)
+
+
+def generate_texts(n_img: int, pattern: str, generators: Optional[List[np.random.Generator]] = None) -> List[str]:
     """
-    Generates n_img strings that follow the given regex pattern
+    Generates n_img strings that follow the given regex pattern.
+    If a random generator per image is given, the text of every image is drawn from its own generator
     """
 
     time_logger: logging.Logger = logging.getLogger('time_logger')
     t: float = time.perf_counter()
-    text_generator: RegexTextGenerator = RegexTextGenerator(pattern=pattern)
-    texts: List[str] = [text_generator.generate_text() for _ in range(n_img)]
+    with span('text_generation', n_items=n_img):
+        if generators is None:
+            text_generator: RegexTextGenerator = RegexTextGenerator(pattern=pattern)
+            texts: List[str] = text_generator.generate_batch(n_img)
+        else:
+            random_generator: random.Random = random.Random()
+            text_generator = RegexTextGenerator(pattern=pattern, random_generator=random_generator)
+            texts = []
+            for generator in generators:
+                random_generator.seed(int(generator.integers(2**63)))
+                texts.append(text_generator.generate_text())
 
     if n_img > 100:
         time_logger.info(f'Created texts in {time.perf_counter() - t} seconds')
@@ -53,6 +163,34 @@ def generate_texts(n_img: int, pattern: str) -> List[str]:
     return texts
 
 
+def get_coverage_ngram_length(picture_parameters: PictureParameters) -> int:
+    """
+    Length of the n-grams that a CoverageTextGenerator needs to cover, so that every pair of consecutive windows
+    (a transition of the HMM) is seen: the most characters that two consecutive windows can overlap
+    """
+    alphabet: Set[str] = {c for element in parse_pattern(picture_parameters.pattern) for c in element.alphabet}
+    widths: List[int] = [picture_parameters.font.getsize(c)[0] for c in alphabet]
+    min_width: int = min([width for width in widths if width > 0], default=1)
+    transition_width: int = (picture_parameters.window_size + 1) * picture_parameters.block_size
+    return math.ceil(transition_width / min_width) + 1
+
+
+def create_text_generator(picture_parameters: PictureParameters, text_generation: str,
+                          seed_sequence: Optional[np.random.SeedSequence] = None) -> Optional[TextGenerator]:
+    """
+    Text generator for the training data. None means random texts that follow the pattern
+    """
+    if text_generation == 'random':
+        return None
+    if text_generation == 'coverage':
+        return CoverageTextGenerator(
+            pattern=picture_parameters.pattern,
+            n=get_coverage_ngram_length(picture_parameters),
+            random_generator=random.Random(get_random_state(seed_sequence))
+        )
+    raise ValueError(f'Unknown text generation {text_generation}, expected random or coverage')
+
+
 def generate_original_images(
         texts: List[str],
         font: FreeTypeFont,
@@ -73,7 +211,8 @@ def generate_original_images(
         background_color=background_color
     )
 
-    original_images: List[OriginalImage] = [generate_image_from_text(text, image_creation_options) for text in texts]
+    with span('render', n_items=len(texts)):
+        original_images: List[OriginalImage] = [generate_image_from_text(text, image_creation_options) for text in texts]
 
     if len(texts) > 100:
         time_logger.info(f'Created original images in {time.perf_counter() - t} seconds')
@@ -84,24 +223,29 @@ def generate_original_images(
 def generate_pixelized_images(original_images: List[OriginalImage],
                               block_size: int,
                               randomize_pixelization_origin_x: bool,
-                              pixelization_offset_y: int) -> List[PixelizedImage]:
+                              pixelization_offset_y: int,
+                              generators: Optional[List[np.random.Generator]] = None) -> List[PixelizedImage]:
     """
     Pixelizes the original images with the given block_size.
     By default, the pixelization is in line with the baseline of the text and the right edge of the bounding box. This
-    can be varied with the other two parameters
+    can be varied with the other two parameters. The random origins are drawn from one generator per image, if given
     """
     time_logger: logging.Logger = logging.getLogger('time_logger')
     t = time.perf_counter()
 
-    pixelization_options: List[PixelizationOptions] = [PixelizationOptions(
-        block_size,
-        offset=(
-            randint(0, block_size) if randomize_pixelization_origin_x else 0,
-            pixelization_offset_y
-        )
-    ) for _ in range(len(original_images))]
+    if not randomize_pixelization_origin_x:
+        offsets_x: List[int] = [0] * len(original_images)
+    elif generators is None:
+        offsets_x = [randint(0, block_size) for _ in range(len(original_images))]
+    else:
+        offsets_x = [int(generator.integers(0, block_size + 1)) for generator in generators]
 
-    pixelized_images: List[PixelizedImage] = [pixelize_image(original_image, pix_o) for original_image, pix_o in zip(original_images, pixelization_options)]
+    pixelization_options: List[PixelizationOptions] = [
+        PixelizationOptions(block_size, offset=(offset_x, pixelization_offset_y)) for offset_x in offsets_x
+    ]
+
+    with span('pixelize', n_items=len(original_images)):
+        pixelized_images: List[PixelizedImage] = [pixelize_image(original_image, pix_o) for original_image, pix_o in zip(original_images, pixelization_options)]
 
     if len(original_images) > 100:
         time_logger.info(f'Pixelated images in {time.perf_counter() - t} seconds')
@@ -109,21 +253,35 @@ def generate_pixelized_images(original_images: List[OriginalImage],
     return pixelized_images
 
 
-def generate_windows(original_images: List[OriginalImage], pixelized_images: List[PixelizedImage], window_size: int) -> List[List[Window]]:
+def generate_windows(original_images: List[OriginalImage], pixelized_images: List[PixelizedImage], window_size: int,
+                     features: str = 'rgb') -> List[List[Window]]:
     """
     Generates the windows from the pixelized images.
     Note: The information from the original images is also needed, since we need to infer the characters that are in this window
     """
+    return generate_windows_from_block_columns(generate_block_columns(original_images, pixelized_images, features),
+                                               window_size)
+
+
+def generate_block_columns(original_images: List[OriginalImage], pixelized_images: List[PixelizedImage],
+                           features: str = 'rgb') -> List[BlockColumns]:
+    """
+    Sample the blocks of the pixelized images and find the block columns of every character, once for all window sizes
+    """
+    with span('block_columns', n_items=len(original_images)):
+        return [
+            create_block_columns(original_image, pixelized_image, features)
+            for original_image, pixelized_image in zip(original_images, pixelized_images)
+        ]
+
+
+def generate_windows_from_block_columns(block_columns: List[BlockColumns], window_size: int) -> List[List[Window]]:
     time_logger: logging.Logger = logging.getLogger('time_logger')
     t = time.perf_counter()
 
-    window_options: WindowOptions = WindowOptions(window_size=window_size, character_threshold=0)
-    windows: List[List[Window]] = [
-        create_windows_from_image(original_image, pixelized_image, window_options)
-        for original_image, pixelized_image
-        in zip(original_images, pixelized_images)
-    ]
-    if len(original_images) > 100:
+    with span('windows', n_items=len(block_columns)):
+        windows: List[List[Window]] = [columns.get_windows(window_size) for columns in block_columns]
+    if len(block_columns) > 100:
         time_logger.info(f'Created windows in {time.perf_counter() - t} seconds')
 
     return windows
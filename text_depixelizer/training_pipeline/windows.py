@@ -3,6 +3,7 @@ from typing import Tuple, Optional, List
 
 import numpy as np
 
+from text_depixelizer.training_pipeline.features import get_features
 from text_depixelizer.training_pipeline.original_image import OriginalImage
 from text_depixelizer.training_pipeline.pixelized_image import PixelizedImage
 
@@ -59,3 +60,85 @@ def create_windows_from_image(original_image: OriginalImage, pixelized_image: Pi
         windows.append(window)
 
     return windows
+
+
+@dataclass
+class BlockColumns:
+    """
+    Features of a pixelized image that the windows of every window size are cut from: the sampled value of every
+    block, and the block columns that every character covers. A window of window_size columns starting at column i
+    contains a character if the columns i to i + window_size - 1 overlap its first_columns to last_columns
+    """
+    values: np.ndarray  # (n_rows, n_columns, n_channels), see get_block_values
+    characters: Tuple[str, ...]
+    first_columns: np.ndarray
+    last_columns: np.ndarray
+
+    def get_windows(self, window_size: int) -> List[Window]:
+        """
+        Same windows as create_windows_from_image with a character threshold of 0. The values of all windows are
+        one matrix of a strided view of the blocks
+        """
+        window_values: np.ndarray = get_window_values(self.values, window_size)
+        window_indices: np.ndarray = np.arange(len(window_values))[:, np.newaxis]
+        contains_character: np.ndarray = (self.first_columns <= window_indices + window_size - 1) & \
+            (self.last_columns >= window_indices)
+
+        return [
+            Window(tuple(self.characters[j] for j in np.flatnonzero(contains_character[i])), window_values[i], i)
+            for i in range(len(window_values))
+        ]
+
+
+def create_block_columns(original_image: OriginalImage, pixelized_image: PixelizedImage,
+                         features: str = 'rgb') -> BlockColumns:
+    """
+    The values are the features of the blocks, given the colors the image was rendered with, see get_features.
+    A window [left, right - 1] overlaps a character [cbb.left, cbb.right] if left < cbb.right and
+    cbb.left + 1 < right, see create_windows_from_image. So a character covers the columns from the one of pixel
+    cbb.left + 1 to the one of pixel cbb.right - 1, and nothing if it is empty
+    """
+    block_size: int = pixelized_image.block_size
+    origin_x: int = pixelized_image.origin[0]
+    boxes: list = [cbb for cbb in original_image.character_bounding_boxes if cbb.left < cbb.right]
+    lefts: np.ndarray = np.array([cbb.left for cbb in boxes], dtype=int)
+    rights: np.ndarray = np.array([cbb.right for cbb in boxes], dtype=int)
+
+    options = original_image.image_creation_options
+    block_values: np.ndarray = get_block_values(np.asarray(pixelized_image.image), pixelized_image.origin,
+                                                pixelized_image.n_tiles, block_size)
+
+    return BlockColumns(
+        values=np.ascontiguousarray(get_features(block_values, features,
+                                                 (options.font_color, options.background_color))),
+        characters=tuple(cbb.char for cbb in boxes),
+        first_columns=(lefts + 1 - origin_x) // block_size,
+        last_columns=-((origin_x - rights) // block_size) - 1
+    )
+
+
+def get_block_values(pixels: np.ndarray, origin: Tuple[int, int], n_tiles: Tuple[int, int], block_size: int) -> np.ndarray:
+    """
+    Sample one pixel (the top-left one) of every block of a pixelized area.
+    Returns an array of shape (n_tiles_y, n_tiles_x, n_channels)
+    """
+    return pixels[
+        origin[1]:origin[1] + n_tiles[1]*block_size:block_size,
+        origin[0]:origin[0] + n_tiles[0]*block_size:block_size,
+        :
+    ]
+
+
+def get_window_values(block_values: np.ndarray, window_size: int) -> np.ndarray:
+    """
+    Cut the sampled blocks of a pixelized area into windows of window_size block columns.
+    Each row of the result holds the flattened values of one window, in the same order as Window.values
+    """
+    n_rows, n_columns, n_channels = block_values.shape
+    n_windows: int = n_columns - window_size + 1
+    if n_windows <= 0:
+        return np.empty((0, n_rows*window_size*n_channels), dtype=block_values.dtype)
+
+    # (n_rows, n_windows, n_channels, window_size) -> (n_windows, n_rows, window_size, n_channels)
+    windows: np.ndarray = np.lib.stride_tricks.sliding_window_view(block_values, window_size, axis=1)
+    return windows.transpose(1, 0, 3, 2).reshape(n_windows, -1)